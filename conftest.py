@@ -0,0 +1,24 @@
+import atexit
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+from os import path
+
+# The modules import each other as scripts.<folder>.<module>, as if the repository is checked out in a folder named
+# scripts. A link named scripts to the repository is put on the path, so the tests run from any checkout folder, also
+# in spawned worker processes, which get the same path.
+if "scripts" not in sys.modules:
+    repo_dir = path.dirname(path.abspath(__file__))
+    link_dir = tempfile.mkdtemp(prefix="scripts_link_")
+    atexit.register(shutil.rmtree, link_dir, True)
+    try:
+        os.symlink(repo_dir, path.join(link_dir, "scripts"), target_is_directory=True)
+        sys.path.insert(0, link_dir)
+    except OSError:
+        # Creating links can need extra rights on Windows, then only this process can import the package
+        spec = importlib.util.spec_from_loader("scripts", loader=None, is_package=True)
+        scripts = importlib.util.module_from_spec(spec)
+        scripts.__path__ = [repo_dir]
+        sys.modules["scripts"] = scripts
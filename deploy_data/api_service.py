@@ -1,15 +1,65 @@
+import math
+import re
+
 import requests
-from typing import List
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
 from requests import Response
+from requests.adapters import HTTPAdapter
 
+from scripts.deploy_data.instrumentation import Tracer
 from scripts.deploy_data.layer import Layer
 
 
+@dataclass
+class LayerUploadResult:
+    """The outcome of adding a single layer to the database."""
+    layer_name: str
+    success: bool
+    id: Optional[int] = None
+    error: str = ""
+
+
+@dataclass
+class SyncResult:
+    """The changes that were sent to make the rows of a workspace match the metadata."""
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    failed: List[str] = field(default_factory=list)  # The names of the layers that could not be synced
+
+    @property
+    def success(self) -> bool:
+        return not self.failed
+
+
 class ApiService:
-    def __init__(self, api_url: str, api_token: str):
+    def __init__(self, api_url: str, api_token: str, batch_size: int = 100, pool_size: int = 10,
+                 tracer: Optional[Tracer] = None, session: Optional[requests.Session] = None):
+        """
+        All requests share one session, so connections to the API are reused instead of opening a new TCP/TLS
+        connection per request. Deploys to the same API can pass the same session, see create_session().
+        The batch_size is the number of layers that are sent per bulk request.
+        """
         self.api_url = api_url
         self.api_token = api_token
+        self.batch_size = batch_size
+        self.session = session or create_session(api_token, pool_size)
+        self.supports_batches = True
+        self.tracer = tracer or Tracer()
+
+    def request(self, operation: str, method: str, url: str, layer_name: Optional[str] = None,
+                **kwargs) -> Response:
+        """Send a request over the shared session and record it as a span of the trace."""
+        with self.tracer.span(operation, layer=layer_name) as span:
+            r = self.session.request(method, url, **kwargs)
+            span.bytes_sent = len(r.request.body or b"")
+            if r.status_code >= 400:
+                span.outcome = "error"
+                span.error = f"Status code {r.status_code}"
+            return r
 
     def check_status(self):
         """
@@ -19,7 +69,7 @@ class ApiService:
         If it succeeds, the API is running and connected to the database.
         """
         try:
-            r = requests.get(url=self.api_url)
+            r = self.request("api.check_status", "get", self.api_url)
             print(f"API is running, is connected to the database and returned {r}")
         except Exception:
             raise RuntimeError("API is not running or is not connected to the database properly")
@@ -32,8 +82,7 @@ class ApiService:
         """
         print("Migrating database...")
         try:
-            headers = {'Authorization': self.api_token}
-            response: Response = requests.post(self.api_url + "/database-migration", headers=headers)
+            response: Response = self.request("api.migrate_database", "post", self.api_url + "/database-migration")
             if response.status_code != 200:
                 raise ApiException(f"The database migration was not successful. Server returned: {response.text}")
         except Exception as ex:
@@ -46,32 +95,250 @@ class ApiService:
         """Delete all layers from the database that are in the given workspace."""
         print(f"Deleting all layers from workspace {workspace}")
 
-        r = requests.delete(url=self.api_url + "/layers",
-                            json={"workspace": workspace},
-                            headers={"Authorization": self.api_token})
+        r = self.request("api.delete_layers", "delete", self.api_url + "/layers", json={"workspace": workspace})
 
         rows_count = r.json()["rowCount"]
 
         print(f"Deleted {rows_count} rows")
 
-    def add_layers(self, layers: List[Layer]) -> None:
-        """Add the given layers to the database."""
-        print(f"Adding {len(layers)} to the database")
+    def sync_layers(self, workspace: str, layers: List[Layer]) -> SyncResult:
+        """
+        Make the rows of the workspace match the given layers with as few writes as possible.
+        The current rows are compared field by field with the layers: new layers are inserted in batches, changed
+        rows are updated in place, so they keep their id, and rows of layers that are gone are deleted.
+        When the API cannot list, update or delete single rows, all rows of the workspace are replaced instead.
+        """
+        rows = self.get_layers(workspace)
+        if rows is None:
+            return self.replace_layers(workspace, layers, "listing layers")
+
+        rows_by_name: Dict[str, dict] = {}
+        duplicate_rows = []
+        # The rows of other workspaces are never touched, even if the API ignores the workspace parameter
+        for row in (row for row in rows if row.get("workspace") == workspace):
+            if row["name"] in rows_by_name:
+                duplicate_rows.append(row)
+            else:
+                rows_by_name[row["name"]] = row
 
+        result = SyncResult()
+        inserts = []
         for layer in layers:
-            self.add_layer(layer)
+            row = rows_by_name.pop(layer.name, None)
+            if row is None:
+                inserts.append(layer)
+            elif self.row_differs(row, layer):
+                updated = self.update_layer(row["id"], layer)
+                if updated is None:
+                    return self.replace_layers(workspace, layers, "updating layers")
+                if updated:
+                    result.updated += 1
+                else:
+                    result.failed.append(layer.name)
+            else:
+                result.unchanged += 1
 
-        print("Finished adding layers to the database")
+        for row in list(rows_by_name.values()) + duplicate_rows:
+            deleted = self.delete_layer(row["id"], row["name"])
+            if deleted is None:
+                return self.replace_layers(workspace, layers, "deleting layers")
+            if deleted:
+                result.deleted += 1
+            else:
+                result.failed.append(row["name"])
 
-    def add_layer(self, layer: Layer) -> None:
+        if inserts:
+            insert_results = self.add_layers(inserts)
+            result.inserted = sum(insert_result.success for insert_result in insert_results)
+            result.failed += [insert_result.layer_name for insert_result in insert_results if not insert_result.success]
+
+        print(f"Synced workspace {workspace}: {result.inserted} inserted, {result.updated} updated, "
+              f"{result.deleted} deleted, {result.unchanged} unchanged, {len(result.failed)} failed")
+        return result
+
+    def replace_layers(self, workspace: str, layers: List[Layer], operation: str) -> SyncResult:
+        """Delete all rows of the workspace and add the layers again, for APIs that cannot sync single rows."""
+        print(f"Degraded mode: the API does not support {operation}, so all rows of {workspace} are "
+              f"deleted and added again. The layers are missing from the atlas until they are added.")
+        self.delete_layers(workspace)
+        results = self.add_layers(layers)
+        return SyncResult(inserted=sum(result.success for result in results),
+                          failed=[result.layer_name for result in results if not result.success])
+
+    def get_layers(self, workspace: str) -> Optional[List[dict]]:
+        """Return the rows of the layers in the workspace, or None if the API does not support listing them."""
+        r = self.request("api.get_layers", "get", self.api_url + "/layers", params={"workspace": workspace})
+
+        if r.status_code in (404, 405):
+            return None
+        if r.status_code != 200:
+            raise ApiException(f"Listing the layers of {workspace} was not successful. Server returned: {r.text}")
+        return r.json()
+
+    def update_layer(self, layer_id: int, layer: Layer) -> Optional[bool]:
+        """Update the row in place. Returns None if the API does not support updating single rows."""
+        r = self.request("api.update_layer", "put", f"{self.api_url}/layer/{layer_id}", layer_name=layer.name,
+                         json=self.layer_payload(layer))
+        if r.status_code in (404, 405):
+            return None
+        if r.status_code not in (200, 204):
+            print(f"Failed to update layer {layer.name}: {r.status_code}: {r.text}")
+            return False
+        return True
+
+    def delete_layer(self, layer_id: int, layer_name: str) -> Optional[bool]:
+        """Delete the row. Returns None if the API does not support deleting single rows."""
+        r = self.request("api.delete_layer", "delete", f"{self.api_url}/layer/{layer_id}", layer_name=layer_name)
+        if r.status_code in (404, 405):
+            return None
+        if r.status_code not in (200, 204):
+            print(f"Failed to delete layer {layer_name}: {r.status_code}: {r.text}")
+            return False
+        return True
+
+    def row_differs(self, row: dict, layer: Layer) -> bool:
+        """
+        Compare the fields of the layer with the row. The database returns typed values, such as booleans, numbers
+        and timestamps, for the strings that are sent to the API, so both sides are normalized first.
+        """
+        for key, value in self.layer_payload(layer).items():
+            if normalize_value(row.get(key)) != normalize_value(value):
+                return True
+        return False
+
+    def swap_workspace(self, staging_workspace: str, workspace: str, layers: List[Layer]) -> None:
+        """
+        Make the layers that were added under the staging workspace the live layers of the workspace.
+        The rows are renamed in two short requests and the previous rows are deleted afterwards. If the second rename
+        fails, the previous rows are renamed back before the error is raised.
+        When the API cannot rename workspaces, the live rows are synced with the given layers in place and the staging
+        rows are deleted instead.
+        """
+        old_workspace = f"{workspace}-old"
+        self.delete_layers(old_workspace)
+
+        if self.rename_workspace(workspace, old_workspace):
+            try:
+                if not self.rename_workspace(staging_workspace, workspace):
+                    raise ApiException(f"Workspace {staging_workspace} could not be renamed to {workspace}")
+            except Exception:
+                self.rename_workspace(old_workspace, workspace)
+                raise
+            self.delete_layers(old_workspace)
+            return
+
+        print("The API does not support renaming workspaces, syncing the live rows with the staging rows instead")
+        result = self.sync_layers(workspace, layers)
+        if not result.success:
+            raise ApiException(f"Not all layers could be synced: {', '.join(result.failed)}")
+        self.delete_layers(staging_workspace)
+
+    def rename_workspace(self, workspace: str, new_name: str) -> bool:
+        """Move all layers of a workspace to a new workspace name. Returns False if the API does not support it."""
+        print(f"Renaming workspace {workspace} to {new_name}")
+        r = self.request("api.rename_workspace", "patch", self.api_url + "/layers",
+                         json={"workspace": workspace, "newWorkspace": new_name})
+
+        if r.status_code in (404, 405):
+            return False
+        if r.status_code != 200:
+            raise ApiException(f"Renaming workspace {workspace} was not successful. Server returned: {r.text}")
+        return True
+
+    def add_layers(self, layers: List[Layer]) -> List[LayerUploadResult]:
+        """
+        Add the given layers to the database in batches.
+        When the API does not support the bulk endpoint, the layers are added one by one instead.
+        """
+        print(f"Adding {len(layers)} layers to the database")
+
+        results = []
+        for start in range(0, len(layers), self.batch_size):
+            batch = layers[start:start + self.batch_size]
+            if self.supports_batches:
+                results += self.add_layer_batch(batch)
+            else:
+                results += [self.add_layer(layer) for layer in batch]
+
+        failed = [result for result in results if not result.success]
+        print(f"Added {len(results) - len(failed)} of {len(results)} layers to the database")
+        for result in failed:
+            print(f"Failed to add layer {result.layer_name}: {result.error}")
+
+        return results
+
+    def add_layer_batch(self, layers: List[Layer]) -> List[LayerUploadResult]:
+        """Add the given layers to the database with a single request to the bulk endpoint."""
+        try:
+            r = self.request("api.add_layer_batch", "post", self.api_url + "/layers",
+                             json=[self.layer_payload(layer) for layer in layers])
+        except Exception as e:
+            return [LayerUploadResult(layer.name, success=False, error=str(e)) for layer in layers]
+
+        if r.status_code in (404, 405):
+            print("The API does not support adding layers in batches, adding them one by one")
+            self.supports_batches = False
+            return [self.add_layer(layer) for layer in layers]
+
+        if r.status_code not in (200, 201):
+            return [LayerUploadResult(layer.name, success=False, error=f"{r.status_code}: {r.text}")
+                    for layer in layers]
+
+        ids = {row["name"]: row["id"] for row in r.json()}
+        return [LayerUploadResult(layer.name, success=layer.name in ids, id=ids.get(layer.name),
+                                  error="" if layer.name in ids else "Layer missing from the response")
+                for layer in layers]
+
+    def add_layer(self, layer: Layer) -> LayerUploadResult:
         """Add the given layer to the database."""
-        print(f"Adding layer {layer.name}")
+        try:
+            r = self.request("api.add_layer", "post", self.api_url + "/layer", layer_name=layer.name,
+                             data=layer.__dict__)
+            if r.status_code not in (200, 201):
+                return LayerUploadResult(layer.name, success=False, error=f"{r.status_code}: {r.text}")
+            return LayerUploadResult(layer.name, success=True, id=r.json()[0]["id"])
+        except Exception as e:
+            return LayerUploadResult(layer.name, success=False, error=str(e))
+
+    @staticmethod
+    def layer_payload(layer: Layer) -> dict:
+        """Convert the layer to a JSON body with the same string values as the form encoded single layer request."""
+        return {key: str(value) for key, value in layer.__dict__.items()}
+
+
+def create_session(api_token: str, pool_size: int = 10) -> requests.Session:
+    """Create a session that authenticates to the API and keeps up to pool_size connections open."""
+    session = requests.Session()
+    session.headers.update({"Authorization": api_token})
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
-        r = requests.post(url=self.api_url + "/layer",
-                          data=layer.__dict__,
-                          headers={"Authorization": self.api_token})
+def normalize_value(value) -> str:
+    """
+    Convert a field value to the string that the API stores for it: booleans as true/false, numbers without a
+    trailing .0, and timestamps at midnight UTC as their date.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
 
-        print(f"Added layer {r.json()[0]['name']} with id {r.json()[0]['id']}")
+    text = str(value).strip()
+    if text.lower() in ("true", "false"):
+        return text.lower()
+    midnight = re.fullmatch(r"(\d{4}-\d{2}-\d{2})[T ]00:00:00(\.0+)?(Z|[+-]00:?00)?", text)
+    if midnight:
+        return midnight.group(1)
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    if math.isfinite(number) and number.is_integer() and abs(number) < 2 ** 53:
+        return str(int(number))
+    return repr(number) if math.isfinite(number) else text
 
 
 class ApiException(Exception):
@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import resource
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os import path
+from typing import List
+
+import numpy as np
+import pandas as pd
+from osgeo import gdal, ogr, osr
+
+from scripts.deploy_data.config import DeployConfig
+from scripts.deploy_data.main import deploy
+from scripts.deploy_data.mock_services import MockApi, MockGeoserver
+
+gdal.UseExceptions()
+ogr.UseExceptions()
+
+SLD_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<StyledLayerDescriptor version="1.0.0" xmlns="http://www.opengis.net/sld" xmlns:ogc="http://www.opengis.net/ogc">
+  <NamedLayer>
+    <Name>{symbolizer}</Name>
+    <UserStyle>
+      <FeatureTypeStyle>
+        <Rule>
+          <{symbolizer}/>
+        </Rule>
+      </FeatureTypeStyle>
+    </UserStyle>
+  </NamedLayer>
+</StyledLayerDescriptor>
+"""
+
+
+def generate_dataset(data_path: str, layer_count: int, raster_size: int = 256, features: int = 100) -> str:
+    """
+    Write a synthetic data folder with layer_count layers, half rasters and half shapefile zips, each with an SLD,
+    and a metadata sheet that lists them. Like in the atlas, many layers have the same SLD.
+    Returns the path to the metadata sheet.
+    """
+    os.makedirs(data_path, exist_ok=True)
+    rng = np.random.default_rng(layer_count)
+    rows = []
+    for i in range(layer_count):
+        layer_type = "raster" if i % 2 == 0 else "vector"
+        name = f"layer_{i:04d}"
+        if layer_type == "raster":
+            filename = f"{name}.tif"
+            write_raster(path.join(data_path, filename), rng, raster_size)
+            symbolizer = "RasterSymbolizer"
+        else:
+            filename = f"{name}.zip"
+            write_shapefile_zip(path.join(data_path, filename), rng, features)
+            symbolizer = "PolygonSymbolizer"
+
+        with open(path.join(data_path, f"{name}.sld"), "w") as f:
+            f.write(SLD_TEMPLATE.format(symbolizer=symbolizer))
+
+        rows.append({"filename": filename, "full_name": f"Layer {i}", "type": layer_type, "source": "",
+                     "unit": "", "layer_group": f"Group {i % 10}", "parent_group": "Benchmark",
+                     "description": f"Synthetic {layer_type} layer {i}", "keywords": "benchmark",
+                     "date": "2024", "restricted": "false", "resolution": ""})
+
+    metadata_filename = path.join(data_path, "benchmark_metadata.xlsx")
+    pd.DataFrame(rows).to_excel(metadata_filename, index=False, engine="openpyxl")
+    return metadata_filename
+
+
+def write_raster(raster_path: str, rng: np.random.Generator, size: int) -> None:
+    dataset = gdal.GetDriverByName("GTiff").Create(raster_path, size, size, 1, gdal.GDT_Float32)
+    dataset.SetGeoTransform((-25.0, 85.0 / size, 0.0, 40.0, 0.0, -85.0 / size))
+    dataset.SetProjection(wgs84().ExportToWkt())
+    dataset.GetRasterBand(1).WriteArray(rng.random((size, size), dtype=np.float32))
+    dataset = None  # Close the dataset to write it
+
+
+def write_shapefile_zip(zip_path: str, rng: np.random.Generator, features: int) -> None:
+    stem = path.splitext(zip_path)[0]
+    shp_path = stem + ".shp"
+    dataset = ogr.GetDriverByName("ESRI Shapefile").CreateDataSource(shp_path)
+    layer = dataset.CreateLayer(path.basename(stem), wgs84(), ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn("value", ogr.OFTReal))
+    for x, y in rng.uniform((-25.0, -45.0), (59.0, 39.0), (features, 2)):
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField("value", float(x * y))
+        feature.SetGeometry(ogr.CreateGeometryFromWkt(
+            f"POLYGON (({x} {y}, {x + 1} {y}, {x + 1} {y + 1}, {x} {y + 1}, {x} {y}))"))
+        layer.CreateFeature(feature)
+    dataset = None  # Close the dataset to write it
+
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as z:
+        for extension in (".shp", ".shx", ".dbf", ".prj"):
+            z.write(stem + extension, path.basename(stem) + extension)
+            os.remove(stem + extension)
+
+
+def wgs84() -> osr.SpatialReference:
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    return srs
+
+
+def run_benchmark(layer_count: int, work_dir: str, latency: float, failure_rate: float, geoserver_workers: int,
+                  api_batch_size: int, api_sync: bool) -> List[dict]:
+    """
+    Deploy a synthetic dataset of layer_count layers to mock services twice: a full deploy and an incremental
+    redeploy without changes. Runs in its own process, so the peak memory use only covers this size.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)  # The manifests and caches of the deploy are written relative to the working directory
+    data_path = path.join(work_dir, "data")
+    metadata_filename = generate_dataset(data_path, layer_count)
+
+    geoserver = MockGeoserver(latency, failure_rate, seed=layer_count).start()
+    api = MockApi(latency, failure_rate, seed=layer_count).start()
+    results = []
+    try:
+        for run_name, incremental in (("full", False), ("incremental", True)):
+            config = DeployConfig(geoserver_url=geoserver.url, api_url=api.url, data_path=data_path,
+                                  metadata_filename=metadata_filename, workspace="benchmark",
+                                  incremental=incremental, geoserver_workers=geoserver_workers,
+                                  api_batch_size=api_batch_size, api_sync=api_sync,
+                                  trace_path=path.join(work_dir, "traces", f"{run_name}.json"))
+            geoserver_before, api_before = geoserver.summary(), api.summary()
+            error = ""
+            start = time.perf_counter()
+            try:
+                deploy(config, "admin", "geoserver", "token")
+            except Exception as e:
+                error = str(e)
+            seconds = time.perf_counter() - start
+
+            geoserver_requests = geoserver.requests - geoserver_before["requests"]
+            api_requests = api.requests - api_before["requests"]
+            results.append({
+                "layers": layer_count,
+                "run": run_name,
+                "seconds": seconds,
+                "geoserver_requests_per_layer": geoserver_requests / layer_count,
+                "api_requests_per_layer": api_requests / layer_count,
+                "mb_sent": (geoserver.bytes_received - geoserver_before["bytes_received"]
+                            + api.bytes_received - api_before["bytes_received"]) / 1024 / 1024,
+                "api_rows_written": api.rows_written - api_before["rows_written"],
+                "injected_failures": (geoserver.failures - geoserver_before["failures"]
+                                      + api.failures - api_before["failures"]),
+                "error": error,
+            })
+    finally:
+        geoserver.stop()
+        api.stop()
+
+    # ru_maxrss is in kilobytes on Linux. The children are the process pools of the validation and preprocessing
+    peak_rss_mb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+    for result in results:
+        result["peak_rss_mb"] = peak_rss_mb
+    return results
+
+
+def print_results(results: List[dict]) -> None:
+    print(f"\n{'layers':>8}{'run':>13}{'seconds':>10}{'GS req/layer':>14}{'API req/layer':>15}{'API rows':>10}"
+          f"{'MB sent':>10}{'failures':>10}{'peak RSS MB':>13}")
+    for result in results:
+        print(f"{result['layers']:>8}{result['run']:>13}{result['seconds']:>10.1f}"
+              f"{result['geoserver_requests_per_layer']:>14.2f}{result['api_requests_per_layer']:>15.2f}"
+              f"{result['api_rows_written']:>10}"
+              f"{result['mb_sent']:>10.1f}{result['injected_failures']:>10}{result['peak_rss_mb']:>13.0f}")
+        if result["error"]:
+            print(f"{'':>8}{'':>13}  failed: {result['error']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the deploy against local mock GeoServer and API servers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Numbers of layers")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every mock request")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Fraction of mutating requests that fail with a 503")
+    parser.add_argument("--workers", type=int, default=4, help="Number of layers published at the same time")
+    parser.add_argument("--api-batch-size", type=int, default=100, help="Number of layers per API request")
+    parser.add_argument("--replace-rows", action="store_true",
+                        help="Replace all API rows on every deploy instead of syncing the changed rows")
+    parser.add_argument("--work-dir", default=path.abspath("benchmark_runs"), help="Where the datasets are written")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        print(f"Benchmarking {size} layers")
+        # A fresh process per size, so the peak memory use of a size does not include the previous ones
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            results += executor.submit(run_benchmark, size, path.join(args.work_dir, f"{size}_layers"),
+                                       args.latency, args.failure_rate, args.workers, args.api_batch_size,
+                                       not args.replace_rows).result()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
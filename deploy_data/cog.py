@@ -0,0 +1,80 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os import path
+from typing import Dict, List, Optional
+
+from osgeo import gdal
+
+from scripts.deploy_data.layer import Layer
+from scripts.deploy_data.manifest import hash_file
+
+gdal.UseExceptions()
+
+# Nearest neighbour overviews keep the class values of categorical rasters intact
+CREATION_OPTIONS = ["COMPRESS=DEFLATE", "BLOCKSIZE=512", "BIGTIFF=IF_SAFER", "NUM_THREADS=ALL_CPUS",
+                    "RESAMPLING=NEAREST"]
+OVERVIEW_LEVELS = [2, 4, 8, 16, 32, 64]
+
+
+def cog_settings() -> str:
+    """Describe the conversion, so the manifest can tell when rasters need to be converted and uploaded again."""
+    return f"cog {' '.join(CREATION_OPTIONS)} overviews {OVERVIEW_LEVELS}"
+
+
+def convert_rasters_to_cog(data_path: str, raster_layers: List[Layer], cache_dir: str = ".cog_cache",
+                           max_workers: Optional[int] = None) -> Dict[str, str]:
+    """
+    Convert the rasters to tiled and compressed Cloud-Optimized GeoTIFFs with internal overviews, which GeoServer
+    renders much faster at small scales. The converted files are cached by the hash of their source, so unchanged
+    rasters are not converted again. Returns the path of the converted file for every layer name.
+    """
+    print(f"Converting {len(raster_layers)} rasters to Cloud-Optimized GeoTIFF")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    source_paths = [path.join(data_path, layer.filename) for layer in raster_layers]
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn")) as executor:
+        cog_paths = executor.map(convert_to_cog, source_paths, [cache_dir] * len(source_paths))
+        return {layer.name: cog_path for layer, cog_path in zip(raster_layers, cog_paths)}
+
+
+def convert_to_cog(source_path: str, cache_dir: str) -> str:
+    """Convert a single raster, or return the cached conversion if the source did not change."""
+    stem = path.splitext(path.basename(source_path))[0]
+    cog_path = path.join(cache_dir, f"{stem}_{hash_file(source_path)[:16]}.tif")
+    if path.isfile(cog_path):
+        return cog_path
+
+    print(f"Converting {path.basename(source_path)}")
+    # Convert to a temporary file first, so an interrupted conversion is never used as a cached result
+    # The name is unique, because deploys of several targets can convert the same raster at the same time
+    fd, temp_path = tempfile.mkstemp(suffix=".tif", dir=cache_dir)
+    os.close(fd)
+    try:
+        if gdal.GetDriverByName("COG") is not None:
+            gdal.Translate(temp_path, source_path, format="COG", creationOptions=CREATION_OPTIONS)
+        else:
+            translate_with_gtiff(source_path, temp_path)
+        os.replace(temp_path, cog_path)
+    finally:
+        if path.exists(temp_path):
+            os.remove(temp_path)
+    return cog_path
+
+
+def translate_with_gtiff(source_path: str, cog_path: str) -> None:
+    """Create a Cloud-Optimized GeoTIFF with the GTiff driver, for GDAL versions before 3.1 without a COG driver."""
+    tiled_path = cog_path + ".tiled.tif"
+    gdal.Translate(tiled_path, source_path, format="GTiff",
+                   creationOptions=["TILED=YES", "BLOCKXSIZE=512", "BLOCKYSIZE=512", "COMPRESS=DEFLATE",
+                                    "BIGTIFF=IF_SAFER"])
+    dataset = gdal.Open(tiled_path, gdal.GA_Update)
+    dataset.BuildOverviews("NEAREST", OVERVIEW_LEVELS)
+    dataset = None  # Close the dataset to write the overviews
+
+    # Copying the overviews into the new file puts them before the image data, as the COG layout requires
+    gdal.Translate(cog_path, tiled_path, format="GTiff",
+                   creationOptions=["TILED=YES", "BLOCKXSIZE=512", "BLOCKYSIZE=512", "COMPRESS=DEFLATE",
+                                    "COPY_SRC_OVERVIEWS=YES", "BIGTIFF=IF_SAFER"])
+    os.remove(tiled_path)
@@ -0,0 +1,36 @@
+import time
+from dataclasses import dataclass, field
+from os import path
+from typing import List, Optional, Tuple
+
+
+@dataclass
+class DeployConfig:
+    """The settings of a single deploy of a workspace. See run() in main.py for the values that are used."""
+    geoserver_url: str
+    api_url: str
+    data_path: str
+    metadata_filename: str
+    workspace: str
+    incremental: bool = True
+    staged: bool = False
+    manifest_path: Optional[str] = None  # Defaults to manifests/<workspace>.json
+    geoserver_workers: int = 4
+    preprocess_workers: Optional[int] = None  # None uses a process per CPU
+    api_batch_size: int = 100
+    api_sync: bool = True
+    raster_upload_mode: str = "upload"
+    server_data_path: Optional[str] = None
+    convert_to_cog: bool = False
+    preprocess_vector_layers: bool = False
+    simplify_tolerances: List[float] = field(default_factory=list)
+    seed_tiles: bool = False
+    seed_zoom_levels: Tuple[int, int] = (0, 6)
+    seed_tasks: int = 2
+    trace_path: Optional[str] = None  # Defaults to traces/<workspace>_<time>.json
+
+    def __post_init__(self):
+        if self.manifest_path is None:
+            self.manifest_path = path.join("manifests", f"{self.workspace}.json")
+        if self.trace_path is None:
+            self.trace_path = path.join("traces", f"{self.workspace}_{time.strftime('%Y%m%d_%H%M%S')}.json")
@@ -1,126 +1,396 @@
 import os
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
 from os import path
 
-from geo.Geoserver import Geoserver
-from typing import List
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
+from dataclasses import dataclass
+from geo.Geoserver import Geoserver, GeoserverException
+from typing import Callable, Dict, List, Optional, Set
 
-from scripts.deploy_data.layer import Layer
+import requests
+
+from scripts.deploy_data.instrumentation import Tracer
+from scripts.deploy_data.layer import Layer, LayerGroup
+from scripts.deploy_data.manifest import hash_file
+from scripts.deploy_data.retry import RetryPolicy
+
+
+UPLOAD_MODES = ["upload", "stream", "reference"]
+# Styles are named after the hash of their SLD, so layers with the same SLD share one style
+STYLE_NAME_PREFIX = "style_"
+# Before the styles were shared, every layer had its own style with this suffix
+LEGACY_STYLE_SUFFIX = "_style"
+
+
+class ProgressFile:
+    """
+    A read-only file that prints the upload progress while it is read.
+    Requests reads it in small blocks, so only one block of the file is in memory at a time.
+    """
+
+    def __init__(self, file_path: str, description: str, report_every: int = 64 * 1024 * 1024):
+        self.file = open(file_path, "rb")
+        self.size = path.getsize(file_path)
+        self.description = description
+        self.report_every = report_every
+        self.bytes_read = 0
+        self.next_report = report_every
+
+    def __len__(self) -> int:
+        return self.size
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.file.read(size)
+        self.bytes_read += len(chunk)
+        if self.bytes_read >= self.next_report or (not chunk and self.next_report <= self.size):
+            print(f"{self.description}: {self.bytes_read / 1024 / 1024:.0f} of {self.size / 1024 / 1024:.0f} MB sent")
+            self.next_report = self.bytes_read + self.report_every
+        return chunk
+
+    def close(self) -> None:
+        self.file.close()
+
+
+@dataclass
+class LayerResult:
+    """The outcome of publishing a single layer."""
+    layer_name: str
+    success: bool
+    error: str = ""
 
 
 class GeoserverService:
-    def __init__(self, geoserver_url: str, username: str, password: str):
+    def __init__(self, geoserver_url: str, username: str, password: str, max_workers: int = 4,
+                 retry_policy: Optional[RetryPolicy] = None, upload_mode: str = "upload",
+                 server_data_path: Optional[str] = None, tracer: Optional[Tracer] = None):
+        """
+        The max_workers argument limits how many layers are published to GeoServer at the same time, so the server
+        is not overloaded. All GeoServer operations are retried according to the retry_policy.
+        The upload_mode decides how rasters get to GeoServer:
+        - upload: the geoserver-rest package uploads the file.
+        - stream: the file is streamed in small blocks with progress reporting.
+        - reference: nothing is uploaded. The coverage store refers to the file in the data folder that is mounted on
+          the GeoServer host at server_data_path. Preprocessed upload_paths are not used in this mode.
+        """
+        if upload_mode not in UPLOAD_MODES:
+            raise ValueError(f"Upload mode {upload_mode} not supported. Use one of {', '.join(UPLOAD_MODES)}.")
+        if upload_mode == "reference" and server_data_path is None:
+            raise ValueError("The reference upload mode needs the server_data_path")
+
         self.geo = Geoserver(geoserver_url, username=username, password=password)
+        self.upload_mode = upload_mode
+        self.server_data_path = server_data_path
+        self._local = threading.local()
+        self.max_workers = max_workers
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.tracer = tracer or Tracer()
+        self.sld_versions: Dict[str, str] = {}  # SLD versions by style path, filled by the validation stage
+        self.style_hashes: Dict[str, str] = {}  # SLD hashes by style path, filled from the manifest
+        self._workspace_styles: Dict[str, Set[str]] = {}  # The styles in each workspace, listed once per deploy
+        self._styles_lock = threading.Lock()
+        self._style_locks = defaultdict(threading.Lock)  # So a shared style is only uploaded by one layer
+        self.upload_paths: Dict[str, str] = {}  # Preprocessed data files to upload instead, by layer name
 
     def check_status(self) -> None:
-        self.geo.get_status()
+        with self.tracer.span("geoserver.get_status"):
+            self.geo.get_status()
 
-    def create_raster_layers(self, data_path: str, raster_layers: List[Layer], workspace_name: str):
+    def create_raster_layers(self, data_path: str, raster_layers: List[Layer],
+                             workspace_name: str) -> List[LayerResult]:
         print("Creating raster layers")
-        for layer in raster_layers:
-            layer_name = layer.name
-            print(f"Creating raster layer {layer_name} with filename {layer.filename} in group {layer.layer_group}")
+        return self.publish_layers(data_path, raster_layers, workspace_name, self.create_raster_layer)
 
-            layer_data_path = path.join(data_path, layer.filename)
+    def create_vector_layers(self, data_path: str, vector_layers: List[Layer],
+                             workspace_name: str) -> List[LayerResult]:
+        print("Creating vector layers")
+        return self.publish_layers(data_path, vector_layers, workspace_name, self.create_vector_layer)
 
-            style_name = f"{layer_name}_style"
-            style_filename = os.path.splitext(layer.filename)[0] + '.sld'
-            layer_style_path = path.join(data_path, style_filename)
-            sld_version = self.extract_sld_version(layer_style_path)
+    def update_layer_styles(self, data_path: str, layers: List[Layer], workspace_name: str) -> List[LayerResult]:
+        """Replace the style of existing layers whose .sld file changed since the previous deploy."""
+        print("Updating layer styles")
+        return self.publish_layers(data_path, layers, workspace_name, self.update_layer_style)
 
-            # TODO: Clean up this repetition
-            max_tries = 3
-            tries = 0
-            success = False
-            while tries < max_tries and not success:
-                try:
-                    tries += 1
-                    print(f"Creating coverage store, try {tries}")
-                    self.geo.create_coveragestore(layer_name=layer_name, path=layer_data_path, workspace=workspace_name)
-                    success = True
-                    print(f"Successfully created coverage store")
-                except:
-                    pass
-
-            tries = 0
-            success = False
-            while tries < max_tries and not success:
-                try:
-                    tries += 1
-                    print(f"Uploading style, try {tries}")
-                    self.geo.upload_style(path=layer_style_path, name=style_name, workspace=workspace_name,
-                                          sld_version=sld_version)
-                    success = True
-                    print(f"Successfully uploaded style")
-                except:
-                    pass
-
-            tries = 0
-            success = False
-            while tries < max_tries and not success:
+    def create_layer_groups(self, groups: List[LayerGroup], workspace_name: str) -> List[LayerResult]:
+        print("Creating layer groups")
+        return self.publish_layers("", groups, workspace_name,
+                                   lambda _, group, workspace: self.create_layer_group(group, workspace))
+
+    def publish_layers(self, data_path: str, layers: List[Layer], workspace_name: str,
+                       publish_layer: Callable[[str, Layer, str], None]) -> List[LayerResult]:
+        """
+        Run publish_layer for every layer on a bounded pool of worker threads.
+        The steps of a single layer still run in order; only different layers run in parallel.
+        The results are returned in the same order as the layers, with the failures printed at the end.
+        """
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(publish_layer, data_path, layer, workspace_name): layer for layer in layers}
+            for future in as_completed(futures):
+                layer_name = futures[future].name
                 try:
-                    tries += 1
-                    print(f"Publishing style, try {tries}")
-                    self.geo.publish_style(layer_name=layer_name, style_name=style_name, workspace=workspace_name)
-                    success = True
-                    print(f"Successfully published style")
-                except:
-                    pass
-
-    def create_vector_layers(self, data_path: str, vector_layers: List[Layer], workspace_name: str):
-        print("Creating vector layers")
+                    future.result()
+                    results[layer_name] = LayerResult(layer_name, success=True)
+                except Exception as e:
+                    results[layer_name] = LayerResult(layer_name, success=False, error=str(e))
+
+        ordered_results = [results[layer.name] for layer in layers]
+        failed = [result for result in ordered_results if not result.success]
+        print(f"Published {len(ordered_results) - len(failed)} of {len(ordered_results)} layers")
+        for result in failed:
+            print(f"Failed to publish {result.layer_name}: {result.error}")
 
-        for layer in vector_layers:
-            layer_name = layer.name
-            print(f"Creating vector layer {layer_name}")
+        return ordered_results
 
-            layer_data_path = path.join(data_path, layer.filename)
+    def create_raster_layer(self, data_path: str, layer: Layer, workspace_name: str) -> None:
+        layer_name = layer.name
+        print(f"Creating raster layer {layer_name} with filename {layer.filename} in group {layer.layer_group}")
 
-            style_name = f"{layer_name}_style"
-            style_filename = os.path.splitext(layer.filename)[0] + '.sld'
-            layer_style_path = path.join(data_path, style_filename)
+        layer_data_path = self.layer_data_path(data_path, layer)
+        layer_style_path = self.style_path(data_path, layer)
+
+        if self.upload_mode == "reference":
+            server_file_path = posixpath.join(self.server_data_path, layer.filename)
+            self.run_step("geoserver.reference_coveragestore", layer_name,
+                          f"Registering coverage store {layer_name} by reference",
+                          lambda: self.reference_coveragestore(layer_name, server_file_path, workspace_name),
+                          exists=lambda: self.layer_exists(layer_name, workspace_name))
+        elif self.upload_mode == "stream":
+            self.run_step("geoserver.stream_coveragestore", layer_name, f"Streaming coverage store {layer_name}",
+                          lambda: self.stream_coveragestore(layer_name, layer_data_path, workspace_name),
+                          exists=lambda: self.layer_exists(layer_name, workspace_name),
+                          payload_bytes=path.getsize(layer_data_path))
+        else:
+            self.run_step("geoserver.create_coveragestore", layer_name, f"Creating coverage store {layer_name}",
+                          lambda: self.geo.create_coveragestore(layer_name=layer_name, path=layer_data_path,
+                                                                workspace=workspace_name),
+                          exists=lambda: self.layer_exists(layer_name, workspace_name),
+                          payload_bytes=path.getsize(layer_data_path))
+        self.upload_and_publish_style(layer_name, layer_style_path, workspace_name)
+
+    def create_layer_group(self, group: LayerGroup, workspace_name: str) -> None:
+        """Create a layer group that draws each of its layers with its own style, in the order of the layers."""
+        print(f"Creating layer group {group.name}")
+        style_names = [self.ensure_style(group.name, style_path, workspace_name) for style_path in group.style_paths]
+        publishables = "".join(f'<published type="layer"><name>{workspace_name}:{layer_name}</name></published>'
+                               for layer_name in group.layer_names)
+        styles = "".join(f"<style><name>{workspace_name}:{style_name}</name></style>" for style_name in style_names)
+        body = (f"<layerGroup><name>{group.name}</name><mode>SINGLE</mode><title>{escape(group.title)}</title>"
+                f"<publishables>{publishables}</publishables><styles>{styles}</styles></layerGroup>")
+
+        def post_layer_group():
+            r = self.session.post(f"{self.geo.service_url}/rest/workspaces/{workspace_name}/layergroups",
+                                  data=body.encode("utf-8"), headers={"content-type": "text/xml"})
+            if r.status_code != 201:
+                raise Exception(GeoserverException(r.status_code, r.content))
+
+        self.run_step("geoserver.create_layergroup", group.name, f"Creating layer group {group.name}",
+                      post_layer_group, exists=lambda: self.layer_group_exists(group.name, workspace_name))
+
+    def stream_coveragestore(self, layer_name: str, layer_data_path: str, workspace_name: str) -> None:
+        """Create a coverage store by streaming the GeoTIFF, so memory use does not grow with the file size."""
+        url = (f"{self.geo.service_url}/rest/workspaces/{workspace_name}/coveragestores/{layer_name}/file.geotiff"
+               f"?coverageName={layer_name}")
+        progress_file = ProgressFile(layer_data_path, f"Uploading {layer_name}")
+        try:
+            r = self.session.put(url, data=progress_file, headers={"content-type": "image/tiff"})
+        finally:
+            progress_file.close()
+
+        if r.status_code != 201:
+            raise Exception(GeoserverException(r.status_code, r.content))
+
+    def reference_coveragestore(self, layer_name: str, server_file_path: str, workspace_name: str) -> None:
+        """Create a coverage store that refers to a GeoTIFF that is already on the GeoServer host."""
+        url = (f"{self.geo.service_url}/rest/workspaces/{workspace_name}/coveragestores/{layer_name}/external.geotiff"
+               f"?configure=first&coverageName={layer_name}")
+        r = self.session.put(url, data=f"file:{server_file_path}", headers={"content-type": "text/plain"})
+
+        if r.status_code not in (200, 201):
+            raise Exception(GeoserverException(r.status_code, r.content))
+
+    @property
+    def session(self) -> requests.Session:
+        """A session per worker thread for the requests that the geoserver-rest package does not support."""
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+            self._local.session.auth = (self.geo.username, self.geo.password)
+        return self._local.session
+
+    def create_vector_layer(self, data_path: str, layer: Layer, workspace_name: str) -> None:
+        layer_name = layer.name
+        print(f"Creating vector layer {layer_name}")
+
+        layer_data_path = self.layer_data_path(data_path, layer)
+        layer_style_path = self.style_path(data_path, layer)
+
+        self.run_step("geoserver.create_shp_datastore", layer_name, f"Creating shp datastore {layer_name}",
+                      lambda: self.geo.create_shp_datastore(path=layer_data_path, store_name=layer_name,
+                                                            workspace=workspace_name),
+                      exists=lambda: self.layer_exists(layer_name, workspace_name),
+                      payload_bytes=path.getsize(layer_data_path))
+        self.upload_and_publish_style(layer_name, layer_style_path, workspace_name)
+
+    def update_layer_style(self, data_path: str, layer: Layer, workspace_name: str) -> None:
+        """Point the layer at the style of its new SLD. The previous style is removed by delete_unused_styles."""
+        print(f"Replacing style of {layer.name}")
+        self.upload_and_publish_style(layer.name, self.style_path(data_path, layer), workspace_name)
+
+    def upload_and_publish_style(self, layer_name: str, layer_style_path: str, workspace_name: str) -> None:
+        style_name = self.ensure_style(layer_name, layer_style_path, workspace_name)
+        self.run_step("geoserver.publish_style", layer_name, f"Publishing style {style_name}",
+                      lambda: self.geo.publish_style(layer_name=layer_name, style_name=style_name,
+                                                     workspace=workspace_name))
+
+    def ensure_style(self, layer_name: str, layer_style_path: str, workspace_name: str) -> str:
+        """
+        Upload the SLD as a style named after its hash, unless the workspace already has it, and return the style
+        name. Layers with the same SLD wait for each other, so every distinct style is only uploaded once.
+        """
+        style_name = self.style_name(layer_style_path)
+        workspace_styles = self.workspace_styles(workspace_name)
+        with self._style_lock(workspace_name, style_name):
+            if style_name in workspace_styles:
+                return style_name
 
             sld_version = self.extract_sld_version(layer_style_path)
+            self.run_step("geoserver.upload_style", layer_name, f"Uploading style {style_name}",
+                          lambda: self.geo.upload_style(path=layer_style_path, name=style_name,
+                                                        workspace=workspace_name, sld_version=sld_version),
+                          exists=lambda: self.style_exists(style_name, workspace_name),
+                          payload_bytes=path.getsize(layer_style_path))
+            workspace_styles.add(style_name)
+        return style_name
 
-            # TODO: Clean up this repetition
-            max_tries = 3
-            tries = 0
-            success = False
-            while tries < max_tries and not success:
-                try:
-                    tries += 1
-                    print(f"Creating shp datastore, try {tries}")
-                    self.geo.create_shp_datastore(path=layer_data_path, store_name=layer_name, workspace=workspace_name)
-                    success = True
-                    print(f"Successfully created shp datastore")
-                except:
-                    pass
-
-            tries = 0
-            success = False
-            while tries < max_tries and not success:
-                try:
-                    tries += 1
-                    print(f"Uploading style, try {tries}")
-                    self.geo.upload_style(path=layer_style_path, name=style_name, workspace=workspace_name, sld_version=sld_version)
-                    success = True
-                    print(f"Successfully uploaded style")
-                except:
-                    pass
-
-            tries = 0
-            success = False
-            while tries < max_tries and not success:
-                try:
-                    tries += 1
-                    print(f"Publishing style, try {tries}")
-                    self.geo.publish_style(layer_name=layer_name, style_name=style_name, workspace=workspace_name)
-                    success = True
-                    print(f"Successfully published style")
-                except:
-                    pass
+    def style_name(self, layer_style_path: str) -> str:
+        if layer_style_path not in self.style_hashes:
+            self.style_hashes[layer_style_path] = hash_file(layer_style_path)
+        return f"{STYLE_NAME_PREFIX}{self.style_hashes[layer_style_path][:16]}"
+
+    def workspace_styles(self, workspace_name: str) -> Set[str]:
+        """Return the names of the styles in the workspace, which are listed with a single request."""
+        with self._styles_lock:
+            if workspace_name not in self._workspace_styles:
+                self._workspace_styles[workspace_name] = set(self.list_styles(workspace_name))
+            return self._workspace_styles[workspace_name]
+
+    def list_styles(self, workspace_name: str) -> List[str]:
+        url = f"{self.geo.service_url}/rest/workspaces/{workspace_name}/styles.json"
+        with self.tracer.span("geoserver.list_styles"):
+            r = self.session.get(url)
+
+        if r.status_code == 404:
+            return []
+        if r.status_code != 200:
+            raise Exception(GeoserverException(r.status_code, r.content))
+        # GeoServer returns an empty string instead of an empty list when the workspace has no styles
+        styles = r.json()["styles"] or {"style": []}
+        return [style["name"] for style in styles["style"]]
+
+    def delete_unused_styles(self, data_path: str, layers: List[Layer], groups: List[LayerGroup],
+                             workspace_name: str, assigned_styles: Optional[Set[str]] = None) -> None:
+        """
+        Delete the styles of the workspace that none of the layers use anymore, such as the style of a changed SLD
+        or the per layer styles of earlier deploys. The assigned_styles are still in use by layers that could not be
+        updated, which GeoServer refuses to delete, so they are kept.
+        """
+        used_styles = {self.style_name(self.style_path(data_path, layer)) for layer in layers}
+        used_styles.update(self.style_name(style_path) for group in groups for style_path in group.style_paths)
+        used_styles.update(assigned_styles or set())
+        workspace_styles = self.workspace_styles(workspace_name)
+        unused_styles = sorted(style_name for style_name in workspace_styles
+                               if style_name not in used_styles
+                               and (style_name.startswith(STYLE_NAME_PREFIX)
+                                    or style_name.endswith(LEGACY_STYLE_SUFFIX)))
+        for style_name in unused_styles:
+            print(f"Deleting unused style {style_name}")
+            url = f"{self.geo.service_url}/rest/workspaces/{workspace_name}/styles/{style_name}?purge=true"
+            with self.tracer.span("geoserver.delete_style"):
+                r = self.session.delete(url)
+            if r.status_code == 200:
+                workspace_styles.discard(style_name)
+            else:
+                print(f"Could not delete style {style_name}: {r.status_code} {r.text}")
+
+    def _style_lock(self, workspace_name: str, style_name: str) -> threading.Lock:
+        with self._styles_lock:
+            return self._style_locks[(workspace_name, style_name)]
+
+    def run_step(self, operation: str, layer_name: Optional[str], description: str, action: Callable[[], object],
+                 exists: Optional[Callable[[], bool]] = None, payload_bytes: int = 0) -> None:
+        """Run a GeoServer operation with the retry policy and record it as a span of the trace."""
+        with self.tracer.span(operation, layer=layer_name) as span:
+            self.retry_policy.run(description, action, exists=exists, payload_bytes=payload_bytes, span=span)
+
+    def layer_exists(self, layer_name: str, workspace_name: str) -> bool:
+        return self.resource_exists(lambda: self.geo.get_layer(layer_name=layer_name, workspace=workspace_name))
+
+    def layer_group_exists(self, group_name: str, workspace_name: str) -> bool:
+        r = self.session.get(f"{self.geo.service_url}/rest/workspaces/{workspace_name}/layergroups/{group_name}.json")
+        if r.status_code not in (200, 404):
+            raise Exception(GeoserverException(r.status_code, r.content))
+        return r.status_code == 200
+
+    def style_exists(self, style_name: str, workspace_name: str) -> bool:
+        return self.resource_exists(lambda: self.geo.get_style(style_name=style_name, workspace=workspace_name))
+
+    @staticmethod
+    def resource_exists(get_resource: Callable[[], object]) -> bool:
+        """Return whether a GeoServer resource exists. Only a 404 response means that it does not exist."""
+        try:
+            get_resource()
+            return True
+        except Exception as e:
+            if getattr(e.args[0], "status", None) == 404:
+                return False
+            raise e
+
+    def layer_data_path(self, data_path: str, layer: Layer) -> str:
+        """Return the data file to upload for the layer, which is the preprocessed file if there is one."""
+        return self.upload_paths.get(layer.name, path.join(data_path, layer.filename))
+
+    @staticmethod
+    def style_path(data_path: str, layer: Layer) -> str:
+        style_filename = os.path.splitext(layer.filename)[0] + '.sld'
+        return path.join(data_path, style_filename)
+
+    def delete_layer(self, layer_name: str, layer_type: str, workspace_name: str) -> LayerResult:
+        """
+        Delete a layer together with its store, or a layer group. A resource that is already gone counts as deleted.
+        The style can be shared with other layers, so it is left to delete_unused_styles.
+        """
+        print(f"Deleting {layer_type} layer {layer_name}")
+        try:
+            if layer_type == "group":
+                self.run_step("geoserver.delete_layergroup", layer_name, f"Deleting layer group {layer_name}",
+                              lambda: self.delete_layer_group(layer_name, workspace_name))
+            elif layer_type == "raster":
+                self.run_step("geoserver.delete_coveragestore", layer_name, f"Deleting coverage store {layer_name}",
+                              lambda: self.geo.delete_coveragestore(coveragestore_name=layer_name,
+                                                                    workspace=workspace_name))
+            else:
+                self.run_step("geoserver.delete_featurestore", layer_name, f"Deleting shp datastore {layer_name}",
+                              lambda: self.geo.delete_featurestore(featurestore_name=layer_name,
+                                                                   workspace=workspace_name))
+        except Exception as e:
+            if e.args and getattr(e.args[0], "status", None) == 404:
+                return LayerResult(layer_name, success=True)
+            print(f"Could not delete store {layer_name}: {e}")
+            return LayerResult(layer_name, success=False, error=f"Could not delete the previous version: {e}")
+        return LayerResult(layer_name, success=True)
+
+    def delete_layer_group(self, group_name: str, workspace_name: str) -> None:
+        r = self.session.delete(f"{self.geo.service_url}/rest/workspaces/{workspace_name}/layergroups/{group_name}")
+        if r.status_code != 200:
+            raise Exception(GeoserverException(r.status_code, r.content))
 
     def extract_sld_version(self, layer_style_path):
+        if layer_style_path in self.sld_versions:
+            return self.sld_versions[layer_style_path]
+
         tree = ET.parse(layer_style_path)
         root = tree.getroot()
         sld_version = root.attrib["version"]
@@ -130,14 +400,104 @@ class GeoserverService:
         print("Checking if workspace exists")
         if self.workspace_exists(workspace):
             print("Workspace exists. Deleting workspace")
-            self.geo.delete_workspace(workspace)
+            with self.tracer.span("geoserver.delete_workspace"):
+                self.geo.delete_workspace(workspace)
         print("Creating workspace")
-        self.geo.create_workspace(workspace)
+        with self.tracer.span("geoserver.create_workspace"):
+            self.geo.create_workspace(workspace)
+        with self._styles_lock:
+            self._workspace_styles[workspace] = set()  # A new workspace has no styles, so they are not listed
+
+    def swap_workspace(self, staging_workspace: str, workspace: str) -> bool:
+        """
+        Replace the live workspace with the staging workspace by renaming both, so the live layers are only
+        unavailable between the two renames. The previous version is kept as <workspace>-old, so the swap can be
+        undone with restore_workspace until delete_previous_workspace is called.
+        Returns whether there was a live workspace.
+        """
+        old_workspace = f"{workspace}-old"
+        if self.workspace_exists(old_workspace):
+            self.delete_workspace_and_data(old_workspace)
+
+        live_exists = self.workspace_exists(workspace)
+        with self.tracer.span("geoserver.swap_workspace"):
+            if live_exists:
+                self.rename_workspace(workspace, old_workspace)
+            self.rename_workspace(staging_workspace, workspace)
+        print(f"Workspace {staging_workspace} is now live as {workspace}")
+        return live_exists
+
+    def restore_workspace(self, staging_workspace: str, workspace: str, live_existed: bool) -> None:
+        """Undo swap_workspace, so the previous version is live again and the new one is back in staging."""
+        print(f"Restoring the previous version of workspace {workspace}")
+        with self.tracer.span("geoserver.restore_workspace"):
+            self.rename_workspace(workspace, staging_workspace)
+            if live_existed:
+                self.rename_workspace(f"{workspace}-old", workspace)
+
+    def delete_previous_workspace(self, workspace: str) -> None:
+        old_workspace = f"{workspace}-old"
+        if self.workspace_exists(old_workspace):
+            print(f"Deleting previous version of workspace {workspace}")
+            self.delete_workspace_and_data(old_workspace)
+
+    def delete_staging_workspaces(self, workspace: str) -> None:
+        """Delete the staging workspaces that deploys which failed before the swap left behind."""
+        r = self.session.get(f"{self.geo.service_url}/rest/workspaces.json")
+        if r.status_code != 200:
+            raise Exception(GeoserverException(r.status_code, r.content))
+        # GeoServer returns an empty string instead of an empty list when there are no workspaces
+        workspaces = r.json()["workspaces"] or {"workspace": []}
+        for name in [workspace_info["name"] for workspace_info in workspaces["workspace"]]:
+            if name.startswith(f"{workspace}-staging-"):
+                print(f"Deleting staging workspace {name} of an earlier deploy")
+                self.delete_workspace_and_data(name)
+
+    def delete_workspace_and_data(self, workspace: str) -> None:
+        """
+        Delete a workspace together with the raster files that were uploaded into it. GeoServer keeps uploaded files
+        in its data directory under the workspace name they were uploaded to, also after the workspace is renamed or
+        deleted. Files that coverage stores refer to outside the data directory are never deleted.
+        """
+        r = self.session.get(f"{self.geo.service_url}/rest/workspaces/{workspace}/coveragestores.json")
+        if r.status_code != 200:
+            raise Exception(GeoserverException(r.status_code, r.content))
+        stores = r.json()["coverageStores"] or {"coverageStore": []}
+        for store_name in [store["name"] for store in stores["coverageStore"]]:
+            store_url = f"{self.geo.service_url}/rest/workspaces/{workspace}/coveragestores/{store_name}"
+            r = self.session.get(store_url + ".json")
+            # Uploaded files are referred to relative to the data directory, like file:data/<workspace>/<store>
+            if r.status_code != 200 or not r.json()["coverageStore"].get("url", "").startswith("file:data/"):
+                continue
+            with self.tracer.span("geoserver.delete_coveragestore"):
+                r = self.session.delete(store_url, params={"recurse": "true", "purge": "all"})
+            if r.status_code != 200:
+                print(f"Could not delete the files of coverage store {store_name}: {r.status_code} {r.text}")
+
+        with self.tracer.span("geoserver.delete_workspace"):
+            self.geo.delete_workspace(workspace)
+
+    def rename_workspace(self, workspace: str, new_name: str):
+        """Rename a workspace. GeoServer keeps the stores, layers and styles in it."""
+        url = f"{self.geo.service_url}/rest/workspaces/{workspace}"
+        r = self.session.put(url, data=f"<workspace><name>{new_name}</name></workspace>",
+                             headers={"content-type": "text/xml"})
+
+        if r.status_code != 200:
+            raise Exception(GeoserverException(r.status_code, r.content))
+
+    def ensure_workspace(self, workspace: str):
+        """Create the workspace if it does not exist yet, keeping its current contents otherwise."""
+        if not self.workspace_exists(workspace):
+            print("Creating workspace")
+            with self.tracer.span("geoserver.create_workspace"):
+                self.geo.create_workspace(workspace)
 
     def workspace_exists(self, workspace: str) -> bool:
         print(f"Checking if workspace exists")
         try:
-            self.geo.get_workspace(workspace)
+            with self.tracer.span("geoserver.get_workspace"):
+                self.geo.get_workspace(workspace)
             return True
         except Exception as e:
             if e.args[0].status == 404:
@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from os import path
+from typing import Iterator, List, Optional
+
+
+@dataclass
+class Span:
+    """A timed operation of the deploy, such as a phase of run() or a single GeoServer or API call."""
+    name: str
+    layer: Optional[str] = None
+    start: float = 0.0  # Unix time
+    duration: float = 0.0  # Seconds
+    bytes_sent: int = 0
+    retries: int = 0
+    outcome: str = "ok"  # ok, skipped or error
+    error: str = ""
+
+
+class Tracer:
+    """Records spans from any thread and writes them as a JSON trace and a summary table."""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, layer: Optional[str] = None) -> Iterator[Span]:
+        """
+        Time the code in the with block. The yielded span can be updated with the bytes sent, retries and outcome.
+        When the block raises an error, the outcome is set to error and the error is raised again.
+        """
+        span = Span(name=name, layer=layer, start=time.time())
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.outcome = "error"
+            span.error = str(e)
+            raise e
+        finally:
+            span.duration = time.perf_counter() - start
+            with self._lock:
+                self.spans.append(span)
+
+    def write_json(self, trace_path: str) -> None:
+        trace_dir = path.dirname(trace_path)
+        if trace_dir:
+            os.makedirs(trace_dir, exist_ok=True)
+
+        with open(trace_path, "w") as f:
+            json.dump({"spans": [asdict(span) for span in self.spans]}, f, indent=4)
+
+    def print_summary(self, slowest_layers: int = 10) -> None:
+        """Print the totals per operation and the layers that took the longest."""
+        operations = defaultdict(list)
+        for span in self.spans:
+            operations[span.name].append(span)
+
+        print(f"{'operation':<40}{'count':>8}{'seconds':>10}{'MB sent':>10}{'retries':>9}{'errors':>8}")
+        for name, spans in sorted(operations.items(), key=lambda item: min(span.start for span in item[1])):
+            print(f"{name:<40}{len(spans):>8}{sum(span.duration for span in spans):>10.1f}"
+                  f"{sum(span.bytes_sent for span in spans) / 1024 / 1024:>10.1f}"
+                  f"{sum(span.retries for span in spans):>9}"
+                  f"{sum(span.outcome == 'error' for span in spans):>8}")
+
+        layer_seconds = defaultdict(float)
+        layer_bytes = defaultdict(int)
+        for span in self.spans:
+            if span.layer is not None:
+                layer_seconds[span.layer] += span.duration
+                layer_bytes[span.layer] += span.bytes_sent
+
+        if layer_seconds:
+            print(f"\n{'slowest layers':<40}{'seconds':>10}{'MB sent':>10}")
+            slowest = sorted(layer_seconds.items(), key=lambda item: item[1], reverse=True)[:slowest_layers]
+            for layer, seconds in slowest:
+                print(f"{layer:<40}{seconds:>10.1f}{layer_bytes[layer] / 1024 / 1024:>10.1f}")
@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import List
 
 
 @dataclass
@@ -17,3 +18,12 @@ class Layer:
     date: str
     restricted: str
     resolution: str
+
+
+@dataclass
+class LayerGroup:
+    """A GeoServer layer group that shows one of its layers at a time, chosen by the scale limits of its styles."""
+    name: str
+    title: str
+    layer_names: List[str] = field(default_factory=list)
+    style_paths: List[str] = field(default_factory=list)  # The .sld file for every layer in the group
@@ -1,15 +1,22 @@
 import os
+import time
+from dataclasses import replace
 from os import path
-from pathlib import Path
+from typing import List, Optional, Set
 
-import pandas as pd
-import validators
-from typing import List
-
-from scripts.deploy_data import secrets
-from scripts.deploy_data.api_service import ApiService
-from scripts.deploy_data.geoserver_service import GeoserverService
-from scripts.deploy_data.layer import Layer
+from scripts.deploy_data.api_service import ApiException, ApiService
+from scripts.deploy_data.cog import cog_settings, convert_rasters_to_cog
+from scripts.deploy_data.config import DeployConfig
+from scripts.deploy_data.geoserver_service import (LEGACY_STYLE_SUFFIX, STYLE_NAME_PREFIX, GeoserverService,
+                                                   LayerResult)
+from scripts.deploy_data.instrumentation import Tracer
+from scripts.deploy_data.layer import Layer, LayerGroup
+from scripts.deploy_data.manifest import (Manifest, build_manifest, diff_manifests, load_manifest, save_manifest,
+                                          style_path_for)
+from scripts.deploy_data.shared_inputs import SharedInputs
+from scripts.deploy_data.tile_seeder import TileSeeder
+from scripts.deploy_data.vector_preprocessing import (preprocess_vectors, preprocessing_settings,
+                                                     scale_dependent_groups, variant_layers)
 
 
 def run() -> None:
@@ -21,91 +28,255 @@ def run() -> None:
     geoserver_password = "my_secret_password"
     api_token = "my_secret_api_token"
     """
-    geoserver_url = os.getenv("GEOSERVER_URL")  # This environment variable is set in the Dockerfile(.prod)
-    api_url = os.getenv("API_URL")  # This environment variable is set in the Dockerfile(.prod)
-    data_path = path.join("..", "..", "data", "gaa")  # The data folder is located in the root of the repository
-    metadata_filename = "gaa_metadata_restructured.xlsx"  # geoelec_metadata.xlsx or gaa_metadata.xlsx
-    workspace = "gaa-dev"  # geoelec-dev or gaa-dev
-    layers = get_layers(metadata_filename, workspace)
+    from scripts.deploy_data import secrets
+
+    config = DeployConfig(
+        geoserver_url=os.getenv("GEOSERVER_URL"),  # This environment variable is set in the Dockerfile(.prod)
+        api_url=os.getenv("API_URL"),  # This environment variable is set in the Dockerfile(.prod)
+        data_path=path.join("..", "..", "data", "gaa"),  # The data folder is located in the root of the repository
+        metadata_filename="gaa_metadata_restructured.xlsx",  # geoelec_metadata.xlsx or gaa_metadata.xlsx
+        workspace="gaa-dev",  # geoelec-dev or gaa-dev
+        incremental=True,  # Only redeploy the layers that changed since the previous deploy of this workspace
+        staged=False,  # Build everything in a staging workspace first and then swap it with the live workspace
+        geoserver_workers=4,  # Number of layers that are published to GeoServer at the same time
+        api_batch_size=100,  # Number of layers that are added to the database per request
+        api_sync=True,  # Only insert, update and delete the changed rows instead of replacing all rows of the workspace
+        raster_upload_mode="upload",  # upload, stream (in blocks, with progress) or reference (no upload at all)
+        server_data_path=None,  # Location of the data folder on the GeoServer host, needed for the reference mode
+        convert_to_cog=False,  # Upload rasters as tiled, compressed Cloud-Optimized GeoTIFFs with overviews
+        preprocess_vector_layers=False,  # Add spatial indexes to shapefiles and publish simplified variants
+        simplify_tolerances=[],  # A simplified variant is published for every tolerance in degrees, e.g. [0.01]
+        preprocess_workers=None,  # Number of files that are converted at the same time, None uses all CPUs
+        seed_tiles=False,  # Fill the GeoWebCache tile cache of the published layers after the deploy
+        seed_zoom_levels=(0, 6),  # First and last zoom level to seed
+        seed_tasks=2,  # Number of layers that are seeded at the same time
+    )
+    deploy(config, secrets.geoserver_username, secrets.geoserver_password, secrets.api_token)
+
+
+def deploy(config: DeployConfig, geoserver_username: str, geoserver_password: str, api_token: str,
+           shared_inputs: Optional[SharedInputs] = None) -> None:
+    """
+    Deploy the data and metadata of one workspace to the API and GeoServer.
+    Deploys that are given the same shared inputs parse, validate and set up the API only once.
+    """
+    shared_inputs = shared_inputs or SharedInputs()
+    geoserver_url = config.geoserver_url
+    api_url = config.api_url
+    data_path = config.data_path
+    metadata_filename = config.metadata_filename
+    workspace = config.workspace
+    staged = config.staged
+    tracer = Tracer()
+    staging_rows_workspace = None  # The staging workspace while the API has rows in it that were not swapped in
+    try:
+        with tracer.span("phase.parse_metadata"):
+            layers = shared_inputs.layers(metadata_filename, workspace)
+
+        # Check all files before anything is deleted, so broken inputs do not leave a half deployed workspace
+        with tracer.span("phase.validate"):
+            validation_report = shared_inputs.validation(data_path, metadata_filename, layers)
+            validation_report.raise_if_invalid(metadata_filename)
+
+        # Setup connection to the API and perform database migrations
+        api_service = ApiService(api_url, api_token, batch_size=config.api_batch_size, tracer=tracer,
+                                 session=shared_inputs.api_session(api_url, api_token))
+        with tracer.span("phase.api_setup"):
+            shared_inputs.setup_api(api_service)
+
+        workspace_layers = [layer for layer in layers if layer.workspace == workspace]
+        live_layers = workspace_layers
+
+        # In staged mode, the complete new version is built next to the live one, which stays available meanwhile.
+        # Every deploy gets its own staging workspace, because GeoServer keeps the uploaded files under the name of
+        # the workspace they were uploaded to, also after the swap, and the next deploy must not overwrite them
+        target_workspace = workspace
+        if staged:
+            target_workspace = f"{workspace}-staging-{time.strftime('%Y%m%d%H%M%S')}"
+            workspace_layers = [replace(layer, workspace=target_workspace) for layer in workspace_layers]
+        raster_layers = [layer for layer in workspace_layers if layer.type.lower() == "raster"]
+        vector_layers = [layer for layer in workspace_layers if layer.type.lower() == "vector"]
+
+        # Update layer metadata in database
+        if staged:
+            staging_rows_workspace = target_workspace
+        with tracer.span("phase.api_update"):
+            if config.api_sync:
+                sync_result = api_service.sync_layers(target_workspace, workspace_layers)
+                if not sync_result.success:
+                    raise ApiException(f"Not all layers could be synced: {', '.join(sync_result.failed)}")
+            else:
+                api_service.delete_layers(target_workspace)  # First, remove all layers of the workspace
+                upload_results = api_service.add_layers(workspace_layers)  # Then, add the layers of the workspace
+                if not all(result.success for result in upload_results):
+                    raise ApiException("Not all layers could be added to the database")
+
+        # Updating layers in GeoServer
+        geoserver_service = GeoserverService(geoserver_url, geoserver_username, geoserver_password,
+                                             max_workers=config.geoserver_workers,
+                                             upload_mode=config.raster_upload_mode,
+                                             server_data_path=config.server_data_path, tracer=tracer)
+        geoserver_service.sld_versions = dict(validation_report.sld_versions)
+        processing = {}  # How the uploaded files are made from the data files, by layer name, for the manifest
+        if config.convert_to_cog:
+            with tracer.span("phase.convert_to_cog"):
+                geoserver_service.upload_paths.update(convert_rasters_to_cog(data_path, raster_layers,
+                                                                             max_workers=config.preprocess_workers))
+            # The converted files are not used in the reference mode, which registers the original files
+            if config.raster_upload_mode != "reference":
+                processing.update({layer.name: cog_settings() for layer in raster_layers})
+        geoserver_layers = list(workspace_layers)  # Simplified variants are only published to GeoServer
+        groups = []  # The layer groups that switch between a layer and its simplified variants by scale
+        if config.preprocess_vector_layers:
+            with tracer.span("phase.preprocess_vectors"):
+                preprocessed = preprocess_vectors(data_path, vector_layers, config.simplify_tolerances,
+                                                  max_workers=config.preprocess_workers)
+                groups = scale_dependent_groups(data_path, vector_layers, preprocessed)
+            variants = variant_layers(vector_layers, preprocessed)
+            for layer_name, result in preprocessed.items():
+                geoserver_service.upload_paths[layer_name] = result.zip_path
+                geoserver_service.upload_paths.update({variant.name: variant.zip_path for variant in result.variants})
+            vector_layers += variants
+            geoserver_layers += variants
+            processing.update({layer.name: preprocessing_settings(config.simplify_tolerances)
+                               for layer in vector_layers})
+        geoserver_service.check_status()
+
+        with tracer.span("phase.build_manifest"):
+            manifest = build_manifest(data_path, geoserver_layers, processing, groups)
+        geoserver_service.style_hashes = {style_path_for(data_path, layer): manifest[layer.name]["style"]
+                                          for layer in geoserver_layers}
+        previous_manifest = {}
+        if config.incremental and not staged and geoserver_service.workspace_exists(workspace):
+            previous_manifest = load_manifest(config.manifest_path)
+
+        with tracer.span("phase.geoserver_update"):
+            if previous_manifest:
+                results = update_changed_layers(geoserver_service, data_path, workspace, geoserver_layers, groups,
+                                                previous_manifest, manifest)
+            else:
+                if staged:
+                    geoserver_service.delete_staging_workspaces(workspace)
+                geoserver_service.create_workspace(target_workspace)
+                results = geoserver_service.create_raster_layers(data_path, raster_layers, target_workspace)
+                results += geoserver_service.create_vector_layers(data_path, vector_layers, target_workspace)
+                results += geoserver_service.create_layer_groups(groups, target_workspace)
+
+        failed_layer_names = [result.layer_name for result in results if not result.success]
+        if staged:
+            if failed_layer_names:
+                raise RuntimeError(f"{len(failed_layer_names)} layers failed to publish to {target_workspace}, "
+                                   f"the live workspace is left unchanged: {', '.join(failed_layer_names)}")
+            with tracer.span("phase.swap_workspace"):
+                live_existed = geoserver_service.swap_workspace(target_workspace, workspace)
+                try:
+                    api_service.swap_workspace(target_workspace, workspace, live_layers)
+                    staging_rows_workspace = None
+                except Exception:
+                    # Put the previous GeoServer version back, so GeoServer and the API keep matching
+                    geoserver_service.restore_workspace(target_workspace, workspace, live_existed)
+                    raise
+            geoserver_service.delete_previous_workspace(workspace)
+
+        # Failed layers keep their previous manifest entry, so the next deploy tries them again
+        for layer_name in failed_layer_names:
+            if layer_name in previous_manifest:
+                manifest[layer_name] = previous_manifest[layer_name]
+            else:
+                del manifest[layer_name]
+        save_manifest(config.manifest_path, manifest)
+        print(f"GeoServer requests: {geoserver_service.retry_policy.summary()}")
+
+        if config.seed_tiles:
+            seeder = TileSeeder(geoserver_url, geoserver_username, geoserver_password, max_concurrent=config.seed_tasks)
+            with tracer.span("phase.seed_tiles"):
+                seeder.seed_layers(workspace, config.seed_zoom_levels)
+
+        if failed_layer_names:
+            raise RuntimeError(f"{len(failed_layer_names)} layers failed to publish: {', '.join(failed_layer_names)}")
+    finally:
+        # A staged deploy that failed before the swap must not leave its rows in the API
+        if staging_rows_workspace is not None:
+            try:
+                api_service.delete_layers(staging_rows_workspace)
+            except Exception as e:
+                print(f"Could not delete the API rows of {staging_rows_workspace}: {e}")
+        # Also write the trace of failed deploys, to see where they failed
+        tracer.write_json(config.trace_path)
+        tracer.print_summary()
+
+
+def update_changed_layers(geoserver_service: GeoserverService, data_path: str, workspace: str, layers: List[Layer],
+                          groups: List[LayerGroup], previous_manifest: Manifest,
+                          manifest: Manifest) -> List[LayerResult]:
+    """
+    Only create, replace or delete the GeoServer stores, styles and publications of the layers that differ from the
+    previous deploy. Layers of which only the metadata changed are left untouched in GeoServer.
+    """
+    diff = diff_manifests(previous_manifest, manifest)
+    print(f"Added: {len(diff.added)}, removed: {len(diff.removed)}, data changed: {len(diff.data_changed)}, "
+          f"style changed: {len(diff.style_changed)}, metadata changed: {len(diff.metadata_changed)}, "
+          f"unchanged: {len(diff.unchanged)}")
+
+    # Layers of deploys before the styles were shared still use their own <layer>_style. Those that are not
+    # recreated or restyled anyway are moved to the shared style of their SLD once
+    workspace_styles = geoserver_service.workspace_styles(workspace)
+    legacy_styled = {layer.name for layer in layers
+                     if layer.name in diff.unchanged + diff.metadata_changed
+                     and f"{layer.name}{LEGACY_STYLE_SUFFIX}" in workspace_styles}
 
-    validate_all_files_exist(data_path, layers, metadata_filename)
+    if not diff.has_geoserver_changes() and not legacy_styled:
+        print("No GeoServer changes since the previous deploy")
+        return []
 
-    # Setup connection to the API and perform database migrations
-    api_service = ApiService(api_url, secrets.api_token)
-    api_service.check_status()
-    api_service.migrate_database()
+    geoserver_service.ensure_workspace(workspace)
 
-    workspace_layers = [layer for layer in layers if layer.workspace == workspace]
-    raster_layers = [layer for layer in workspace_layers if layer.type.lower() == "raster"]
-    vector_layers = [layer for layer in workspace_layers if layer.type.lower() == "vector"]
+    # Layers with new data are removed first and then recreated like new layers. A layer that could not be deleted
+    # is reported as failed, so it keeps its previous manifest entry and the next deploy tries it again
+    results = []
+    # Groups go first, so their layers are not deleted while a group still refers to them
+    for layer_name in sorted(diff.removed + diff.data_changed,
+                             key=lambda name: previous_manifest[name]["type"] != "group"):
+        result = geoserver_service.delete_layer(layer_name, previous_manifest[layer_name]["type"], workspace)
+        if not result.success:
+            results.append(result)
+    failed_deletes = {result.layer_name for result in results}
 
-    # Update layer metadata in database
-    api_service.delete_layers(workspace)  # First, remove all layers of the workspace
-    api_service.add_layers(workspace_layers)  # Then, add the layers of the workspace
+    if legacy_styled:
+        print(f"Moving {len(legacy_styled)} layers from their own style to the shared style of their SLD")
+    restyled_layers = [layer for layer in layers if layer.name in diff.style_changed or layer.name in legacy_styled]
+    results += geoserver_service.update_layer_styles(data_path, restyled_layers, workspace)
 
-    # Updating layers in GeoServer
-    geoserver_service = GeoserverService(geoserver_url, secrets.geoserver_username, secrets.geoserver_password)
-    geoserver_service.check_status()
+    new_layers = [layer for layer in layers if (layer.name in diff.added or layer.name in diff.data_changed)
+                  and layer.name not in failed_deletes]
+    results += geoserver_service.create_raster_layers(
+        data_path, [layer for layer in new_layers if layer.type.lower() == "raster"], workspace)
+    results += geoserver_service.create_vector_layers(
+        data_path, [layer for layer in new_layers if layer.type.lower() == "vector"], workspace)
+    results += geoserver_service.create_layer_groups(
+        [group for group in groups if (group.name in diff.added or group.name in diff.data_changed)
+         and group.name not in failed_deletes], workspace)
 
-    geoserver_service.create_workspace(workspace)
-    geoserver_service.create_raster_layers(data_path, raster_layers, workspace)
-    geoserver_service.create_vector_layers(data_path, vector_layers, workspace)
+    # Restyled, recreated and removed layers can leave styles behind that no layer uses anymore
+    geoserver_service.delete_unused_styles(data_path, layers, groups, workspace,
+                                           assigned_styles(results, previous_manifest))
+    return results
 
 
-def validate_all_files_exist(data_path: str, layers: List[Layer], metadata_filename: str):
+def assigned_styles(results: List[LayerResult], previous_manifest: Manifest) -> Set[str]:
     """
-    Check if all files in the metadata file exist in the data_path.
-    If not, throw an exception.
+    Return the styles that the failed layers and groups may still use: the shared styles of their previous deploy
+    and, for layers from before the styles were shared, their own style.
     """
-    files_in_path = [path.basename(filename) for filename in os.listdir(data_path)]
-    for layer in layers:
-        if not path.isfile(path.join(data_path, layer.filename)) or layer.filename not in files_in_path:
-            raise FileNotFoundError(f"{metadata_filename} contains the file '{layer.filename}' that cannot be "
-                                    f"found in {data_path}.")
-
-
-def get_layers(metadata_filename: str, workspace: str) -> List[Layer]:
-    """Get a list of layer objects by parsing the metadata Excel file."""
-    if not metadata_filename.endswith(".xlsx"):
-        raise ValueError(f"File type {metadata_filename} not supported. Use .xlsx instead.")
-
-    return parse_metadata_excel(metadata_filename, workspace)
-
-
-def parse_metadata_excel(metadata_filename: str, workspace: str) -> List[Layer]:
-    """Parse the metadata Excel file and return a list of layer objects."""
-    layers = []
-    df = pd.read_excel(metadata_filename, engine="openpyxl")
-    df.fillna("", inplace=True)  # Replace all nan values with an empty string
-
-    if not df["filename"].is_unique:
-        raise ValueError("Layer filenames are not unique")
-
-    for index, row in df.iterrows():
-        # Validate
-        source_url = row["source"]
-        if not validators.url(source_url) and source_url != "":
-            raise ValueError(f"{row['source']} is not a valid url")
-
-        filename: str = row["filename"]
-        name = Path(filename).stem
-        layer = Layer(name=name,
-                      full_name=row["full_name"],
-                      filename=row["filename"],
-                      type=row["type"],
-                      url=row["source"],
-                      unit=row["unit"],
-                      workspace=workspace,
-                      layer_group=row["layer_group"],
-                      parent_group=row["parent_group"],
-                      description=row["description"],
-                      keywords=row["keywords"],
-                      date=row["date"],
-                      restricted=row["restricted"],
-                      resolution=row["resolution"]
-                      )
-        layers.append(layer)
-    return layers
+    style_names = set()
+    for result in results:
+        if result.success:
+            continue
+        style_names.add(f"{result.layer_name}{LEGACY_STYLE_SUFFIX}")
+        entry = previous_manifest.get(result.layer_name, {})
+        style_hashes = entry.get("styles", []) + ([entry["style"]] if entry.get("style") else [])
+        style_names.update(f"{STYLE_NAME_PREFIX}{style_hash[:16]}" for style_hash in style_hashes)
+    return style_names
 
 
 if __name__ == "__main__":
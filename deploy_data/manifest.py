@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from os import path
+from typing import Dict, List, Optional
+
+from scripts.deploy_data.layer import Layer, LayerGroup
+
+Manifest = Dict[str, Dict[str, str]]
+
+
+@dataclass
+class ManifestDiff:
+    """The layers that differ between the previous and the current deploy, by layer name."""
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    data_changed: List[str] = field(default_factory=list)
+    style_changed: List[str] = field(default_factory=list)
+    metadata_changed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+
+    def has_geoserver_changes(self) -> bool:
+        return bool(self.added or self.removed or self.data_changed or self.style_changed)
+
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 hash of a file, read in chunks so large rasters are not loaded into memory."""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_metadata(layer: Layer) -> str:
+    """Return the SHA-256 hash of a layer's metadata row."""
+    serialized = json.dumps(asdict(layer), sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def style_path_for(data_path: str, layer: Layer) -> str:
+    """Return the path to the .sld file that belongs to the layer."""
+    return path.join(data_path, os.path.splitext(layer.filename)[0] + ".sld")
+
+
+def build_manifest(data_path: str, layers: List[Layer], processing: Optional[Dict[str, str]] = None,
+                   groups: Optional[List[LayerGroup]] = None) -> Manifest:
+    """
+    Create a manifest with the content hashes of each layer's data file, style and metadata row.
+    The processing describes, by layer name, how the data file is converted before it is uploaded, such as the COG
+    settings, so a layer is uploaded again when that changes too.
+    A layer group counts as changed when its definition, its styles or the data of one of its layers changed, because
+    GeoServer removes a layer from its groups when the layer is recreated.
+    """
+    processing = processing or {}
+    manifest = {}
+    for layer in layers:
+        manifest[layer.name] = {
+            "type": layer.type.lower(),
+            "data": hash_file(path.join(data_path, layer.filename)),
+            "processing": processing.get(layer.name, ""),
+            "style": hash_file(style_path_for(data_path, layer)),
+            "metadata": hash_metadata(layer),
+        }
+
+    for group in groups or []:
+        definition = {"title": group.title, "layers": group.layer_names,
+                      "data": [manifest[name]["data"] + manifest[name]["processing"] for name in group.layer_names],
+                      "styles": [hash_file(style_path) for style_path in group.style_paths]}
+        manifest[group.name] = {
+            "type": "group",
+            "data": hashlib.sha256(json.dumps(definition, sort_keys=True).encode("utf-8")).hexdigest(),
+            "processing": "",
+            "style": "",
+            "styles": definition["styles"],  # So the styles of a group that could not be deleted are kept
+            "metadata": "",
+        }
+    return manifest
+
+
+def load_manifest(manifest_path: str) -> Manifest:
+    """Load the manifest of a previous deploy. An empty manifest is returned if there is none."""
+    if not path.isfile(manifest_path):
+        return {}
+
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest_path: str, manifest: Manifest) -> None:
+    """Save the manifest so the next deploy can compare against it."""
+    manifest_dir = path.dirname(manifest_path)
+    if manifest_dir:
+        os.makedirs(manifest_dir, exist_ok=True)
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+
+
+def diff_manifests(previous: Manifest, current: Manifest) -> ManifestDiff:
+    """
+    Compare the manifest of the previous deploy with the current one.
+    A layer whose data file, processing or type changed needs to be recreated completely. A layer of which only the
+    style changed only needs its style replaced, and a layer of which only the metadata changed does not need any
+    change in GeoServer.
+    """
+    diff = ManifestDiff()
+    for name, entry in current.items():
+        previous_entry = previous.get(name)
+        if previous_entry is None:
+            diff.added.append(name)
+        elif (previous_entry["data"] != entry["data"] or previous_entry["type"] != entry["type"]
+              or previous_entry.get("processing", "") != entry["processing"]):
+            diff.data_changed.append(name)
+        elif previous_entry["style"] != entry["style"]:
+            diff.style_changed.append(name)
+        elif previous_entry["metadata"] != entry["metadata"]:
+            diff.metadata_changed.append(name)
+        else:
+            diff.unchanged.append(name)
+
+    diff.removed = [name for name in previous if name not in current]
+    return diff
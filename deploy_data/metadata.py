@@ -0,0 +1,86 @@
+import hashlib
+import os
+from os import path
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+import validators
+
+from scripts.deploy_data.layer import Layer
+from scripts.deploy_data.manifest import hash_file
+
+REQUIRED_COLUMNS = ["filename", "full_name", "type", "source", "unit", "layer_group", "parent_group", "description",
+                    "keywords", "date", "restricted", "resolution"]
+
+
+def read_metadata_table(metadata_filename: str, cache_dir: str = ".metadata_cache") -> pd.DataFrame:
+    """
+    Read the metadata Excel file into a DataFrame.
+    Parsing the Excel file with openpyxl is slow, so the parsed table is cached as a pickle file that is keyed on the
+    path and the hash of the Excel file. Only the latest version of every file is kept. The table is returned as
+    read, without replacing empty cells.
+    """
+    source_key = hashlib.sha256(path.abspath(metadata_filename).encode("utf-8")).hexdigest()[:16]
+    cache_path = path.join(cache_dir, f"{source_key}_{hash_file(metadata_filename)}.pkl")
+    if path.isfile(cache_path):
+        return pd.read_pickle(cache_path)
+
+    df = pd.read_excel(metadata_filename, engine="openpyxl")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    df.to_pickle(cache_path)
+    # Remove the tables of the earlier versions of the file, and those of the cache before it was keyed on the path
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".pkl") and entry.path != cache_path and (entry.name.startswith(source_key + "_")
+                                                                           or "_" not in entry.name):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    return df
+
+
+def validate_metadata(df: pd.DataFrame, metadata_filename: str) -> None:
+    """Validate the columns of the metadata table at once, raising an error that lists all invalid values."""
+    missing_columns = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing_columns:
+        raise ValueError(f"{metadata_filename} is missing the columns {', '.join(missing_columns)}")
+
+    if not df["filename"].is_unique:
+        duplicates = df.loc[df["filename"].duplicated(), "filename"].unique()
+        raise ValueError(f"Layer filenames are not unique: {', '.join(duplicates)}")
+
+    sources = df["source"]
+    invalid_sources = sources[(sources != "") & ~sources.map(lambda source: bool(validators.url(source)))]
+    if not invalid_sources.empty:
+        raise ValueError(f"{', '.join(map(str, invalid_sources))} are not valid urls")
+
+
+def build_layers(df: pd.DataFrame, workspace: str) -> List[Layer]:
+    """Create a layer object for every row of the metadata table."""
+    names = df["filename"].map(lambda filename: Path(filename).stem)
+    rows = df.assign(name=names).to_dict("records")
+    return [Layer(name=row["name"],
+                  full_name=row["full_name"],
+                  filename=row["filename"],
+                  type=row["type"],
+                  url=row["source"],
+                  unit=row["unit"],
+                  workspace=workspace,
+                  layer_group=row["layer_group"],
+                  parent_group=row["parent_group"],
+                  description=row["description"],
+                  keywords=row["keywords"],
+                  date=row["date"],
+                  restricted=row["restricted"],
+                  resolution=row["resolution"])
+            for row in rows]
+
+
+def load_layers(metadata_filename: str, workspace: str) -> List[Layer]:
+    """Parse and validate the metadata Excel file and return a list of layer objects."""
+    df = read_metadata_table(metadata_filename)
+    df = df.fillna("")  # Replace all nan values with an empty string
+    validate_metadata(df, metadata_filename)
+    return build_layers(df, workspace)
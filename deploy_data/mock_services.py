@@ -0,0 +1,332 @@
+import json
+import random
+from abc import ABC, abstractmethod
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, parse_qsl, urlparse
+
+from scripts.deploy_data.tile_seeder import TASK_RUNNING, expected_tiles
+
+WORKSPACE_NAME = re.compile(r"<name>(.*?)</name>")
+DEFAULT_STYLE_NAME = re.compile(r"<defaultStyle>.*?<name>(.*?)</name>", re.DOTALL)
+
+
+class MockServer(ABC):
+    """
+    A local HTTP server that stands in for GeoServer or the API, so the deploy can be run and measured offline.
+    Every request is delayed by the latency and mutating requests fail with a 503 at the given failure rate. The
+    requests and bytes received are counted, so they can be compared between runs.
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep connections open, like the real servers
+
+            def do_GET(self):
+                mock.handle(self, "GET")
+
+            def do_POST(self):
+                mock.handle(self, "POST")
+
+            def do_PUT(self):
+                mock.handle(self, "PUT")
+
+            def do_PATCH(self):
+                mock.handle(self, "PATCH")
+
+            def do_DELETE(self):
+                mock.handle(self, "DELETE")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler: BaseHTTPRequestHandler, method: str) -> None:
+        length = int(handler.headers.get("content-length") or 0)
+        body = b""
+        if length:
+            body = handler.rfile.read(length)
+        elif handler.headers.get("transfer-encoding", "").lower() == "chunked":
+            body = self.read_chunked(handler)
+
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += len(body)
+            fail = method != "GET" and self.random.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+
+        time.sleep(self.latency)
+        if fail:
+            status, response = 503, {"error": "Service unavailable"}
+        else:
+            url = urlparse(handler.path)
+            status, response = self.respond(method, url.path, body, parse_qs(url.query))
+
+        content = json.dumps(response).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("content-type", "application/json")
+        handler.send_header("content-length", str(len(content)))
+        handler.end_headers()
+        handler.wfile.write(content)
+
+    @staticmethod
+    def read_chunked(handler: BaseHTTPRequestHandler) -> bytes:
+        chunks = []
+        while True:
+            size = int(handler.rfile.readline().strip(), 16)
+            chunks.append(handler.rfile.read(size))
+            handler.rfile.readline()
+            if size == 0:
+                return b"".join(chunks)
+
+    @abstractmethod
+    def respond(self, method: str, url_path: str, body: bytes, query: Dict[str, List[str]]) -> Tuple[int, object]:
+        """Return the status code and the JSON body of the response to a request."""
+
+    def summary(self) -> dict:
+        return {"requests": self.requests, "failures": self.failures, "bytes_received": self.bytes_received}
+
+
+class MockGeoserver(MockServer):
+    """
+    Implements the parts of the GeoServer REST API that the deploy uses, keeping workspaces, layers and styles.
+    Like GeoServer, a style that is assigned to a layer cannot be deleted.
+    A seed task of GeoWebCache advances by seed_tiles_per_poll tiles every time its progress is requested.
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: Optional[int] = None,
+                 seed_tiles_per_poll: int = 100):
+        super().__init__(latency, failure_rate, seed)
+        self.resources: Set[str] = set()  # Such as "ws", "ws/layers/name" and "ws/styles/name"
+        self.resources_lock = threading.Lock()
+        self.store_urls: Dict[str, str] = {}  # The file of every store, by store name
+        self.layer_styles: Dict[str, str] = {}  # The style of every layer, by "ws/name"
+        self.seed_tiles_per_poll = seed_tiles_per_poll
+        self.seed_tasks: Dict[str, list] = {}  # The task of every layer that is being seeded, by layer name
+        self.seeded_tiles = 0
+        self.next_task_id = 1
+
+    def respond(self, method: str, url_path: str, body: bytes, query: Dict[str, List[str]]) -> Tuple[int, object]:
+        url_path = url_path.replace("/geoserver", "", 1) if url_path.startswith("/geoserver") else url_path
+        parts = [part[:-len(".json")] if part.endswith(".json") else part for part in url_path.split("/") if part]
+
+        if parts[:3] == ["gwc", "rest", "seed"] and len(parts) == 4:
+            with self.resources_lock:
+                return self.respond_seed(method, parts[3], body)
+        if parts[:2] == ["rest", "about"]:
+            return 200, {"about": {"status": []}}
+        if parts[:2] == ["rest", "layers"] and method == "PUT":
+            style_name = DEFAULT_STYLE_NAME.search(body.decode("utf-8"))
+            if style_name is not None:
+                with self.resources_lock:
+                    self.layer_styles[parts[2].replace(":", "/", 1)] = style_name.group(1).split(":")[-1]
+            return 200, {}
+        if parts[:2] != ["rest", "workspaces"]:
+            return 404, {}
+
+        with self.resources_lock:
+            return self.respond_workspaces(method, parts[2:], body)
+
+    def respond_seed(self, method: str, layer_name: str, body: bytes) -> Tuple[int, object]:
+        if method == "POST":
+            seed_request = json.loads(body)["seedRequest"]
+            total = expected_tiles(seed_request["gridSetId"], tuple(seed_request["bounds"]["coords"]["double"]),
+                                   (seed_request["zoomStart"], seed_request["zoomStop"]))
+            # Tiles done, tiles total, seconds remaining, task id and task status
+            self.seed_tasks[layer_name] = [0, total, -1, self.next_task_id, TASK_RUNNING]
+            self.next_task_id += 1
+            return 200, {}
+
+        task = self.seed_tasks.get(layer_name)
+        if task is None:
+            return 200, {"long-array-array": []}
+        progress = min(self.seed_tiles_per_poll, task[1] - task[0])
+        task[0] += progress
+        self.seeded_tiles += progress
+        if task[0] >= task[1]:
+            del self.seed_tasks[layer_name]
+            return 200, {"long-array-array": []}
+        return 200, {"long-array-array": [task]}
+
+    def respond_workspaces(self, method: str, parts: list, body: bytes) -> Tuple[int, object]:
+        if not parts:
+            if method == "POST":
+                self.resources.add(WORKSPACE_NAME.search(body.decode("utf-8")).group(1))
+                return 201, {}
+            names = sorted(r for r in self.resources if "/" not in r)
+            return 200, {"workspaces": {"workspace": [{"name": name} for name in names]} if names else ""}
+
+        workspace = parts[0]
+        if workspace not in self.resources:
+            return 404, {}
+
+        if len(parts) == 1:
+            if method == "DELETE":
+                self.resources = {r for r in self.resources if r != workspace and not r.startswith(workspace + "/")}
+                self.layer_styles = {layer: style for layer, style in self.layer_styles.items()
+                                     if not layer.startswith(workspace + "/")}
+            elif method == "PUT":
+                new_name = WORKSPACE_NAME.search(body.decode("utf-8")).group(1)
+                self.resources = {new_name + r[len(workspace):] if r == workspace or r.startswith(workspace + "/")
+                                  else r for r in self.resources}
+                self.layer_styles = {new_name + layer[len(workspace):] if layer.startswith(workspace + "/")
+                                     else layer: style for layer, style in self.layer_styles.items()}
+            return 200, {"workspace": {"name": workspace}}
+
+        kind = parts[1]
+        if kind == "layers" and len(parts) == 2 and method == "GET":
+            prefix = f"{workspace}/layers/"
+            names = sorted(r[len(prefix):] for r in self.resources if r.startswith(prefix))
+            return 200, {"layers": {"layer": [{"name": name} for name in names]} if names else ""}
+        if kind in ("coveragestores", "datastores"):
+            store_key = "coverageStore" if kind == "coveragestores" else "dataStore"
+            prefix = f"{workspace}/{kind}/"
+            if len(parts) == 2 and method == "GET":
+                names = sorted(r[len(prefix):] for r in self.resources if r.startswith(prefix))
+                return 200, {store_key + "s": {store_key: [{"name": name} for name in names]} if names else ""}
+
+            layer, store = f"{workspace}/layers/{parts[2]}", prefix + parts[2]
+            if method == "PUT":
+                self.resources.update({layer, store})
+                # Uploaded files are kept in the data directory, referenced files stay where they are
+                self.store_urls[parts[2]] = (body.decode("utf-8") if parts[3:] == ["external.geotiff"]
+                                             else f"file:data/{workspace}/{parts[2]}/{parts[2]}")
+                return 201, {"name": parts[2]}
+            if method == "DELETE":
+                self.resources.difference_update({layer, store})
+                self.layer_styles.pop(f"{workspace}/{parts[2]}", None)
+                return 200, {}
+            if method == "GET" and store in self.resources:
+                return 200, {store_key: {"name": parts[2], "url": self.store_urls.get(parts[2], "")}}
+
+        if kind == "layergroups":
+            if method == "POST":
+                self.resources.add(f"{workspace}/layergroups/{WORKSPACE_NAME.search(body.decode('utf-8')).group(1)}")
+                return 201, {}
+            if method == "DELETE":
+                group = f"{workspace}/layergroups/{parts[2]}"
+                if group not in self.resources:
+                    return 404, {}
+                self.resources.discard(group)
+                return 200, {}
+
+        if kind == "styles":
+            if len(parts) == 2 and method == "GET":
+                prefix = f"{workspace}/styles/"
+                names = sorted(r[len(prefix):] for r in self.resources if r.startswith(prefix))
+                # Like GeoServer, an empty string instead of an empty list
+                return 200, {"styles": {"style": [{"name": name} for name in names]} if names else ""}
+            if method == "POST":
+                self.resources.add(f"{workspace}/styles/{WORKSPACE_NAME.search(body.decode('utf-8')).group(1)}")
+                return 201, {}
+            style = f"{workspace}/styles/{parts[2]}"
+            if method == "DELETE":
+                if any(layer.startswith(workspace + "/") and style_name == parts[2]
+                       for layer, style_name in self.layer_styles.items()):
+                    return 403, {"message": "Can't delete style referenced by existing layers"}
+                self.resources.discard(style)
+                return 200, {}
+            if method == "PUT":
+                return 200, {}
+
+        if method == "GET":
+            resource = "/".join(parts[:3])
+            if resource in self.resources:
+                return 200, {parts[1][:-1]: {"name": parts[2]}}
+        return 404, {}
+
+
+class MockApi(MockServer):
+    """
+    Implements the layer endpoints of the API, keeping the layer rows in memory. The rows that are inserted, updated
+    and deleted are counted as rows_written, to compare the database load of the sync modes.
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: Optional[int] = None):
+        super().__init__(latency, failure_rate, seed)
+        self.rows = {}
+        self.next_id = 1
+        self.rows_written = 0
+        self.rows_lock = threading.Lock()
+
+    def respond(self, method: str, url_path: str, body: bytes, query: Dict[str, List[str]]) -> Tuple[int, object]:
+        with self.rows_lock:
+            if url_path == "/" and method == "GET":
+                return 200, {"now": time.time()}
+            if url_path == "/database-migration" and method == "POST":
+                return 200, {}
+            if url_path == "/layers" and method == "GET":
+                workspace = query.get("workspace", [None])[0]
+                return 200, [{"id": row_id, **row} for row_id, row in self.rows.items()
+                             if workspace is None or row["workspace"] == workspace]
+            if url_path == "/layers" and method == "DELETE":
+                workspace = json.loads(body)["workspace"]
+                deleted = [row_id for row_id, row in self.rows.items() if row["workspace"] == workspace]
+                for row_id in deleted:
+                    del self.rows[row_id]
+                self.rows_written += len(deleted)
+                return 200, {"rowCount": len(deleted)}
+            if url_path == "/layers" and method == "POST":
+                return 201, [self.insert(row) for row in json.loads(body)]
+            if url_path == "/layers" and method == "PATCH":
+                names = json.loads(body)
+                for row in self.rows.values():
+                    if row["workspace"] == names["workspace"]:
+                        row["workspace"] = names["newWorkspace"]
+                        self.rows_written += 1
+                return 200, {}
+            if url_path == "/layer" and method == "POST":
+                return 201, [self.insert(dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True)))]
+            if url_path.startswith("/layer/"):
+                row_id = int(url_path.split("/")[-1])
+                if row_id not in self.rows:
+                    return 404, {}
+                if method == "PUT":
+                    self.rows[row_id] = json.loads(body)
+                elif method == "DELETE":
+                    del self.rows[row_id]
+                else:
+                    return 405, {}
+                self.rows_written += 1
+                return 200, {}
+        return 404, {}
+
+    def insert(self, row: dict) -> dict:
+        row_id = self.next_id
+        self.next_id += 1
+        self.rows[row_id] = row
+        self.rows_written += 1
+        return {"id": row_id, "name": row["name"]}
+
+    def summary(self) -> dict:
+        return {**super().summary(), "rows_written": self.rows_written}
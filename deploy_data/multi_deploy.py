@@ -0,0 +1,134 @@
+import argparse
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
+from os import path
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+from scripts.deploy_data.config import DeployConfig
+from scripts.deploy_data.main import deploy
+from scripts.deploy_data.shared_inputs import SharedInputs
+
+
+@dataclass
+class DeployTarget:
+    name: str
+    config: DeployConfig
+
+
+@dataclass
+class TargetResult:
+    name: str
+    workspace: str
+    success: bool
+    seconds: float  # The time the deploy took, without the time it waited for other targets
+    waited_seconds: float = 0.0
+    error: str = ""
+
+
+def load_targets(config_path: str) -> Tuple[List[DeployTarget], dict]:
+    """
+    Read the deploy targets from a YAML file. Every target is a DeployConfig, the settings under defaults apply to
+    all targets. Environment variables in the values, such as ${GEOSERVER_URL}, are expanded.
+    Returns the targets and the remaining top level settings.
+    """
+    with open(config_path, "r") as f:
+        settings = yaml.safe_load(f)
+
+    config_fields = {config_field.name for config_field in fields(DeployConfig)}
+    defaults = settings.pop("defaults", {}) or {}
+    targets = []
+    for target_settings in settings.pop("targets"):
+        target_settings = {**defaults, **target_settings}
+        name = target_settings.pop("name", target_settings["workspace"])
+        unknown = set(target_settings) - config_fields
+        if unknown:
+            raise ValueError(f"Target {name} has unknown settings: {', '.join(sorted(unknown))}")
+
+        target_settings = {key: os.path.expandvars(value) if isinstance(value, str) else value
+                           for key, value in target_settings.items()}
+        # Targets can share a workspace name on different servers, so the manifests and traces are named after the
+        # target
+        target_settings.setdefault("manifest_path", path.join("manifests", f"{name}.json"))
+        target_settings.setdefault("trace_path", path.join("traces", f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.json"))
+        targets.append(DeployTarget(name, DeployConfig(**target_settings)))
+
+    names = [target.name for target in targets]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Target names are not unique: {', '.join(sorted(duplicates))}")
+
+    return targets, settings
+
+
+def deploy_targets(targets: List[DeployTarget], geoserver_username: str, geoserver_password: str, api_token: str,
+                   max_concurrent_targets: int = 2,
+                   max_targets_per_geoserver: Optional[int] = None) -> List[TargetResult]:
+    """
+    Deploy the targets at the same time, with at most max_concurrent_targets running in total. The concurrency
+    within a target is capped by its own settings, such as geoserver_workers, preprocess_workers and seed_tasks.
+    Optionally, at most max_targets_per_geoserver run against the same GeoServer, so a shared server is not
+    overloaded. The metadata files, data folders and APIs that targets have in common are parsed, validated and set
+    up once, and the deploys to the same API reuse its connections.
+    """
+    shared_inputs = SharedInputs()
+    geoserver_slots: Dict[str, threading.Semaphore] = defaultdict(
+        lambda: threading.Semaphore(max_targets_per_geoserver or len(targets)))
+    for target in targets:
+        geoserver_slots[target.config.geoserver_url]  # Create the semaphores before the threads use them
+
+    def deploy_target(target: DeployTarget) -> TargetResult:
+        queued = time.perf_counter()
+        with geoserver_slots[target.config.geoserver_url]:
+            start = time.perf_counter()
+            print(f"Deploying target {target.name}")
+            try:
+                deploy(target.config, geoserver_username, geoserver_password, api_token, shared_inputs)
+                return TargetResult(target.name, target.config.workspace, success=True,
+                                    seconds=time.perf_counter() - start, waited_seconds=start - queued)
+            except Exception as e:
+                print(f"Deploying target {target.name} failed: {e}")
+                return TargetResult(target.name, target.config.workspace, success=False,
+                                    seconds=time.perf_counter() - start, waited_seconds=start - queued,
+                                    error=str(e))
+
+    with ThreadPoolExecutor(max_workers=max_concurrent_targets) as executor:
+        return list(executor.map(deploy_target, targets))
+
+
+def print_summary(results: List[TargetResult]) -> None:
+    print(f"\n{'target':<30}{'workspace':<25}{'result':<10}{'seconds':>10}{'waited':>10}")
+    for result in results:
+        print(f"{result.name:<30}{result.workspace:<25}{'ok' if result.success else 'failed':<10}"
+              f"{result.seconds:>10.1f}{result.waited_seconds:>10.1f}")
+        if not result.success:
+            print(f"  {result.error}")
+
+
+def run(config_path: str) -> None:
+    """
+    Deploy all the targets in the YAML file. The credentials are read from secrets.py, like in main.run().
+    See targets.example.yaml for the format.
+    """
+    from scripts.deploy_data import secrets
+
+    targets, settings = load_targets(config_path)
+    results = deploy_targets(targets, secrets.geoserver_username, secrets.geoserver_password, secrets.api_token,
+                             max_concurrent_targets=settings.get("max_concurrent_targets", 2),
+                             max_targets_per_geoserver=settings.get("max_targets_per_geoserver"))
+    print_summary(results)
+
+    failed = [result.name for result in results if not result.success]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(results)} targets failed: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deploy several workspaces, as listed in a YAML file")
+    parser.add_argument("config", help="The YAML file with the deploy targets")
+    run(parser.parse_args().config)
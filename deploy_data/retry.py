@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+import requests
+
+from scripts.deploy_data.instrumentation import Span
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """
+    Runs operations with retries, exponential backoff and jitter.
+    Errors are classified as retryable (connection problems, timeouts and server errors) or fatal (all other errors,
+    such as bad requests or missing permissions), so fatal errors are raised immediately instead of retried.
+    The counters are shared by all threads that use the policy.
+    """
+
+    def __init__(self, max_tries: int = 3, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.attempts = 0
+        self.retries = 0
+        self.skipped = 0
+        self.failures = 0
+        self.wasted_bytes = 0
+        self._lock = threading.Lock()
+
+    def run(self, description: str, operation: Callable[[], object], exists: Optional[Callable[[], bool]] = None,
+            payload_bytes: int = 0, span: Optional[Span] = None) -> bool:
+        """
+        Run the operation until it succeeds, fails with a fatal error or runs out of tries.
+        Before every retry, the optional exists check is used to find out if the result is already present on the
+        server, for example because a previous attempt timed out after the server finished it. In that case the
+        payload is not sent again and False is returned. True is returned when the operation was performed.
+        The first attempt is always sent, so a resource that was there before, such as the previous version of a
+        layer that could not be deleted, makes the operation fail instead of being taken for its result.
+        The bytes sent and the retries are added to the optional span.
+        """
+        for attempt in range(1, self.max_tries + 1):
+            if attempt > 1 and exists is not None and exists():
+                print(f"{description} skipped, it already exists")
+                self._count(skipped=1)
+                if span is not None:
+                    span.outcome = "skipped"
+                return False
+
+            try:
+                print(f"{description}, try {attempt}")
+                self._count(attempts=1)
+                if span is not None:
+                    span.bytes_sent += payload_bytes
+                operation()
+                print(f"{description} succeeded")
+                return True
+            except Exception as e:
+                self._count(wasted_bytes=payload_bytes)
+                if not self.is_retryable(e) or attempt == self.max_tries:
+                    self._count(failures=1)
+                    raise e
+
+                delay = self.backoff_delay(attempt)
+                print(f"{description} failed with {e}, retrying in {delay:.1f} seconds")
+                self._count(retries=1)
+                if span is not None:
+                    span.retries += 1
+                time.sleep(delay)
+
+        return False
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Return a random delay up to the exponential backoff of the attempt ("full jitter")."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        # The geoserver-rest package wraps its errors in a plain Exception
+        if error.args and isinstance(error.args[0], Exception):
+            error = error.args[0]
+
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+
+        status = getattr(error, "status", None)
+        return status in RETRYABLE_STATUSES
+
+    def summary(self) -> str:
+        return (f"{self.attempts} attempts, {self.retries} retries, {self.failures} failures, "
+                f"{self.skipped} skipped because they already existed, "
+                f"{self.wasted_bytes} bytes sent in failed attempts")
+
+    def _count(self, attempts: int = 0, retries: int = 0, skipped: int = 0, failures: int = 0,
+               wasted_bytes: int = 0) -> None:
+        with self._lock:
+            self.attempts += attempts
+            self.retries += retries
+            self.skipped += skipped
+            self.failures += failures
+            self.wasted_bytes += wasted_bytes
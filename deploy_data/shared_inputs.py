@@ -0,0 +1,69 @@
+import threading
+from collections import defaultdict
+from dataclasses import replace
+from typing import Dict, List, Set, Tuple
+
+import requests
+
+from scripts.deploy_data.api_service import ApiService, create_session
+from scripts.deploy_data.layer import Layer
+from scripts.deploy_data.metadata import load_layers
+from scripts.deploy_data.validation import ValidationReport, validate_layers
+
+
+def get_layers(metadata_filename: str, workspace: str) -> List[Layer]:
+    """Get a list of layer objects by parsing the metadata Excel file."""
+    if not metadata_filename.endswith(".xlsx"):
+        raise ValueError(f"File type {metadata_filename} not supported. Use .xlsx instead.")
+
+    return load_layers(metadata_filename, workspace)
+
+
+class SharedInputs:
+    """
+    Parses each metadata file, validates each data folder and sets up each API only once, for all the deploys that
+    use them. The deploys to the same API also share its session, so they reuse its connections.
+    Deploys of several targets can use it from different threads at the same time.
+    """
+
+    def __init__(self):
+        self._layers: Dict[str, List[Layer]] = {}
+        self._validations: Dict[Tuple[str, str], ValidationReport] = {}
+        self._ready_apis: Set[str] = set()
+        self._api_sessions: Dict[Tuple[str, str], requests.Session] = {}
+        self._lock = threading.Lock()
+        self._key_locks = defaultdict(threading.Lock)  # So different inputs are prepared at the same time
+
+    def layers(self, metadata_filename: str, workspace: str) -> List[Layer]:
+        """Return the layers of the metadata file in the given workspace."""
+        with self._key_lock(("layers", metadata_filename)):
+            if metadata_filename not in self._layers:
+                self._layers[metadata_filename] = get_layers(metadata_filename, workspace)
+        return [replace(layer, workspace=workspace) for layer in self._layers[metadata_filename]]
+
+    def validation(self, data_path: str, metadata_filename: str, layers: List[Layer]) -> ValidationReport:
+        """Return the validation report of the files of the metadata file in the data folder."""
+        key = (data_path, metadata_filename)
+        with self._key_lock(("validation",) + key):
+            if key not in self._validations:
+                self._validations[key] = validate_layers(data_path, layers)
+        return self._validations[key]
+
+    def setup_api(self, api_service: ApiService) -> None:
+        """Check that the API is running and migrate its database, once per API."""
+        with self._key_lock(("api", api_service.api_url)):
+            if api_service.api_url not in self._ready_apis:
+                api_service.check_status()
+                api_service.migrate_database()
+                self._ready_apis.add(api_service.api_url)
+
+    def api_session(self, api_url: str, api_token: str) -> requests.Session:
+        """Return the session of the API, which is created by the first deploy that uses it."""
+        with self._lock:
+            if (api_url, api_token) not in self._api_sessions:
+                self._api_sessions[(api_url, api_token)] = create_session(api_token)
+            return self._api_sessions[(api_url, api_token)]
+
+    def _key_lock(self, key: tuple) -> threading.Lock:
+        with self._lock:
+            return self._key_locks[key]
@@ -0,0 +1,149 @@
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+AFRICA_BBOX = (-25.0, -45.0, 60.0, 40.0)  # min longitude, min latitude, max longitude, max latitude
+
+# The status codes in the task lists of GeoWebCache
+TASK_ABORTED = -1
+TASK_PENDING = 0
+TASK_RUNNING = 1
+TASK_DONE = 2
+
+# Half the width of the world in the spherical Mercator projection of the EPSG:900913 gridset, in metres
+MERCATOR_EXTENT = 20037508.342789244
+
+
+def expected_tiles(gridset: str, bbox: Tuple[float, float, float, float], zoom_levels: Tuple[int, int]) -> int:
+    """
+    Return the number of tiles of the bbox for the zoom levels in the default EPSG:4326 or EPSG:900913 gridset of
+    GeoWebCache, or 0 for other gridsets.
+    """
+    min_x, min_y, max_x, max_y = bbox
+    if gridset == "EPSG:4326":
+        origin_x, origin_y, world_height = -180.0, -90.0, 180.0
+    elif gridset == "EPSG:900913":
+        def mercator_y(latitude):
+            return MERCATOR_EXTENT / math.pi * math.log(math.tan(math.pi / 4 + math.radians(latitude) / 2))
+
+        min_x, max_x = min_x * MERCATOR_EXTENT / 180, max_x * MERCATOR_EXTENT / 180
+        min_y, max_y = mercator_y(min_y), mercator_y(max_y)
+        origin_x, origin_y, world_height = -MERCATOR_EXTENT, -MERCATOR_EXTENT, 2 * MERCATOR_EXTENT
+    else:
+        return 0
+
+    tiles = 0
+    for zoom in range(zoom_levels[0], zoom_levels[1] + 1):
+        # EPSG:4326 has two tiles on the top level, EPSG:900913 one
+        tile_size = world_height / 2 ** zoom
+        columns = math.ceil((max_x - origin_x) / tile_size) - math.floor((min_x - origin_x) / tile_size)
+        rows = math.ceil((max_y - origin_y) / tile_size) - math.floor((min_y - origin_y) / tile_size)
+        tiles += columns * rows
+    return tiles
+
+
+@dataclass
+class SeedResult:
+    layer_name: str
+    success: bool
+    tiles: int = 0
+    seconds: float = 0.0
+    error: str = ""
+
+
+class TileSeeder:
+    """
+    Fills the GeoWebCache tile cache of published layers through the GeoWebCache REST API of GeoServer, so the first
+    visitors do not have to wait for every tile to be rendered.
+    At most max_concurrent layers are seeded at the same time, each by a single GeoWebCache thread.
+    """
+
+    def __init__(self, geoserver_url: str, username: str, password: str, max_concurrent: int = 2,
+                 poll_interval: float = 5.0, gridset: str = "EPSG:4326", image_format: str = "image/png"):
+        self.gwc_url = geoserver_url + "/gwc/rest"
+        self.rest_url = geoserver_url + "/rest"
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.max_concurrent = max_concurrent
+        self.poll_interval = poll_interval
+        self.gridset = gridset
+        self.image_format = image_format
+
+    def workspace_layers(self, workspace: str) -> List[str]:
+        """Return the names of all layers that are published in the workspace."""
+        r = self.session.get(f"{self.rest_url}/workspaces/{workspace}/layers.json")
+        r.raise_for_status()
+        # GeoServer returns an empty string instead of an empty list when the workspace has no layers
+        layers = r.json()["layers"] or {"layer": []}
+        return [layer["name"] for layer in layers["layer"]]
+
+    def seed_layers(self, workspace: str, zoom_levels: Tuple[int, int], layer_names: Optional[List[str]] = None,
+                    bbox: Tuple[float, float, float, float] = AFRICA_BBOX) -> List[SeedResult]:
+        """
+        Seed the given layers, or by default all layers of the workspace, for the zoom levels (start and stop,
+        inclusive) and print a summary.
+        """
+        if layer_names is None:
+            layer_names = self.workspace_layers(workspace)
+        print(f"Seeding tiles of {len(layer_names)} layers for zoom levels {zoom_levels[0]} to {zoom_levels[1]}")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            results = list(executor.map(lambda name: self.seed_layer(workspace, name, zoom_levels, bbox), layer_names))
+
+        failed = [result for result in results if not result.success]
+        print(f"Seeded {sum(result.tiles for result in results)} tiles of {len(results) - len(failed)} layers "
+              f"in {time.perf_counter() - start:.1f} seconds")
+        for result in sorted(results, key=lambda r: r.seconds, reverse=True):
+            print(f"  {result.layer_name}: {result.tiles} tiles in {result.seconds:.1f} seconds"
+                  + (f", failed: {result.error}" if not result.success else ""))
+
+        return results
+
+    def seed_layer(self, workspace: str, layer_name: str, zoom_levels: Tuple[int, int],
+                   bbox: Tuple[float, float, float, float]) -> SeedResult:
+        """Start a seed task for the layer and wait until GeoWebCache has no running tasks for it anymore."""
+        start = time.perf_counter()
+        url = f"{self.gwc_url}/seed/{workspace}:{layer_name}.json"
+        seed_request = {"seedRequest": {"name": f"{workspace}:{layer_name}",
+                                        "bounds": {"coords": {"double": list(bbox)}},
+                                        "gridSetId": self.gridset,
+                                        "zoomStart": zoom_levels[0],
+                                        "zoomStop": zoom_levels[1],
+                                        "format": self.image_format,
+                                        "type": "seed",
+                                        "threadCount": 1}}
+        try:
+            r = self.session.post(url, json=seed_request)
+            if r.status_code != 200:
+                raise RuntimeError(f"Seeding was not started. Server returned {r.status_code}: {r.text}")
+
+            # The tiles done and the total tiles of every task that was seen, by task id
+            progress: Dict[int, Tuple[int, int]] = {}
+            while True:
+                r = self.session.get(url)
+                r.raise_for_status()
+                # Each task is a list of tiles done, tiles total, seconds remaining, task id and task status
+                tasks = r.json()["long-array-array"]
+                if any(task[4] == TASK_ABORTED for task in tasks):
+                    raise RuntimeError("The seed task was aborted")
+                running = {task[3]: (task[0], task[1]) for task in tasks}
+                # Tasks leave the list when they are done, so all their tiles were seeded
+                for task_id, (_, total) in progress.items():
+                    if task_id not in running:
+                        progress[task_id] = (total, total)
+                progress.update(running)
+                if not tasks:
+                    break
+                time.sleep(self.poll_interval)
+
+            tiles = sum(done for done, _ in progress.values())
+            if not progress:
+                # The task finished before the first poll
+                tiles = expected_tiles(self.gridset, bbox, zoom_levels)
+            return SeedResult(layer_name, success=True, tiles=tiles, seconds=time.perf_counter() - start)
+        except Exception as e:
+            return SeedResult(layer_name, success=False, seconds=time.perf_counter() - start, error=str(e))
@@ -0,0 +1,120 @@
+import os
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from dataclasses import dataclass, field
+from os import path
+from typing import Dict, List, Optional
+
+from osgeo import gdal
+
+from scripts.deploy_data.layer import Layer
+from scripts.deploy_data.manifest import style_path_for
+
+gdal.UseExceptions()
+
+SHAPEFILE_EXTENSIONS = [".shp", ".shx", ".dbf"]
+
+
+@dataclass
+class LayerValidation:
+    """The problems found in the files of a single layer, and the version of its parsed SLD file."""
+    layer_name: str
+    problems: List[str] = field(default_factory=list)
+    sld_version: Optional[str] = None
+
+
+@dataclass
+class ValidationReport:
+    problems: Dict[str, List[str]] = field(default_factory=dict)
+    sld_versions: Dict[str, str] = field(default_factory=dict)  # The SLD version of each style file path
+
+    def raise_if_invalid(self, metadata_filename: str) -> None:
+        if not self.problems:
+            return
+
+        lines = [f"{layer_name}: {problem}" for layer_name, problems in self.problems.items() for problem in problems]
+        raise ValueError(f"{len(self.problems)} layers in {metadata_filename} are invalid:\n" + "\n".join(lines))
+
+
+def validate_layers(data_path: str, layers: List[Layer], max_workers: Optional[int] = None) -> ValidationReport:
+    """
+    Check the files of all layers before anything is changed in the API or GeoServer.
+    The layers are checked in parallel on a process pool: raster headers are read with GDAL, the members of shapefile
+    zips are listed and every SLD file is parsed once. All problems are collected in the report, together with the
+    SLD versions so the styles do not have to be parsed again when publishing.
+    """
+    files_in_path = set(os.listdir(data_path))
+    report = ValidationReport()
+
+    # The processes are spawned instead of forked, because deploys of several targets run in threads, and a fork
+    # copies the locks that the other threads hold
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn")) as executor:
+        results = executor.map(validate_layer, [data_path] * len(layers), layers,
+                               [layer.filename in files_in_path for layer in layers], chunksize=8)
+        for layer, result in zip(layers, results):
+            if result.problems:
+                report.problems[result.layer_name] = result.problems
+            if result.sld_version is not None:
+                report.sld_versions[style_path_for(data_path, layer)] = result.sld_version
+
+    return report
+
+
+def validate_layer(data_path: str, layer: Layer, listed: bool) -> LayerValidation:
+    """Validate the files of a single layer. listed tells whether the data file is in the directory listing."""
+    result = LayerValidation(layer.name)
+    layer_data_path = path.join(data_path, layer.filename)
+    layer_type = layer.type.lower()
+
+    if not listed or not path.isfile(layer_data_path):
+        result.problems.append(f"the file '{layer.filename}' cannot be found in {data_path}")
+    elif layer_type == "raster":
+        result.problems += validate_raster(layer_data_path)
+    elif layer_type == "vector":
+        result.problems += validate_shapefile_zip(layer_data_path)
+    else:
+        result.problems.append(f"layer type '{layer.type}' is not supported")
+
+    layer_style_path = style_path_for(data_path, layer)
+    if not path.isfile(layer_style_path):
+        result.problems.append(f"the style '{path.basename(layer_style_path)}' cannot be found in {data_path}")
+    else:
+        try:
+            result.sld_version = ET.parse(layer_style_path).getroot().attrib["version"]
+        except ET.ParseError as e:
+            result.problems.append(f"the style cannot be parsed: {e}")
+        except KeyError:
+            result.problems.append("the style has no version attribute")
+
+    return result
+
+
+def validate_raster(raster_path: str) -> List[str]:
+    """Read the header of the raster with GDAL, without reading the pixel data."""
+    try:
+        dataset = gdal.Open(raster_path)
+    except RuntimeError as e:
+        return [f"the raster cannot be opened: {e}"]
+
+    problems = []
+    if dataset.RasterCount == 0 or dataset.RasterXSize == 0 or dataset.RasterYSize == 0:
+        problems.append("the raster has no data")
+    if not dataset.GetProjection():
+        problems.append("the raster has no projection")
+    return problems
+
+
+def validate_shapefile_zip(zip_path: str) -> List[str]:
+    """Check that the zip contains all parts of a shapefile, by listing its members."""
+    try:
+        with zipfile.ZipFile(zip_path) as z:
+            extensions = {path.splitext(member)[1].lower() for member in z.namelist()}
+    except zipfile.BadZipFile as e:
+        return [f"the zip cannot be read: {e}"]
+
+    missing = [extension for extension in SHAPEFILE_EXTENSIONS if extension not in extensions]
+    if missing:
+        return [f"the zip is missing the shapefile parts {', '.join(missing)}"]
+    return []
@@ -0,0 +1,221 @@
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from dataclasses import dataclass, field, replace
+from io import BytesIO
+from os import path
+from typing import Dict, List, Optional
+
+from osgeo import gdal, ogr
+
+from scripts.deploy_data.layer import Layer, LayerGroup
+from scripts.deploy_data.manifest import hash_file, style_path_for
+
+gdal.UseExceptions()
+ogr.UseExceptions()
+
+# A simplification is not visible while the tolerance is smaller than a pixel. Scales relate to ground distances by
+# the standard pixel size of 0.28 mm that GeoServer uses, and the tolerances are in degrees.
+STANDARD_PIXEL_SIZE = 0.00028
+METRES_PER_DEGREE = 111320
+SLD_NAMESPACES = {"sld": "http://www.opengis.net/sld", "se": "http://www.opengis.net/se",
+                  "ogc": "http://www.opengis.net/ogc", "xlink": "http://www.w3.org/1999/xlink",
+                  "gml": "http://www.opengis.net/gml"}
+
+
+@dataclass
+class VectorVariant:
+    """A simplified copy of a shapefile, meant to be shown at small scales."""
+    name: str
+    zip_path: str
+    tolerance: float
+
+
+@dataclass
+class PreprocessedVector:
+    zip_path: str
+    variants: List[VectorVariant] = field(default_factory=list)
+
+
+def variant_name(layer_name: str, tolerance: float) -> str:
+    return f"{layer_name}_simplified_{str(tolerance).replace('.', '_')}"
+
+
+def preprocessing_settings(tolerances: List[float]) -> str:
+    """Describe the preprocessing, so the manifest can tell when layers need to be processed and uploaded again."""
+    return f"qix simplify {sorted(tolerances)}"
+
+
+def preprocess_vectors(data_path: str, vector_layers: List[Layer], tolerances: List[float],
+                       cache_dir: str = ".vector_cache",
+                       max_workers: Optional[int] = None) -> Dict[str, PreprocessedVector]:
+    """
+    Add a spatial index (.qix) to every shapefile zip and create a simplified variant for every tolerance, in the
+    units of the layer's coordinate system. The results are packaged as zips like the ones create_shp_datastore
+    expects and are cached by the hash of the input zip, so unchanged layers are not processed again.
+    Returns the preprocessed files for every layer name.
+    """
+    print(f"Preprocessing {len(vector_layers)} vector layers")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    zip_paths = [path.join(data_path, layer.filename) for layer in vector_layers]
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn")) as executor:
+        results = executor.map(preprocess_vector, zip_paths, [layer.name for layer in vector_layers],
+                               [tolerances] * len(vector_layers), [cache_dir] * len(vector_layers))
+        return {layer.name: result for layer, result in zip(vector_layers, results)}
+
+
+def variant_layers(vector_layers: List[Layer], preprocessed: Dict[str, PreprocessedVector]) -> List[Layer]:
+    """
+    Create a layer for every simplified variant. A variant keeps the filename of its original layer, so it is
+    published with the same style.
+    """
+    return [replace(layer, name=variant.name)
+            for layer in vector_layers
+            for variant in preprocessed[layer.name].variants]
+
+
+def scale_dependent_groups(data_path: str, vector_layers: List[Layer], preprocessed: Dict[str, PreprocessedVector],
+                           cache_dir: str = ".vector_cache") -> List[LayerGroup]:
+    """
+    Create a layer group named <layer>_multiscale for every layer with simplified variants. The group shows the
+    original layer at large scales and ever more simplified variants at smaller scales, so clients that request the
+    group switch between them automatically. Its styles are copies of the layer's SLD with scale limits.
+    """
+    styles_dir = path.join(cache_dir, "styles")
+    os.makedirs(styles_dir, exist_ok=True)
+    groups = []
+    for layer in vector_layers:
+        variants = sorted(preprocessed[layer.name].variants, key=lambda variant: variant.tolerance)
+        if not variants:
+            continue
+
+        # Every variant is shown from the scale at which its simplification is smaller than a pixel
+        limits = [variant.tolerance * METRES_PER_DEGREE / STANDARD_PIXEL_SIZE for variant in variants]
+        style_path = style_path_for(data_path, layer)
+        group = LayerGroup(f"{layer.name}_multiscale", layer.full_name)
+        for name, min_scale, max_scale in zip([layer.name] + [variant.name for variant in variants],
+                                              [None] + limits, limits + [None]):
+            group.layer_names.append(name)
+            group.style_paths.append(scale_limited_style(style_path, min_scale, max_scale, styles_dir))
+        groups.append(group)
+    return groups
+
+
+def scale_limited_style(style_path: str, min_scale: Optional[float], max_scale: Optional[float],
+                        styles_dir: str) -> str:
+    """
+    Write a copy of the SLD in which every rule is only shown from min_scale up to max_scale, keeping stricter limits
+    that the rules already have. Returns the path of the copy, which is named after its content.
+    """
+    for prefix, uri in SLD_NAMESPACES.items():
+        ET.register_namespace(prefix, uri)
+    tree = ET.parse(style_path)
+    for rule in tree.iter():
+        if rule.tag == "Rule" or rule.tag.endswith("}Rule"):
+            limit_rule(rule, min_scale, max_scale)
+
+    # ET.tostring only has the xml_declaration argument from Python 3.8 on
+    buffer = BytesIO()
+    tree.write(buffer, encoding="utf-8", xml_declaration=True)
+    content = buffer.getvalue()
+    copy_path = path.join(styles_dir, f"{hashlib.sha256(content).hexdigest()[:16]}.sld")
+    if not path.isfile(copy_path):
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=styles_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(temp_path, copy_path)
+    return copy_path
+
+
+def limit_rule(rule: ET.Element, min_scale: Optional[float], max_scale: Optional[float]) -> None:
+    namespace = rule.tag[:-len("Rule")]
+    limits = []
+    for tag, limit, stricter in ((namespace + "MinScaleDenominator", min_scale, max),
+                                 (namespace + "MaxScaleDenominator", max_scale, min)):
+        element = rule.find(tag)
+        if element is None:
+            element = ET.Element(tag)
+        else:
+            rule.remove(element)
+            existing = float(element.text)
+            limit = existing if limit is None else stricter(existing, limit)
+        if limit is not None:
+            element.text = str(limit)
+            limits.append(element)
+
+    # The scale limits come after the name, title, legend and filter of a rule and before its symbolizers
+    index = next((i for i, child in enumerate(rule) if child.tag.endswith("Symbolizer")), len(rule))
+    for offset, element in enumerate(limits):
+        rule.insert(index + offset, element)
+
+
+def preprocess_vector(zip_path: str, layer_name: str, tolerances: List[float], cache_dir: str) -> PreprocessedVector:
+    key = hashlib.sha256(f"{hash_file(zip_path)}{sorted(tolerances)}".encode("utf-8")).hexdigest()[:16]
+    output_dir = path.join(cache_dir, f"{layer_name}_{key}")
+    result = PreprocessedVector(zip_path=path.join(output_dir, f"{layer_name}.zip"))
+    for tolerance in tolerances:
+        name = variant_name(layer_name, tolerance)
+        result.variants.append(VectorVariant(name, path.join(output_dir, f"{name}.zip"), tolerance))
+    if path.isdir(output_dir):
+        return result
+
+    print(f"Preprocessing {path.basename(zip_path)}")
+    work_dir = tempfile.mkdtemp()
+    try:
+        with zipfile.ZipFile(zip_path) as z:
+            z.extractall(work_dir)
+        shp_path = glob.glob(path.join(work_dir, "**", "*.shp"), recursive=True)[0]
+
+        create_spatial_index(shp_path)
+        # Build the complete output in a temporary directory, so an interrupted run is never used as a cached result.
+        # The name is unique, because deploys of several targets can preprocess the same layer at the same time
+        temp_output_dir = tempfile.mkdtemp(prefix=f"{layer_name}_{key}.", dir=cache_dir)
+        try:
+            zip_shapefile(shp_path, path.join(temp_output_dir, path.basename(result.zip_path)))
+
+            for variant in result.variants:
+                variant_shp_path = path.join(work_dir, f"{variant.name}.shp")
+                source = gdal.OpenEx(shp_path, gdal.OF_VECTOR)
+                gdal.VectorTranslate(variant_shp_path, source,
+                                     options=f'-f "ESRI Shapefile" -simplify {variant.tolerance}')
+                source = None
+                create_spatial_index(variant_shp_path)
+                zip_shapefile(variant_shp_path, path.join(temp_output_dir, path.basename(variant.zip_path)))
+
+            try:
+                os.replace(temp_output_dir, output_dir)
+            except OSError:
+                # Another deploy finished the same layer first, its output is the same
+                if not path.isdir(output_dir):
+                    raise
+        finally:
+            # Only left when a step failed or another deploy was first
+            if path.isdir(temp_output_dir):
+                shutil.rmtree(temp_output_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+    return result
+
+
+def create_spatial_index(shp_path: str) -> None:
+    """Create the .qix quadtree index that GeoServer uses to read only the features in view."""
+    dataset = ogr.Open(shp_path, 1)
+    layer_name = dataset.GetLayer(0).GetName()
+    dataset.ExecuteSQL(f'CREATE SPATIAL INDEX ON "{layer_name}"')
+    dataset = None  # Close the dataset to write the index
+
+
+def zip_shapefile(shp_path: str, zip_path: str) -> None:
+    """Zip all the files of a shapefile, such as the .shp, .shx, .dbf, .prj and .qix files."""
+    stem = path.splitext(shp_path)[0]
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as z:
+        for file in glob.glob(f"{glob.escape(stem)}.*"):
+            z.write(file, path.basename(file))
@@ -1,40 +1,234 @@
-import processing
-import glob
-import zipfile
+import json
 import os
+import shutil
+import tempfile
+import zipfile
 from os import path
 
+from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtWidgets import QProgressBar
+
 style_path = "C:\\Users\\mosj\\Desktop\\gaa-testing"
+compression_level = 6  # 0 stores the shapefiles in the zips uncompressed, 9 makes the smallest zips
+state_filename = ".export_state.json"  # Remembers the sources of the last export, to skip the unchanged layers
+
+# The tasks must be referenced until they finish, otherwise Python removes them while they are running
+export_tasks = []
+
+
+def source_fingerprint(layer):
+    """
+    Describe the source of the layer and the size and modification time of its file, so a changed source can be
+    detected without reading it. Returns None for sources that are not files, which are always exported.
+    """
+    parts = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source())
+    source_file = parts.get("path")
+    if not source_file or not path.isfile(source_file):
+        return None
+
+    stat = os.stat(source_file)
+    subset = layer.subsetString() if isinstance(layer, QgsVectorLayer) else ""
+    return f"{layer.source()}|{subset}|{layer.crs().authid()}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def load_state():
+    state_path = path.join(style_path, state_filename)
+    if not path.isfile(state_path):
+        return {}
+    with open(state_path, "r") as f:
+        return json.load(f)
+
+
+def save_state(state):
+    with open(path.join(style_path, state_filename), "w") as f:
+        json.dump(state, f, indent=4)
+
+
+class ExportTask(QgsTask):
+    """Exports the data of a single layer in the background. The layer itself is only used on the main thread."""
+
+    def __init__(self, name, output_path, fingerprint, on_finished):
+        super().__init__(f"Exporting {name}", QgsTask.CanCancel)
+        self.name = name
+        self.output_path = output_path
+        self.fingerprint = fingerprint
+        self.on_finished = on_finished
+        self.feedback = QgsFeedback()
+        self.error = None
+
+    def run(self):
+        # The feedback reports the progress of the writers and lets them stop when the task is cancelled
+        self.feedback.progressChanged.connect(self.setProgress)
+        try:
+            self.export(self.feedback)
+            return not self.isCanceled()
+        except Exception as e:
+            self.error = str(e)
+            return False
+
+    def cancel(self):
+        self.feedback.cancel()
+        super().cancel()
+
+    def export(self, feedback):
+        """Write the layer's data to output_path. Runs on the task's thread, the subclasses implement it."""
+        raise NotImplementedError
+
+    def finished(self, result):
+        self.on_finished(self, result)
+
 
-layers = QgsProject.instance().mapLayers().values()
-for layer in layers:
-    name = layer.name()
-    print(name, end=", ")
-    if isinstance(layer, QgsVectorLayer):
-        writer = QgsVectorFileWriter.writeAsVectorFormat(layer, path.join(style_path, name), "utf-8", layer.crs(),
-                                                         "ESRI Shapefile")
-        files_to_zip = [file for file in glob.glob(f"{path.join(style_path, name)}.*") if not file.endswith(".zip")]
-
-        with zipfile.ZipFile(path.join(style_path, name) + ".zip", "w") as z:
-            for file in files_to_zip:
-                z.write(file, path.basename(file))
-
-        files_to_remove = files_to_zip
-        for file in files_to_remove:
-            os.remove(file)
-    elif isinstance(layer, QgsRasterLayer):
+class ExportVectorTask(ExportTask):
+    """
+    Writes the shapefile to a temporary directory and zips it into the export directory. The shapefile writer seeks
+    in its output files, so it cannot write into the zip directly.
+    """
+
+    def __init__(self, layer, output_path, fingerprint, on_finished):
+        super().__init__(layer.name(), output_path, fingerprint, on_finished)
+        # A new layer is created on the task's thread from these, because layers cannot be shared between threads
+        self.source = layer.source()
+        self.provider = layer.providerType()
+        self.subset = layer.subsetString()
+        self.transform_context = QgsProject.instance().transformContext()
+        # Memory layers and unsaved edits only exist in the layer itself, so their features are copied on the main
+        # thread to a new memory layer, which only this task uses
+        self.snapshot = None
+        if layer.providerType() == "memory" or layer.isModified():
+            self.snapshot = layer.materialize(QgsFeatureRequest())
+
+    def export(self, feedback):
+        if self.snapshot is not None:
+            layer = self.snapshot
+        else:
+            layer = QgsVectorLayer(self.source, self.name, self.provider)
+            if self.subset:
+                layer.setSubsetString(self.subset)
+
+        work_dir = tempfile.mkdtemp()
+        try:
+            options = QgsVectorFileWriter.SaveVectorOptions()
+            options.driverName = "ESRI Shapefile"
+            options.fileEncoding = "utf-8"
+            options.feedback = feedback
+            error, message, _, _ = QgsVectorFileWriter.writeAsVectorFormatV3(
+                layer, path.join(work_dir, self.name), self.transform_context, options)
+            if error != QgsVectorFileWriter.NoError:
+                raise RuntimeError(message)
+
+            # Write to a temporary zip first, so a cancelled export never leaves a partial zip behind
+            temp_zip_path = self.output_path + ".tmp"
+            compression = zipfile.ZIP_DEFLATED if compression_level > 0 else zipfile.ZIP_STORED
+            try:
+                with zipfile.ZipFile(temp_zip_path, "w", compression, compresslevel=compression_level) as z:
+                    for file in sorted(os.listdir(work_dir)):
+                        z.write(path.join(work_dir, file), file)
+                os.replace(temp_zip_path, self.output_path)
+            finally:
+                if path.isfile(temp_zip_path):
+                    os.remove(temp_zip_path)
+        finally:
+            shutil.rmtree(work_dir)
+
+
+class ExportRasterTask(ExportTask):
+    def __init__(self, layer, output_path, fingerprint, on_finished):
+        super().__init__(layer.name(), output_path, fingerprint, on_finished)
+        # A clone of the data provider can be used on another thread, the layer cannot
+        self.provider = layer.dataProvider().clone()
+        self.width = layer.width()
+        self.height = layer.height()
+        self.extent = layer.extent()
+        self.crs = layer.crs()
+        self.transform_context = QgsProject.instance().transformContext()
+
+    def export(self, feedback):
         pipe = QgsRasterPipe()
-        pipe.set(layer.dataProvider().clone())
-        filename = path.join(style_path, name + ".tif")
-        writer = QgsRasterFileWriter(filename)
-        writer.writeRaster(pipe, layer.width(), layer.height(), layer.extent(), layer.crs(),
-                           QgsProject().instance().transformContext())
-    else:
-        ValueError("layer type not supported")
-
-    pathqml = path.join(style_path, str(name) + '.qml')
-    pathsld = path.join(style_path, str(name) + '.sld')
-    layer.saveNamedStyle(pathqml)
-    layer.saveSldStyle(pathsld)
-
-print("\n\nExport finished")
+        pipe.set(self.provider)
+        temp_path = self.output_path + ".tmp.tif"
+        writer = QgsRasterFileWriter(temp_path)
+        try:
+            error = writer.writeRaster(pipe, self.width, self.height, self.extent, self.crs, self.transform_context,
+                                       feedback)
+            if error != QgsRasterFileWriter.NoError:
+                raise RuntimeError(f"Writing the raster failed with error {error}")
+            os.replace(temp_path, self.output_path)
+        finally:
+            # A failed or cancelled write leaves a partial file behind
+            if path.isfile(temp_path):
+                os.remove(temp_path)
+
+
+def export_layers():
+    state = load_state()
+    layers = list(QgsProject.instance().mapLayers().values())
+    exports = []
+    skipped = []
+
+    for layer in layers:
+        name = layer.name()
+        # The styles are small, so they are always written, on the main thread
+        pathqml = path.join(style_path, str(name) + '.qml')
+        pathsld = path.join(style_path, str(name) + '.sld')
+        layer.saveNamedStyle(pathqml)
+        layer.saveSldStyle(pathsld)
+
+        if isinstance(layer, QgsVectorLayer):
+            task_type, output_path = ExportVectorTask, path.join(style_path, name + ".zip")
+        elif isinstance(layer, QgsRasterLayer):
+            task_type, output_path = ExportRasterTask, path.join(style_path, name + ".tif")
+        else:
+            print(f"{name}: layer type not supported")
+            continue
+
+        # Unsaved edits are not in the source file, so such a layer is always exported and not remembered
+        modified = isinstance(layer, QgsVectorLayer) and layer.isModified()
+        fingerprint = None if modified else source_fingerprint(layer)
+        if fingerprint is not None and state.get(name) == fingerprint and path.isfile(output_path):
+            skipped.append(name)
+            continue
+        exports.append((task_type, layer, output_path, fingerprint))
+
+    if skipped:
+        print(f"Skipped {len(skipped)} layers whose source did not change: {', '.join(skipped)}")
+    if not exports:
+        print("\n\nExport finished")
+        return
+
+    # The tasks run at the same time in the background, the progress bar counts the finished layers
+    progress_bar = QProgressBar()
+    progress_bar.setMaximum(len(exports))
+    progress_bar.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+    message = iface.messageBar().createMessage(f"Exporting {len(exports)} layers")
+    message.layout().addWidget(progress_bar)
+    progress_bar.setValue(0)  # A new progress bar has no value (-1) until it is set
+    iface.messageBar().pushWidget(message, Qgis.Info)
+    finished = []
+    failed = []
+
+    def on_finished(task, result):
+        """Runs on the main thread when a task finished, failed or was cancelled."""
+        print(task.name, end=", ")
+        if result:
+            if task.fingerprint is not None:
+                state[task.name] = task.fingerprint
+        else:
+            state.pop(task.name, None)
+            failed.append(task.name)
+            print(f"\nExporting {task.name} failed: {task.error or 'cancelled'}")
+        finished.append(task.name)
+        progress_bar.setValue(len(finished))
+
+        if len(finished) == len(exports):
+            save_state(state)
+            iface.messageBar().popWidget(message)
+            export_tasks.clear()
+            print(f"\n\nExport finished, {len(exports) - len(failed)} layers exported, {len(failed)} failed")
+
+    for task_type, layer, output_path, fingerprint in exports:
+        task = task_type(layer, output_path, fingerprint, on_finished)
+        export_tasks.append(task)
+        QgsApplication.taskManager().addTask(task)
+
+
+export_layers()
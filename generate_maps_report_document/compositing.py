@@ -0,0 +1,60 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# Formats that python-docx can embed in a document
+SUPPORTED_FORMATS = ('PNG', 'JPEG')
+
+
+def load_rgba(image_bytes: bytes, size=None) -> np.ndarray:
+    """Decode an image to a float RGBA array, resized to the given (width, height) if needed."""
+    img = Image.open(BytesIO(image_bytes)).convert("RGBA")
+    if size is not None and img.size != size:
+        img = img.resize(size)
+    return np.asarray(img, dtype=np.float32)
+
+
+def composite_page_image(map_bytes: bytes, basemap_bytes: bytes, legend_bytes: bytes, alpha: float = 0.5,
+                         image_format: str = 'PNG', quality: int = 85, dpi: int = 150,
+                         width_inches: float = 5.3) -> bytes:
+    """
+    Blend the map with the basemap, overlay the legend in the bottom left corner and encode the result once.
+    The blend and overlay give the same result as Image.blend followed by Image.paste with the legend as mask.
+    The image is downscaled to the given DPI at the width it gets in the document. JPEG is smaller but does not
+    support transparency, so transparent parts are made white.
+    """
+    image_format = image_format.upper()
+    if image_format not in SUPPORTED_FORMATS:
+        raise ValueError(f"Image format {image_format} not supported. Use one of {', '.join(SUPPORTED_FORMATS)}.")
+
+    layer_map = load_rgba(map_bytes)
+    height, width = layer_map.shape[:2]
+    basemap = load_rgba(basemap_bytes, size=(width, height))
+    legend = load_rgba(legend_bytes)
+
+    # Blend the map with the basemap
+    page = layer_map * (1.0 - alpha) + basemap * alpha
+
+    # Overlay the legend in the bottom left corner, using its alpha channel as mask
+    legend = legend[-height:, :width]
+    legend_height, legend_width = legend.shape[:2]
+    mask = legend[:, :, 3:4] / 255.0
+    corner = page[height - legend_height:, :legend_width]
+    page[height - legend_height:, :legend_width] = legend * mask + corner * (1.0 - mask)
+
+    img = Image.fromarray(np.clip(np.rint(page), 0, 255).astype(np.uint8), mode="RGBA")
+
+    target_width = round(width_inches * dpi)
+    if img.width > target_width:
+        img = img.resize((target_width, round(img.height * target_width / img.width)), Image.LANCZOS)
+
+    stream = BytesIO()
+    if image_format == 'JPEG':
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        background.save(stream, format='JPEG', quality=quality, optimize=True, dpi=(dpi, dpi))
+    else:
+        img.save(stream, format='PNG', optimize=True, dpi=(dpi, dpi))
+
+    return stream.getvalue()
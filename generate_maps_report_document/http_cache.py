@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from os import path
+from typing import Optional
+
+import requests
+
+
+class CacheMissError(Exception):
+    ...
+
+
+class HttpCache:
+    """
+    A persistent on-disk cache for GET requests, keyed on the full request URL.
+    Cached responses are used without a request for ttl_seconds. After that, they are revalidated with the ETag or
+    Last-Modified header of the cached response, so unchanged images are not downloaded again.
+    When the total size of the cache exceeds max_size_bytes, the least recently used responses are removed.
+    In offline mode only cached responses are used, regardless of their age, and no requests are made at all.
+    """
+
+    def __init__(self, cache_dir: str, ttl_seconds: float = 24 * 60 * 60, max_size_bytes: int = 500 * 1024 * 1024,
+                 offline: bool = False):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_size_bytes = max_size_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, session: requests.Session, url: str) -> requests.Response:
+        """
+        Return the response for the url, from the cache when possible.
+        Responses that are not successful are returned as is and are not cached.
+        A response that is evicted by another thread or process while it is read counts as not cached.
+        """
+        body_path, meta_path = self._paths(url)
+        meta = self._read_meta(meta_path)
+        cached = meta is not None and path.isfile(body_path)
+
+        if self.offline:
+            response = self._cached_response(url, body_path) if cached else None
+            if response is None:
+                raise CacheMissError(f"{url} is not cached and the cache is in offline mode")
+            return response
+
+        if cached and time.time() - meta["fetched_at"] < self.ttl_seconds:
+            response = self._cached_response(url, body_path)
+            if response is not None:
+                return response
+            cached = False
+
+        headers = {}
+        if cached and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if cached and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = session.get(url, headers=headers)
+
+        if response.status_code == 304 and cached:
+            cached_response = self._cached_response(url, body_path)
+            if cached_response is not None:
+                meta["fetched_at"] = time.time()
+                self._write(meta_path, json.dumps(meta).encode("utf-8"))
+                return cached_response
+            # Evicted while it was revalidated, so download it again without the validators
+            response = session.get(url)
+
+        if response.status_code == 200:
+            self._write(body_path, response.content)
+            self._write(meta_path, json.dumps({"url": url,
+                                               "etag": response.headers.get("ETag"),
+                                               "last_modified": response.headers.get("Last-Modified"),
+                                               "fetched_at": time.time()}).encode("utf-8"))
+            self.evict()
+
+        return response
+
+    def evict(self) -> None:
+        """Remove the least recently used responses until the cache fits in max_size_bytes."""
+        with self._lock:
+            bodies = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(".bin"):
+                    try:
+                        bodies.append((entry.path, entry.stat()))
+                    except FileNotFoundError:
+                        pass  # Removed by another process meanwhile
+            total_size = sum(stat.st_size for _, stat in bodies)
+            for body_path, stat in sorted(bodies, key=lambda body: body[1].st_mtime):
+                if total_size <= self.max_size_bytes:
+                    break
+                total_size -= stat.st_size
+                for file_path in (body_path, body_path[:-len(".bin")] + ".json"):
+                    # Another process that shares the cache may have removed it already
+                    try:
+                        os.remove(file_path)
+                    except FileNotFoundError:
+                        pass
+
+    @staticmethod
+    def _cached_response(url: str, body_path: str) -> Optional[requests.Response]:
+        """Return the cached response, or None if it was evicted since it was found."""
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        try:
+            # Touch the body so the modification time records when it was last used
+            os.utime(body_path)
+            with open(body_path, "rb") as f:
+                response._content = f.read()
+        except FileNotFoundError:
+            return None
+        return response
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return path.join(self.cache_dir, key + ".bin"), path.join(self.cache_dir, key + ".json")
+
+    @staticmethod
+    def _read_meta(meta_path: str) -> Optional[dict]:
+        try:
+            with open(meta_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write(file_path: str, content: bytes) -> None:
+        # Write to a temporary file first so other threads and processes never read a partially written file
+        temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(content)
+        os.replace(temp_path, file_path)
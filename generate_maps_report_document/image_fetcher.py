@@ -0,0 +1,79 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from scripts.generate_maps_report_document.http_cache import HttpCache
+
+GEOSERVER_URL = "https://gaa-proxy.azurewebsites.net/geoserver"
+OSM_URL = "https://ows.terrestris.de/osm/service"
+
+
+@dataclass
+class LayerImages:
+    """The raw image bytes that are needed to create the map of a single layer."""
+    map: bytes
+    basemap: bytes
+    legend: bytes
+
+
+def wms_url(filename: str, bbox: str) -> str:
+    file_name_without_ext = os.path.splitext(filename)[0]
+    return f"{GEOSERVER_URL}/gaa-dev/wms?SERVICE=WMS&VERSION=1.3.0&REQUEST=GetMap&FORMAT=image%2Fpng&TRANSPARENT=true&STYLES&LAYERS=gaa-dev%3A{file_name_without_ext}&exceptions=application%2Fvnd.ogc.se_inimage&SRS=EPSG%3A4326&WIDTH=747&HEIGHT=768&BBOX={bbox}"
+
+
+def osm_url(bbox: str) -> str:
+    return f"{OSM_URL}?SERVICE=WMS&VERSION=1.3.0&REQUEST=GetMap&FORMAT=image%2Fpng&TRANSPARENT=true&LAYERS=OSM-WMS&STYLES&TILED=false&WIDTH=747&HEIGHT=768&CRS=EPSG%3A4326&BBOX={bbox}"
+
+
+def legend_url(filename: str) -> str:
+    file_name_without_ext = os.path.splitext(filename)[0]
+    return f"{GEOSERVER_URL}/wms?REQUEST=GetLegendGraphic&VERSION=1.0.0&FORMAT=image/png&WIDTH=20&HEIGHT=20&STRICT=false&LAYER=gaa-dev:{file_name_without_ext}"
+
+
+class ImageFetcher:
+    """
+    Downloads the map, basemap and legend images of many layers at the same time.
+    The number of worker threads is also the maximum number of open connections.
+    When a cache is given, all requests go through it.
+    """
+
+    def __init__(self, bbox: str, max_workers: int = 8, cache: Optional[HttpCache] = None):
+        self.bbox = bbox
+        self.max_workers = max_workers
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch_all(self, filenames: List[str]) -> Dict[str, LayerImages]:
+        """Fetch the images of all the given layer files, keyed on the filename."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # The basemap has the same bbox and size for every layer, so it is only fetched once
+            basemap_future = executor.submit(self.get, osm_url(self.bbox), 'OpenStreetMap')
+            map_futures = {filename: executor.submit(self.get, wms_url(filename, self.bbox), 'GeoServer')
+                           for filename in filenames}
+            legend_futures = {filename: executor.submit(self.get, legend_url(filename), 'GeoServer legend')
+                              for filename in filenames}
+
+            basemap = basemap_future.result()
+            return {filename: LayerImages(map=map_futures[filename].result(),
+                                          basemap=basemap,
+                                          legend=legend_futures[filename].result())
+                    for filename in filenames}
+
+    def get(self, url: str, source: str) -> bytes:
+        if self.cache is not None:
+            response = self.cache.get(self.session, url)
+        else:
+            response = self.session.get(url)
+
+        # Check if the request was successful
+        if response.status_code != 200:
+            raise Exception(f'Failed to fetch image from {source}')
+
+        return response.content
@@ -0,0 +1,242 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from os import path
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import requests
+from PIL import Image, ImageDraw, ImageFont
+
+from scripts.generate_maps_report_document.image_fetcher import LayerImages, osm_url
+from scripts.generate_maps_report_document.sld_parser import (ColorMap, ColorMapEntry, LayerStyle, VectorRule,
+                                                              parse_sld)
+
+try:
+    from osgeo import gdal, ogr, osr
+except ImportError:
+    raise ImportError("The local renderer reads the data with the GDAL Python bindings, which are not installed. "
+                      "Install them or use the image of deploy_data, which includes them.")
+
+gdal.UseExceptions()
+ogr.UseExceptions()
+
+# The same size as the WMS images, so the pages look the same in both modes
+WIDTH = 747
+HEIGHT = 768
+LEGEND_SWATCH = 20
+
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    """Convert a WMS 1.3.0 EPSG:4326 bbox (min lat, min lon, max lat, max lon) to min x, min y, max x, max y."""
+    min_lat, min_lon, max_lat, max_lon = (float(value) for value in bbox.split(","))
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    stream = BytesIO()
+    Image.fromarray(rgba, mode="RGBA").save(stream, format="PNG")
+    return stream.getvalue()
+
+
+class LocalRenderer:
+    """
+    Renders the map and legend images of layers from the files in the data folder, instead of fetching them from
+    GeoServer. The colours come from the layer's .sld file, the basemap is a local image instead of OpenStreetMap.
+    The basemap is downloaded from the OpenStreetMap WMS once, when the basemap file does not exist yet, so it looks
+    the same as in the WMS mode and later runs work offline.
+    The layers are rendered in parallel processes. It has the same fetch_all as the ImageFetcher, so both can be used.
+    """
+
+    def __init__(self, data_path: str, bbox: str, basemap_path: Optional[str] = None,
+                 max_workers: Optional[int] = None):
+        self.data_path = data_path
+        self.wms_bbox = bbox
+        self.bbox = parse_bbox(bbox)
+        self.basemap_path = basemap_path
+        self.max_workers = max_workers
+
+    def fetch_all(self, filenames: List[str]) -> Dict[str, LayerImages]:
+        """Render the images of all the given layer files, keyed on the filename."""
+        basemap = self.load_basemap()
+        if self.max_workers == 1:
+            # Render in this process, such as when the report is already built in several worker processes
+            results = [render_layer(self.data_path, filename, self.bbox) for filename in filenames]
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(render_layer, [self.data_path] * len(filenames), filenames,
+                                            [self.bbox] * len(filenames)))
+        return {filename: LayerImages(map=map_image, basemap=basemap, legend=legend)
+                for filename, (map_image, legend) in zip(filenames, results)}
+
+    def load_basemap(self) -> bytes:
+        if self.basemap_path is not None and not path.isfile(self.basemap_path):
+            self.download_basemap()
+        if self.basemap_path is not None and path.isfile(self.basemap_path):
+            with open(self.basemap_path, "rb") as f:
+                return f.read()
+
+        print(f"Basemap {self.basemap_path} not found, using a plain background")
+        return encode_png(np.full((HEIGHT, WIDTH, 4), (242, 239, 233, 255), dtype=np.uint8))
+
+    def download_basemap(self) -> None:
+        """Save the OpenStreetMap image of the bbox as the basemap file, which is the basemap of the WMS mode."""
+        print(f"Downloading the basemap to {self.basemap_path}")
+        try:
+            r = requests.get(osm_url(self.wms_bbox), timeout=60)
+            r.raise_for_status()
+            if not r.headers.get("content-type", "").startswith("image/"):
+                raise ValueError(f"The WMS returned {r.headers.get('content-type')} instead of an image")
+        except Exception as e:
+            print(f"Could not download the basemap: {e}")
+            return
+
+        # The shard processes can download it at the same time, so it is written under a temporary name first
+        fd, temp_path = tempfile.mkstemp(suffix=".png", dir=path.dirname(path.abspath(self.basemap_path)))
+        with os.fdopen(fd, "wb") as f:
+            f.write(r.content)
+        os.replace(temp_path, self.basemap_path)
+
+
+def render_layer(data_path: str, filename: str, bbox: Tuple[float, float, float, float]) -> Tuple[bytes, bytes]:
+    """Render the map and the legend of a single layer as PNG images."""
+    print(f"Rendering the map of {filename}")
+    style = parse_sld(path.join(data_path, Path(filename).stem + ".sld"))
+    data_file_path = path.join(data_path, filename)
+
+    # The data folder has GeoTIFF rasters and zipped shapefiles, like the deploy expects
+    if Path(filename).suffix.lower() in (".tif", ".tiff"):
+        values, valid = read_raster(data_file_path, bbox)
+        if style.color_map is None:
+            style.color_map = grayscale_color_map(values, valid)
+        map_image = apply_color_map(values, valid, style.color_map)
+    else:
+        map_image = render_vector(data_file_path, style.rules, bbox)
+
+    return encode_png(map_image), render_legend(style)
+
+
+def read_raster(raster_path: str, bbox: Tuple[float, float, float, float]) -> Tuple[np.ndarray, np.ndarray]:
+    """Warp the first band of the raster to the bbox and image size. Returns the values and a mask of valid values."""
+    dataset = gdal.Warp("", raster_path, format="MEM", outputBounds=bbox, width=WIDTH, height=HEIGHT,
+                        dstSRS="EPSG:4326", resampleAlg="near", dstNodata=np.nan, outputType=gdal.GDT_Float64)
+    values = dataset.GetRasterBand(1).ReadAsArray()
+    return values, np.isfinite(values)
+
+
+def grayscale_color_map(values: np.ndarray, valid: np.ndarray) -> ColorMap:
+    """Stretch the values from black to white, like GeoServer does for rasters without a ColorMap."""
+    low, high = (float(values[valid].min()), float(values[valid].max())) if valid.any() else (0.0, 1.0)
+    return ColorMap("ramp", [ColorMapEntry(low, (0, 0, 0, 255), f"{low:g}"),
+                             ColorMapEntry(high, (255, 255, 255, 255), f"{high:g}")])
+
+
+def apply_color_map(values: np.ndarray, valid: np.ndarray, color_map: ColorMap) -> np.ndarray:
+    """Colour all pixels at once, following the ramp, intervals and values types of GeoServer's ColorMap."""
+    quantities = np.array([entry.quantity for entry in color_map.entries])
+    colors = np.array([entry.color for entry in color_map.entries], dtype=np.float64)
+    rgba = np.zeros(values.shape + (4,), dtype=np.float64)
+    if not len(quantities):
+        return rgba.astype(np.uint8)
+
+    filled = np.where(valid, values, quantities[0])
+    if color_map.type == "values":
+        index = np.clip(np.searchsorted(quantities, filled), 0, len(quantities) - 1)
+        valid = valid & (quantities[index] == filled)
+        rgba = colors[index]
+    elif color_map.type == "intervals":
+        # Every entry colours the values from the previous quantity up to, but not including, its own quantity
+        index = np.searchsorted(quantities, filled, side="right")
+        valid = valid & (index < len(quantities))
+        rgba = colors[np.clip(index, 0, len(quantities) - 1)]
+    else:
+        for channel in range(4):
+            rgba[:, :, channel] = np.interp(filled, quantities, colors[:, channel])
+
+    rgba[~valid] = 0
+    return np.rint(rgba).astype(np.uint8)
+
+
+def render_vector(zip_path: str, rules: List[VectorRule], bbox: Tuple[float, float, float, float]) -> np.ndarray:
+    """
+    Rasterize the features that match each rule with GDAL and colour the masks with NumPy, drawing the rules in
+    order. The features are reprojected to EPSG:4326 first.
+    """
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(4326)
+    wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    source = gdal.OpenEx(f"/vsizip/{zip_path}", gdal.OF_VECTOR)
+    features = gdal.VectorTranslate("", source, format="Memory", dstSRS="EPSG:4326", reproject=True)
+    layer = features.GetLayer(0)
+
+    rgba = np.zeros((HEIGHT, WIDTH, 4), dtype=np.float64)
+    for rule in rules:
+        layer.SetAttributeFilter(rule.where)
+        if rule.fill is not None:
+            mask = rasterize(layer, wgs84, bbox, all_touched=rule.point_size > 0)
+            if rule.point_size > 1:
+                mask = dilate(mask, rule.point_size // 2)
+            draw(rgba, mask, rule.fill)
+        if rule.stroke is not None:
+            draw(rgba, outline(rasterize(layer, wgs84, bbox, all_touched=True)), rule.stroke)
+    layer.SetAttributeFilter(None)
+
+    return np.rint(rgba).astype(np.uint8)
+
+
+def rasterize(layer, srs, bbox: Tuple[float, float, float, float], all_touched: bool) -> np.ndarray:
+    min_x, min_y, max_x, max_y = bbox
+    dataset = gdal.GetDriverByName("MEM").Create("", WIDTH, HEIGHT, 1, gdal.GDT_Byte)
+    dataset.SetGeoTransform((min_x, (max_x - min_x) / WIDTH, 0.0, max_y, 0.0, -(max_y - min_y) / HEIGHT))
+    dataset.SetProjection(srs.ExportToWkt())
+    gdal.RasterizeLayer(dataset, [1], layer, burn_values=[1], options=[f"ALL_TOUCHED={str(all_touched).upper()}"])
+    return dataset.GetRasterBand(1).ReadAsArray().astype(bool)
+
+
+def outline(mask: np.ndarray) -> np.ndarray:
+    """Return the pixels of the mask that border a pixel outside it, which are the lines of the features."""
+    padded = np.pad(mask, 1)
+    interior = padded[:-2, 1:-1] & padded[2:, 1:-1] & padded[1:-1, :-2] & padded[1:-1, 2:]
+    return mask & ~interior
+
+
+def dilate(mask: np.ndarray, radius: int) -> np.ndarray:
+    padded = np.pad(mask, radius)
+    result = np.zeros_like(mask)
+    for dy in range(2 * radius + 1):
+        for dx in range(2 * radius + 1):
+            result |= padded[dy:dy + mask.shape[0], dx:dx + mask.shape[1]]
+    return result
+
+
+def draw(rgba: np.ndarray, mask: np.ndarray, color) -> None:
+    """Draw the colour over the image where the mask is set, with the colour's opacity."""
+    color = np.array(color, dtype=np.float64)
+    alpha = color[3] / 255.0
+    rgba[mask, :3] = color[:3] * alpha + rgba[mask, :3] * (1.0 - alpha)
+    rgba[mask, 3] = np.maximum(rgba[mask, 3], color[3])
+
+
+def render_legend(style: LayerStyle) -> bytes:
+    """Draw a legend like GeoServer's GetLegendGraphic: a swatch and a label for every colour map entry or rule."""
+    if style.color_map is not None:
+        items = [(entry.color, entry.label) for entry in style.color_map.entries]
+    else:
+        items = [(rule.fill or rule.stroke or (0, 0, 0, 0), rule.label) for rule in style.rules]
+
+    font = ImageFont.load_default()
+    label_width = max([round(font.getlength(label)) for _, label in items] + [0])
+    legend = Image.new("RGBA", (LEGEND_SWATCH + label_width + 12, max(len(items), 1) * LEGEND_SWATCH + 4),
+                       (255, 255, 255, 255))
+    drawing = ImageDraw.Draw(legend)
+    for i, (color, label) in enumerate(items):
+        top = 2 + i * LEGEND_SWATCH
+        drawing.rectangle((2, top + 2, LEGEND_SWATCH - 2, top + LEGEND_SWATCH - 2), fill=tuple(color),
+                          outline=(0, 0, 0, 255))
+        drawing.text((LEGEND_SWATCH + 4, top + 4), label, fill=(0, 0, 0, 255), font=font)
+
+    stream = BytesIO()
+    legend.save(stream, format="PNG")
+    return stream.getvalue()
@@ -1,12 +1,36 @@
+import argparse
 import os
+import posixpath
+import re
+import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
 from io import BytesIO
+from os import path
+from typing import Dict, List, Optional, Tuple
 
-from PIL import Image
 import docx
 import pandas as pd
-import requests
 from docx import Document
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.ns import qn
 from docx.shared import Pt
+from lxml import etree
+
+from scripts.deploy_data.metadata import read_metadata_table
+from scripts.generate_maps_report_document.compositing import composite_page_image
+from scripts.generate_maps_report_document.http_cache import HttpCache
+from scripts.generate_maps_report_document.image_fetcher import ImageFetcher, LayerImages
+from scripts.generate_maps_report_document.page_cache import (PageAssets, PageCache, hash_bytes, layer_files_hash,
+                                                              page_key)
+
+# The parts of a Word document that merge_documents changes
+DOCUMENT_PART = 'word/document.xml'
+DOCUMENT_RELS_PART = 'word/_rels/document.xml.rels'
+CONTENT_TYPES_PART = '[Content_Types].xml'
+RELS_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+CT_NS = 'http://schemas.openxmlformats.org/package/2006/content-types'
 
 
 def add_hyperlink(paragraph, text, url):
@@ -70,17 +94,125 @@ def add_paragraph(doc, text, line_spacing=1.0):
     return p
 
 
-def run():
-    # Step 2: Read the Excel file
-    df = pd.read_excel('gaa_metadata_restructured.xlsx')
+def render_page(row, layer_images: LayerImages, image_format: str, image_quality: int, image_dpi: int) -> PageAssets:
+    """Render the metadata text and the map image of a single layer."""
+    # Blend the map with the basemap, add the legend and encode the page image once
+    page_image = composite_page_image(layer_images.map, layer_images.basemap, layer_images.legend, alpha=0.5,
+                                      image_format=image_format, quality=image_quality, dpi=image_dpi)
 
-    # Step 3: Extract the required columns
-    df = df[['parent_group', 'filename', 'full_name', 'description', 'keywords', 'source', 'date', 'coverage', 'resolution']]
+    # If the source is a URL, it is added as a hyperlink. Otherwise, the text 'no online source available' is used
+    return PageAssets(full_name=row['full_name'],
+                      paragraphs=['description: ' + str(row['description']), 'keywords: ' + str(row['keywords'])],
+                      source=None if pd.isnull(row['source']) else row['source'],
+                      closing_paragraphs=['date: ' + str(row['date']), 'coverage: ' + str(row['coverage'])],
+                      image=page_image)
+
+
+def add_page(doc, page: PageAssets):
+    doc.add_heading(page.full_name)
+
+    for text in page.paragraphs:
+        add_paragraph(doc, text)
+
+    if page.source is None:
+        add_paragraph(doc, 'source: no online source available')
+    else:
+        p = add_paragraph(doc, 'source: ')
+        add_hyperlink(p, 'link', page.source)
+
+    for text in page.closing_paragraphs:
+        add_paragraph(doc, text)
+
+    # Add the resulting image to the Word document
+    doc.add_picture(BytesIO(page.image), width=docx.shared.Inches(5.3))
+
+
+@dataclass
+class ReportSettings:
+    """The settings of run() that the worker processes need to build their part of the report."""
+    bbox: str
+    image_format: str
+    image_quality: int
+    image_dpi: int
+    renderer: str
+    data_path: Optional[str]
+    basemap_path: Optional[str]
+    offline: bool
+    fetch_threads: int
+    render_processes: int
+
+    def cache_settings(self) -> dict:
+        """The settings that change the pages, which are part of the page cache keys."""
+        return {'bbox': self.bbox, 'image_format': self.image_format, 'image_quality': self.image_quality,
+                'image_dpi': self.image_dpi, 'renderer': self.renderer, 'basemap_path': self.basemap_path}
+
+
+def make_shards(df: pd.DataFrame, shard_by: str, shard_size: int) -> List[Tuple[str, pd.DataFrame]]:
+    """
+    Split the sorted rows into named shards, either one per parent group or in consecutive runs of shard_size
+    rows. Both keep the alphabetical order within a shard, merge_documents restores it across the shards.
+    """
+    if shard_by == 'group':
+        # Rows without a parent group are kept too, in a shard of their own
+        return [('no_parent_group' if pd.isnull(group) else str(group), rows)
+                for group, rows in df.groupby('parent_group', sort=True, dropna=False)]
+    return [(f'part_{i // shard_size + 1:03d}', df.iloc[i:i + shard_size]) for i in range(0, len(df), shard_size)]
 
-    # Order the dataframe alphabetically by full_name
-    df = df.sort_values(by='full_name')
 
-    # Step 4: Create a new Word document
+def build_pages(rows: Dict[str, dict], settings: ReportSettings) -> Tuple[Dict[str, PageAssets], Dict[str, str]]:
+    """
+    Get the pages of the rows, keyed on the filename, from the page cache or by fetching and rendering them.
+    Finished pages are cached, keyed on the metadata row, the settings and the content of the map.
+    When data_path is set to the data folder that is deployed to GeoServer, the content is the layer's style and
+    data file, so unchanged layers are not fetched at all. Otherwise, the fetched images are compared.
+    Also returns the page cache key of every filename.
+    """
+    page_cache = PageCache('.page_cache')
+    cache_settings = settings.cache_settings()
+
+    page_keys = {}
+    if settings.data_path is not None:
+        page_keys = {filename: page_key(row, cache_settings, layer_files_hash(settings.data_path, filename))
+                     for filename, row in rows.items()}
+    pages = {filename: page_cache.get(key) for filename, key in page_keys.items()}
+
+    # Download or render the images of the remaining layers at the same time, before building the document in the
+    # sorted order
+    if settings.renderer == 'local':
+        if settings.data_path is None:
+            raise ValueError('The local renderer needs the data_path of the data folder')
+        # Imported here, because the local renderer needs GDAL, which the WMS mode does not
+        from scripts.generate_maps_report_document.local_renderer import LocalRenderer
+        fetcher = LocalRenderer(settings.data_path, settings.bbox, basemap_path=settings.basemap_path,
+                                max_workers=settings.render_processes)
+    else:
+        cache = HttpCache('.http_cache', ttl_seconds=24 * 60 * 60, max_size_bytes=500 * 1024 * 1024,
+                          offline=settings.offline)
+        fetcher = ImageFetcher(settings.bbox, max_workers=settings.fetch_threads, cache=cache)
+    filenames_to_fetch = [filename for filename in rows if pages.get(filename) is None]
+    images = fetcher.fetch_all(filenames_to_fetch)
+
+    rendered = 0
+    for filename in filenames_to_fetch:
+        # The map image of the layer, the basemap and the legend of Africa
+        layer_images = images[filename]
+        if filename not in page_keys:
+            content_hash = hash_bytes(layer_images.map, layer_images.basemap, layer_images.legend)
+            page_keys[filename] = page_key(rows[filename], cache_settings, content_hash)
+            pages[filename] = page_cache.get(page_keys[filename])
+
+        if pages[filename] is None:
+            print(f"Rendering {rows[filename]['full_name']}")
+            pages[filename] = render_page(rows[filename], layer_images, settings.image_format,
+                                          settings.image_quality, settings.image_dpi)
+            page_cache.put(page_keys[filename], pages[filename], filename)
+            rendered += 1
+
+    print(f"Rendered {rendered} pages, used {len(rows) - rendered} pages from the cache")
+    return pages, page_keys
+
+
+def new_document():
     doc = Document()
 
     style = doc.styles['Normal']
@@ -88,99 +220,214 @@ def run():
     font.name = 'Calibri'
     font.size = Pt(10)
 
-    bbox = "-45,-25,40,60"
+    return doc
 
-    # Step 5: Iterate over the rows of the DataFrame
-    for index, row in df.iterrows():
-        # Stop at row 5
-        # if index == 5:
-        #     break
 
-        # Only include rows whose parent_group is "Geoscientific"
-        if row['parent_group'] != 'Geoscientific':
-            continue
+def build_document(rows: List[dict], settings: ReportSettings, output_path: str) -> Dict[str, str]:
+    """
+    Build the document of a shard of rows and save it to output_path. Runs in a worker process, so only the
+    images of this shard are in memory at the same time. Returns the page cache key of every filename.
+    """
+    pages, page_keys = build_pages({row['filename']: row for row in rows}, settings)
 
+    doc = new_document()
+    # The merged document keeps the styles of the first shard, so every shard defines the hyperlink style
+    get_or_create_hyperlink_style(doc)
+    for i, row in enumerate(rows):
         print(row['full_name'])
         # Add a new page
-        if index != 0:
+        if i != 0:
             doc.add_page_break()
 
-        doc.add_heading(row['full_name'])
-
-        add_paragraph(doc, 'description: ' + str(row['description']))
-        add_paragraph(doc, 'keywords: ' + str(row['keywords']))
-
-        # If the source is a URL, add a hyperlink to it. Otherwise, use the text 'no online source available'
-        if pd.isnull(row['source']):
-            add_paragraph(doc, 'source: no online source available')
-        else:
-            p = add_paragraph(doc, 'source: ')
-            add_hyperlink(p, 'link', row['source'])
-
-        add_paragraph(doc, 'date: ' + str(row['date']))
-        add_paragraph(doc, 'coverage: ' + str(row['coverage']))
-
-        # Add a GeoServer WMS request for a JPG image of Africa
-        file_name_without_ext = os.path.splitext(row['filename'])[0]
-        wms_url = f"https://gaa-proxy.azurewebsites.net/geoserver/gaa-dev/wms?SERVICE=WMS&VERSION=1.3.0&REQUEST=GetMap&FORMAT=image%2Fpng&TRANSPARENT=true&STYLES&LAYERS=gaa-dev%3A{file_name_without_ext}&exceptions=application%2Fvnd.ogc.se_inimage&SRS=EPSG%3A4326&WIDTH=747&HEIGHT=768&BBOX={bbox}"
-        response = requests.get(wms_url)
+        add_page(doc, pages[row['filename']])
 
-        # Check if the request was successful
-        if response.status_code != 200:
-            raise Exception('Failed to fetch image from GeoServer')
+    doc.save(output_path)
+    return page_keys
 
-        # Add a OpenStreetMap WMS request for a PNG image of Africa
-        osm_url = f"https://ows.terrestris.de/osm/service?SERVICE=WMS&VERSION=1.3.0&REQUEST=GetMap&FORMAT=image%2Fpng&TRANSPARENT=true&LAYERS=OSM-WMS&STYLES&TILED=false&WIDTH=747&HEIGHT=768&CRS=EPSG%3A4326&BBOX={bbox}"
-        response_osm = requests.get(osm_url)
 
-        # Check if the request was successful
-        if response_osm.status_code != 200:
-            raise Exception('Failed to fetch image from OpenStreetMap')
+def merge_documents(document_paths: List[str], output_path: str,
+                    page_order: Optional[List[Tuple[int, int]]] = None) -> None:
+    """
+    Merge the documents into one and save it. The page_order lists the pages of the result as (document index, page
+    index) pairs, such as the alphabetical order over all the documents. By default, the documents follow each other.
+    The documents are merged as zip files: only the XML of the documents is in memory, the images are copied from
+    the shard files to the output one at a time, so the memory use does not grow with the size of the report.
+    """
+    with zipfile.ZipFile(document_paths[0]) as first:
+        document = etree.fromstring(first.read(DOCUMENT_PART))
+        rels = etree.fromstring(first.read(DOCUMENT_RELS_PART))
+        content_types = etree.fromstring(first.read(CONTENT_TYPES_PART))
+
+    body = document.find(qn('w:body'))
+    section = body.find(qn('w:sectPr'))
+    rel_ids = {rel.get('Id') for rel in rels}
+    known_extensions = {default.get('Extension').lower() for default in content_types.iter(f'{{{CT_NS}}}Default')}
+    extensions = set()
+    copied_media = []  # (shard path, name in the shard, name in the output)
+
+    def new_rel(target: str, rel_type: str, external: bool) -> str:
+        r_id = f'rId{len(rel_ids) + 1}'
+        while r_id in rel_ids:
+            r_id = f'rId{int(r_id[3:]) + 1}'
+        rel_ids.add(r_id)
+        rel = etree.SubElement(rels, f'{{{RELS_NS}}}Relationship', Id=r_id, Type=rel_type, Target=target)
+        if external:
+            rel.set('TargetMode', 'External')
+        return r_id
+
+    pages = [split_pages(body)]  # The pages of every document, as lists of body elements
+    for i, document_path in enumerate(document_paths[1:], start=1):
+        with zipfile.ZipFile(document_path) as shard:
+            shard_body = etree.fromstring(shard.read(DOCUMENT_PART)).find(qn('w:body'))
+            shard_rels = {rel.get('Id'): rel for rel in etree.fromstring(shard.read(DOCUMENT_RELS_PART))}
+
+        # The images and hyperlinks refer to relationships of the shard, which are added to the output
+        image_rel_ids = {}  # The same image can be used more than once, it is copied once
+        for blip in shard_body.iter(qn('a:blip')):
+            target = shard_rels[blip.get(qn('r:embed'))].get('Target')
+            if target not in image_rel_ids:
+                name = f'media/shard{i}_{posixpath.basename(target)}'
+                source_name = posixpath.normpath(posixpath.join('word', target))
+                copied_media.append((document_path, source_name, f'word/{name}'))
+                extensions.add(posixpath.splitext(name)[1][1:].lower())
+                image_rel_ids[target] = new_rel(name, RT.IMAGE, external=False)
+            blip.set(qn('r:embed'), image_rel_ids[target])
+        for hyperlink in shard_body.iter(qn('w:hyperlink')):
+            url = shard_rels[hyperlink.get(qn('r:id'))].get('Target')
+            hyperlink.set(qn('r:id'), new_rel(url, RT.HYPERLINK, external=True))
+        pages.append(split_pages(shard_body))
+
+    if page_order is None:
+        page_order = [(i, j) for i, document_pages in enumerate(pages) for j in range(len(document_pages))]
+    for element in list(body):
+        if element is not section:
+            body.remove(element)
+    for n, (i, j) in enumerate(page_order):
+        if n != 0:
+            section.addprevious(page_break())
+        for element in pages[i][j]:
+            section.addprevious(element)
+
+    # Word expects the ids of the pictures to be unique
+    for picture_id, doc_pr in enumerate(document.iter(qn('wp:docPr')), start=1):
+        doc_pr.set('id', str(picture_id))
+    for extension in sorted(extensions - known_extensions):
+        etree.SubElement(content_types, f'{{{CT_NS}}}Default', Extension=extension,
+                         ContentType='image/jpeg' if extension in ('jpg', 'jpeg') else f'image/{extension}')
+
+    replaced_parts = {DOCUMENT_PART: document, DOCUMENT_RELS_PART: rels, CONTENT_TYPES_PART: content_types}
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as output:
+        with zipfile.ZipFile(document_paths[0]) as first:
+            for info in first.infolist():
+                if info.filename in replaced_parts:
+                    output.writestr(info.filename, etree.tostring(replaced_parts[info.filename], xml_declaration=True,
+                                                                  encoding='UTF-8', standalone=True))
+                else:
+                    copy_zip_entry(first, info.filename, output, info.filename)
+        for document_path, source_name, output_name in copied_media:
+            with zipfile.ZipFile(document_path) as shard:
+                copy_zip_entry(shard, source_name, output, output_name)
+
+
+def split_pages(body) -> List[list]:
+    """Split the elements of a document body at the page breaks that build_document adds between the pages."""
+    pages = [[]]
+    for element in body:
+        if element.tag == qn('w:sectPr'):
+            continue
+        if element.tag == qn('w:p') and any(br.get(qn('w:type')) == 'page' for br in element.iter(qn('w:br'))):
+            pages.append([])
+        else:
+            pages[-1].append(element)
+    return pages
 
-        img1 = Image.open(BytesIO(response.content)).convert("RGBA")
-        img2 = Image.open(BytesIO(response_osm.content)).convert("RGBA")
 
-        # Ensure the images are the same size
-        if img1.size != img2.size:
-            img2 = img2.resize(img1.size)
+def page_break():
+    paragraph = docx.oxml.shared.OxmlElement('w:p')
+    run = docx.oxml.shared.OxmlElement('w:r')
+    br = docx.oxml.shared.OxmlElement('w:br')
+    br.set(qn('w:type'), 'page')
+    run.append(br)
+    paragraph.append(run)
+    return paragraph
 
-        # Blend the images
-        alpha = 0.5  # set your own alpha
-        img_blend = Image.blend(img1, img2, alpha)
 
-        # Save the result to a BytesIO stream
-        image_stream_blend = BytesIO()
-        img_blend.save(image_stream_blend, format='PNG')
+def copy_zip_entry(source: zipfile.ZipFile, source_name: str, output: zipfile.ZipFile, output_name: str) -> None:
+    """Copy a file from one zip to the other in chunks."""
+    with source.open(source_name) as src, output.open(output_name, 'w') as dst:
+        shutil.copyfileobj(src, dst)
 
-        # Get the legend graphic
-        legend_url = f"https://gaa-proxy.azurewebsites.net/geoserver/wms?REQUEST=GetLegendGraphic&VERSION=1.0.0&FORMAT=image/png&WIDTH=20&HEIGHT=20&STRICT=false&style=gaa-dev:{file_name_without_ext}_style"
-        response_legend = requests.get(legend_url)
 
-        # Check if the request was successful
-        if response_legend.status_code != 200:
-            raise Exception('Failed to fetch legend from GeoServer')
+def parse_arguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Create a Word document with a page per layer of the metadata')
+    parser.add_argument('--metadata', default='gaa_metadata_restructured.xlsx', help='The metadata Excel file')
+    parser.add_argument('--parent-groups', nargs='*', default=['Geoscientific'],
+                        help='Only include rows of these parent groups. Give no groups to include all rows')
+    parser.add_argument('--shard-by', choices=['count', 'group'], default='count',
+                        help='Split the rows in runs of --shard-size rows or in one shard per parent group')
+    parser.add_argument('--shard-size', type=int, default=25, help='Number of rows per shard when sharding by count')
+    parser.add_argument('--workers', type=int, default=None, help='Number of shards built at the same time')
+    parser.add_argument('--split', action='store_true',
+                        help='Keep a document per shard, named after the output, instead of merging them')
+    parser.add_argument('--output', default='output.docx', help='The Word document to create')
+    return parser.parse_args(argv)
 
-        # Open the third image
-        img3 = Image.open(BytesIO(response_legend.content)).convert("RGBA")
 
-        # Resize the third image to the desired size for the overlay
-        # overlay_size = (200, 200)  # set your own overlay size
-        # img3 = img3.resize(overlay_size)
+def run(argv: Optional[List[str]] = None):
+    args = parse_arguments(argv)
 
-        # Paste the third image onto the blended image in the bottom left corner
-        bottom_left_corner = (0, img_blend.height - img3.height)
-        img_blend.paste(img3, bottom_left_corner, img3)
+    # Step 2: Read the Excel file
+    df = read_metadata_table(args.metadata)
 
-        # Save the result to a BytesIO stream
-        image_stream_blend = BytesIO()
-        img_blend.save(image_stream_blend, format='PNG')
+    # Step 3: Extract the required columns
+    df = df[['parent_group', 'filename', 'full_name', 'description', 'keywords', 'source', 'date', 'coverage', 'resolution']]
 
-        # Add the resulting image to the Word document
-        image_stream_blend.seek(0)  # Go to the start of the BytesIO stream
-        doc.add_picture(image_stream_blend, width=docx.shared.Inches(5.3))
+    # Order the dataframe alphabetically by full_name
+    df = df.sort_values(by='full_name')
 
-    # Step 6: Save the Word document
-    doc.save('output.docx')
+    settings = ReportSettings(
+        bbox="-45,-25,40,60",
+        image_format='PNG',  # PNG or JPEG. JPEG makes the document much smaller
+        image_quality=85,  # Only used for JPEG
+        image_dpi=150,  # Resolution of the map images at their width of 5.3 inches in the document
+        renderer='wms',  # wms fetches the maps from GeoServer and OpenStreetMap, local renders them from data_path
+        data_path=None,  # The data folder that is deployed to GeoServer, required for the local renderer
+        basemap_path='basemap.png',  # The basemap image of the local renderer, covering the bbox
+        offline=False,  # Set to True to build the report from the cached images only
+        fetch_threads=8,  # Number of images downloaded at the same time, shared by the shard processes
+        render_processes=os.cpu_count() or 1,  # Number of layers rendered at the same time by the local renderer
+    )
+
+    # Only include rows of the selected parent groups, such as "Geoscientific"
+    if args.parent_groups:
+        df = df[df['parent_group'].isin(args.parent_groups)]
+
+    # Step 4: Build a document per shard in worker processes, which each fetch or render only their own pages
+    shards = make_shards(df, args.shard_by, args.shard_size)
+    output_stem = path.splitext(args.output)[0]
+    shard_paths = [f'{output_stem}_{re.sub(r"[^A-Za-z0-9_-]+", "_", name)}.docx' for name, _ in shards]
+    print(f'Building {len(df)} pages in {len(shards)} shards')
+    workers = max(1, min(args.workers or os.cpu_count() or 1, len(shards)))
+    # The shard processes share the download threads and render processes, instead of each using all of them
+    shard_settings = replace(settings, fetch_threads=max(1, settings.fetch_threads // workers),
+                             render_processes=max(1, settings.render_processes // workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        page_keys = executor.map(build_document, [rows.to_dict('records') for _, rows in shards],
+                                 [shard_settings] * len(shards), shard_paths)
+        used_page_keys = {filename: key for keys in page_keys for filename, key in keys.items()}
+    # The old versions of the pages of changed layers are removed from the cache
+    PageCache('.page_cache').prune(used_page_keys)
+
+    # Step 5: Merge the documents of the shards in order and save the Word document
+    if not args.split and shard_paths:
+        # Shards by group each hold a part of the alphabet, so the pages are put back in the order of the rows
+        positions = {index: (i, j) for i, (_, rows) in enumerate(shards) for j, index in enumerate(rows.index)}
+        merge_documents(shard_paths, args.output, [positions[index] for index in df.index])
+        for shard_path in shard_paths:
+            os.remove(shard_path)
+        print(f'Saved {args.output}')
+    else:
+        print(f'Saved {", ".join(shard_paths)}')
 
 
 if __name__ == '__main__':
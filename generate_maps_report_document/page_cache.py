@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass
+from os import path
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from scripts.deploy_data.manifest import hash_file
+
+
+@dataclass
+class PageAssets:
+    """The finished content of a single page of the report: the metadata text and the composited map image."""
+    full_name: str
+    paragraphs: List[str]
+    source: Optional[str]  # A URL that is linked after the paragraphs, or None when there is no online source
+    closing_paragraphs: List[str]
+    image: bytes
+
+
+def page_key(row: dict, settings: dict, content_hash: str) -> str:
+    """
+    Create the cache key of a page from the metadata row, the render settings (such as the bbox and image format)
+    and a hash of the content that the map is made from, such as the fetched images or the layer's style.
+    """
+    key_data = json.dumps({"row": row, "settings": settings, "content": content_hash}, sort_keys=True, default=str)
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+def hash_bytes(*contents: bytes) -> str:
+    content_hash = hashlib.sha256()
+    for content in contents:
+        content_hash.update(hashlib.sha256(content).digest())
+    return content_hash.hexdigest()
+
+
+def layer_files_hash(data_path: str, filename: str) -> str:
+    """
+    Hash the style of a layer and the size and modification time of its data file, in the data folder that is
+    deployed to GeoServer. This changes whenever a redeploy would change the map, without fetching it.
+    """
+    data_file_path = path.join(data_path, filename)
+    stat = os.stat(data_file_path)
+    style_hash = hash_file(path.join(data_path, Path(filename).stem + ".sld"))
+    return hashlib.sha256(f"{style_hash}{stat.st_size}{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    """
+    A persistent on-disk cache of finished pages, so a rerun of the report only renders the layers that changed.
+    Every page is stored as a JSON file with the text and a file with the encoded image, both named after the key.
+    The JSON file also records the layer of the page, so the old versions of a layer can be removed.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[PageAssets]:
+        text_path, image_path = self._paths(key)
+        if not path.isfile(text_path) or not path.isfile(image_path):
+            return None
+
+        with open(text_path, "r", encoding="utf-8") as f:
+            text = json.load(f)
+        text.pop("layer", None)
+        with open(image_path, "rb") as f:
+            return PageAssets(image=f.read(), **text)
+
+    def put(self, key: str, page: PageAssets, layer: str) -> None:
+        text_path, image_path = self._paths(key)
+        text = asdict(page)
+        del text["image"]
+        text["layer"] = layer
+        # The image is written first, so a page is never read with a missing or partially written image
+        self._write(image_path, page.image)
+        self._write(text_path, json.dumps(text).encode("utf-8"))
+
+    def prune(self, used_keys: Dict[str, str]) -> int:
+        """
+        Remove the old versions of the pages of the layers in used_keys, which maps the layers to the keys of their
+        current pages. The pages of other layers are kept, such as those of the groups that a run left out.
+        """
+        removed = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            key = entry.name[:-len(".json")]
+            try:
+                with open(entry.path, "r", encoding="utf-8") as f:
+                    layer = json.load(f).get("layer")
+            except (OSError, ValueError):
+                continue
+            if layer in used_keys and used_keys[layer] != key:
+                for file_path in self._paths(key):
+                    if path.isfile(file_path):
+                        os.remove(file_path)
+                removed += 1
+        return removed
+
+    def _paths(self, key: str):
+        return path.join(self.cache_dir, key + ".json"), path.join(self.cache_dir, key + ".img")
+
+    @staticmethod
+    def _write(file_path: str, content: bytes) -> None:
+        temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(content)
+        os.replace(temp_path, file_path)
@@ -0,0 +1,129 @@
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+RGBA = Tuple[int, int, int, int]
+
+# The comparison operators of OGC filters and their OGR SQL equivalent
+COMPARISON_OPERATORS = {
+    "PropertyIsEqualTo": "=",
+    "PropertyIsNotEqualTo": "<>",
+    "PropertyIsLessThan": "<",
+    "PropertyIsLessThanOrEqualTo": "<=",
+    "PropertyIsGreaterThan": ">",
+    "PropertyIsGreaterThanOrEqualTo": ">=",
+}
+
+
+@dataclass
+class ColorMapEntry:
+    quantity: float
+    color: RGBA
+    label: str
+
+
+@dataclass
+class ColorMap:
+    """The colour map of a RasterSymbolizer. The type is ramp, intervals or values, as in GeoServer."""
+    type: str
+    entries: List[ColorMapEntry]
+
+
+@dataclass
+class VectorRule:
+    """A rule of a vector style, with its filter translated to an OGR SQL where clause."""
+    label: str
+    where: Optional[str] = None
+    fill: Optional[RGBA] = None
+    stroke: Optional[RGBA] = None
+    point_size: int = 0  # Points are drawn as squares of this size in pixels
+
+
+@dataclass
+class LayerStyle:
+    color_map: Optional[ColorMap] = None
+    rules: List[VectorRule] = field(default_factory=list)
+
+
+def local_name(element: ET.Element) -> str:
+    """Return the tag without its namespace, so SLD 1.0 and SLD 1.1 (SE) elements are handled alike."""
+    return element.tag.split("}")[-1]
+
+
+def children(element: ET.Element, name: str) -> List[ET.Element]:
+    return [child for child in element.iter() if local_name(child) == name]
+
+
+def parse_color(color: str, opacity: float = 1.0) -> RGBA:
+    color = color.strip().lstrip("#")
+    return int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16), round(opacity * 255)
+
+
+def parse_sld(style_path: str) -> LayerStyle:
+    """Read the colour map of a raster style or the rules of a vector style from an SLD file."""
+    root = ET.parse(style_path).getroot()
+    color_maps = children(root, "ColorMap")
+    if color_maps:
+        return LayerStyle(color_map=parse_color_map(color_maps[0]))
+
+    return LayerStyle(rules=[parse_rule(rule) for rule in children(root, "Rule")])
+
+
+def parse_color_map(element: ET.Element) -> ColorMap:
+    entries = [ColorMapEntry(quantity=float(entry.get("quantity", 0)),
+                             color=parse_color(entry.get("color", "#000000"), float(entry.get("opacity", 1))),
+                             label=entry.get("label") or entry.get("quantity", ""))
+               for entry in children(element, "ColorMapEntry")]
+    return ColorMap(type=element.get("type", "ramp"), entries=sorted(entries, key=lambda e: e.quantity))
+
+
+def parse_rule(element: ET.Element) -> VectorRule:
+    titles = children(element, "Title") or children(element, "Name")
+    rule = VectorRule(label=(titles[0].text or "") if titles else "")
+
+    filters = children(element, "Filter")
+    if filters and len(filters[0]):
+        rule.where = filter_to_where(filters[0][0])
+
+    parameters = {}
+    for parameter in children(element, "CssParameter") + children(element, "SvgParameter"):
+        parameters[parameter.get("name")] = (parameter.text or "").strip()
+
+    if children(element, "PolygonSymbolizer") and "fill" in parameters:
+        rule.fill = parse_color(parameters["fill"], float(parameters.get("fill-opacity", 1)))
+    if children(element, "PointSymbolizer"):
+        sizes = children(element, "Size")
+        rule.point_size = int(float(sizes[0].text)) if sizes else 6
+        rule.fill = parse_color(parameters.get("fill", "#808080"), float(parameters.get("fill-opacity", 1)))
+    if "stroke" in parameters:
+        rule.stroke = parse_color(parameters["stroke"], float(parameters.get("stroke-opacity", 1)))
+
+    return rule
+
+
+def filter_to_where(element: ET.Element) -> Optional[str]:
+    """
+    Translate an OGC filter to an OGR SQL where clause. Only comparisons, And, Or and Not are supported, other
+    filters return None, which selects all features.
+    """
+    name = local_name(element)
+    if name in ("And", "Or"):
+        clauses = [filter_to_where(child) for child in element]
+        if any(clause is None for clause in clauses):
+            return None
+        return "(" + f" {name.upper()} ".join(clauses) + ")"
+    if name == "Not" and len(element):
+        clause = filter_to_where(element[0])
+        return None if clause is None else f"NOT {clause}"
+    if name in COMPARISON_OPERATORS:
+        properties = children(element, "PropertyName")
+        literals = children(element, "Literal")
+        if not properties or not literals:
+            return None
+        value = (literals[0].text or "").strip()
+        try:
+            float(value)
+        except ValueError:
+            value = "'" + value.replace("'", "''") + "'"
+        return f'"{properties[0].text.strip()}" {COMPARISON_OPERATORS[name]} {value}'
+    return None
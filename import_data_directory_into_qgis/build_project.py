@@ -0,0 +1,139 @@
+"""
+Build a QGIS project (.qgz) of the data directory without opening QGIS, so the atlas can be opened as a single
+project file instead of importing every layer with main.py. The styles of the .qml files are stored in the project,
+the layers are collapsed and hidden and the rasters are put in a group.
+When the project exists, only the layers whose data or style file changed since the last build are loaded again.
+
+Run it with the Python of QGIS, for example on Windows in the OSGeo4W shell:
+python-qgis build_project.py <data directory> [--project <path to the .qgz file>]
+"""
+import argparse
+import hashlib
+import os
+import zipfile
+from os import path
+
+from qgis.core import QgsApplication, QgsLayerTreeLayer, QgsProject, QgsRasterLayer, QgsVectorLayer
+
+RASTER_GROUP = "Rasters"
+# Stored with every layer in the project, to find the layer of a file and to see if the file changed
+SOURCE_FILE_PROPERTY = "gaa/source_file"
+FINGERPRINT_PROPERTY = "gaa/fingerprint"
+
+
+def fingerprint(data_path, style_path):
+    """Describe the data file by its size and modification time and the style by its content."""
+    stat = os.stat(data_path)
+    style_hash = ""
+    if path.isfile(style_path):
+        with open(style_path, "rb") as f:
+            style_hash = hashlib.sha256(f.read()).hexdigest()
+    return f"{stat.st_size}|{stat.st_mtime_ns}|{style_hash}"
+
+
+def shapefile_in_zip(zip_path):
+    """Return the path of the .shp file inside the zip. Only the list of files is read, nothing is extracted."""
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        return next(name for name in zip_ref.namelist() if name.lower().endswith(".shp"))
+
+
+def load_layer(data_dir, filename):
+    """Open the raster or the shapefile in the zip of the file and apply its .qml style, if there is one."""
+    data_path = path.join(data_dir, filename)
+    stem = filename.split('.')[0]
+    if filename.endswith(".tif"):
+        layer = QgsRasterLayer(data_path, filename)
+    else:
+        layer = QgsVectorLayer(f"/vsizip/{data_path}/{shapefile_in_zip(data_path)}", stem + ".shp", "ogr")
+
+    if not layer.isValid():
+        raise Exception(f"Layer {filename} failed to load!")
+
+    style_path = path.join(data_dir, stem + ".qml")
+    if path.isfile(style_path):
+        layer.loadNamedStyle(style_path)
+    return layer
+
+
+def sort_layers(group):
+    """
+    Order the layers of the group by name, below its subgroups, by inserting sorted copies of the nodes. The copies
+    are inserted before the original nodes are removed, because the project removes a layer as soon as it has no
+    node left in the layer tree.
+    """
+    nodes = [node for node in group.children() if isinstance(node, QgsLayerTreeLayer)]
+    clones = [node.clone() for node in sorted(nodes, key=lambda node: node.name().lower())]
+    group.insertChildNodes(-1, clones)
+    for node in nodes:
+        group.removeChildNode(node)
+
+
+def build_project(data_dir, project_path):
+    project = QgsProject.instance()
+    if path.isfile(project_path):
+        print(f"Updating {project_path}")
+        project.read(project_path)
+    else:
+        print(f"Creating {project_path}")
+        project.clear()
+
+    root = project.layerTreeRoot()
+    raster_group = root.findGroup(RASTER_GROUP) or root.addGroup(RASTER_GROUP)
+    raster_group.setExpanded(False)
+
+    files = sorted(filename for filename in os.listdir(data_dir) if filename.endswith((".tif", ".zip")))
+    # Layers that were added to the project by hand are left as they are
+    existing = {layer.customProperty(SOURCE_FILE_PROPERTY): layer for layer in project.mapLayers().values()
+                if layer.customProperty(SOURCE_FILE_PROPERTY)}
+    kept, loaded = 0, 0
+
+    for filename in files:
+        stem = filename.split('.')[0]
+        current = fingerprint(path.join(data_dir, filename), path.join(data_dir, stem + ".qml"))
+        layer = existing.pop(filename, None)
+        if layer is not None and layer.customProperty(FINGERPRINT_PROPERTY) == current:
+            kept += 1
+            continue
+        if layer is not None:
+            project.removeMapLayer(layer.id())
+
+        print(filename)
+        layer = load_layer(data_dir, filename)
+        layer.setCustomProperty(SOURCE_FILE_PROPERTY, filename)
+        layer.setCustomProperty(FINGERPRINT_PROPERTY, current)
+        project.addMapLayer(layer, False)
+
+        node = QgsLayerTreeLayer(layer)
+        node.setExpanded(False)
+        node.setItemVisibilityChecked(False)
+        (raster_group if filename.endswith(".tif") else root).addChildNode(node)
+        loaded += 1
+
+    # The files that were removed from the data directory
+    for layer in existing.values():
+        project.removeMapLayer(layer.id())
+
+    # The new layers were added at the end, so the layers are sorted again, with the raster group above the vectors
+    sort_layers(raster_group)
+    sort_layers(root)
+
+    project.write(project_path)
+    print(f"Saved {project_path}: {loaded} layers loaded, {kept} unchanged, {len(existing)} removed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a QGIS project of the data directory")
+    parser.add_argument("data_dir", help="The directory with the .tif rasters, .zip shapefiles and .qml styles")
+    parser.add_argument("--project", help="The project file to create or update, by default atlas.qgz in data_dir")
+    args = parser.parse_args()
+
+    qgs = QgsApplication([], False)
+    qgs.initQgis()
+    try:
+        build_project(args.data_dir, args.project or path.join(args.data_dir, "atlas.qgz"))
+    finally:
+        qgs.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
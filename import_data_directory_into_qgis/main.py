@@ -6,8 +6,16 @@ QgsProject.instance().removeAllMapLayers()
 data_dir = "C:\work\projects\geothermal-atlas-africa\data\gaa"
 root = QgsProject.instance().layerTreeRoot()
 all_files = os.listdir(data_dir)
-all_files.reverse()
 
+
+def shapefile_in_zip(zip_path):
+    """Return the path of the .shp file inside the zip. Only the list of files is read, nothing is extracted."""
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        return next(name for name in zip_ref.namelist() if name.lower().endswith(".shp"))
+
+
+# Open every layer once, before anything is added to the project
+layers = []
 for file in all_files:
     filename = os.fsdecode(file)
     # Handle rasters
@@ -17,32 +25,40 @@ for file in all_files:
         rlayer = QgsRasterLayer(raster_layer, filename)
         if not rlayer.isValid():
             raise Exception(f"Layer {filename} failed to load!")
-        iface.addRasterLayer(raster_layer, filename)
-        layer = QgsProject.instance().mapLayersByName(filename)[0]
-        myLayerNode = root.findLayer(layer.id())
-        myLayerNode.setExpanded(False)
-        myLayerNode.setItemVisibilityChecked(False)
+        layers.append(rlayer)
 
-    # Handle shapefiles (in zip)
+    # Handle shapefiles (in zip), which GDAL reads from the zip directly
     if filename.endswith(".zip"):
         print(filename)
-        unzipped_dir = os.path.join(data_dir, filename.split('.')[0])
-        with zipfile.ZipFile(os.path.join(data_dir, filename), "r") as zip_ref:
-            zip_ref.extractall(unzipped_dir)
-
+        zip_path = os.path.join(data_dir, filename)
         shp_filename = filename.split('.')[0] + ".shp"
-        vector_layer = QgsVectorLayer(os.path.join(unzipped_dir, shp_filename), shp_filename, "ogr")
+        vector_layer = QgsVectorLayer(f"/vsizip/{zip_path}/{shapefile_in_zip(zip_path)}", shp_filename, "ogr")
 
         if not vector_layer.isValid():
             raise Exception(f"Layer {shp_filename} failed to load!")
 
-        QgsProject.instance().addMapLayer(vector_layer)
+        # Add styling
+        style_filename = os.path.join(data_dir, filename.split('.')[0] + ".qml")
+        vector_layer.loadNamedStyle(style_filename)
+        layers.append(vector_layer)
 
-        myLayerNode = root.findLayer(vector_layer.id())
+# Add all layers at once, with the layer tree and the map canvas paused until they are all in
+canvas = iface.mapCanvas()
+layer_tree_view = iface.layerTreeView()
+canvas.freeze(True)
+layer_tree_view.setUpdatesEnabled(False)
+try:
+    QgsProject.instance().addMapLayers(layers, False)
+    nodes = []
+    for layer in layers:
+        myLayerNode = QgsLayerTreeLayer(layer)
         myLayerNode.setExpanded(False)
         myLayerNode.setItemVisibilityChecked(False)
+        nodes.append(myLayerNode)
+    root.insertChildNodes(0, nodes)
+finally:
+    layer_tree_view.setUpdatesEnabled(True)
+    canvas.freeze(False)
+    canvas.refresh()
 
-        # Add styling
-        style_filename = os.path.join(data_dir, filename.split('.')[0] + ".qml")
-        vector_layer.loadNamedStyle(style_filename)
-        vector_layer.triggerRepaint()
+print(f"Added {len(layers)} layers")
@@ -0,0 +1,123 @@
+import math
+import socket
+
+import pytest
+
+from scripts.deploy_data.api_service import ApiService
+from scripts.deploy_data.layer import Layer
+from scripts.deploy_data.mock_services import MockApi
+
+
+def make_layers(count: int, workspace: str = "test") -> list:
+    return [Layer(name=f"layer_{i}", full_name=f"Layer {i}", filename=f"layer_{i}.tif", type="raster", url="",
+                  unit="", workspace=workspace, layer_group="Group", parent_group="Parent", description="",
+                  keywords="", date="2024", restricted="false", resolution="")
+            for i in range(count)]
+
+
+@pytest.fixture
+def api():
+    api = MockApi().start()
+    yield api
+    api.stop()
+
+
+@pytest.mark.parametrize("count", [100, 1000, 10000])
+def test_add_layers_in_batches(api, count):
+    api_service = ApiService(api.url, "token", batch_size=100)
+
+    results = api_service.add_layers(make_layers(count))
+
+    assert all(result.success for result in results)
+    assert len({result.id for result in results}) == count
+    assert len(api.rows) == count
+    assert api.requests == math.ceil(count / 100)
+
+
+def test_add_layers_one_by_one_when_batches_are_not_supported(api):
+    api_service = ApiService(api.url, "token", batch_size=10)
+    api_service.supports_batches = False
+
+    results = api_service.add_layers(make_layers(25))
+
+    assert all(result.success for result in results)
+    assert api.requests == 25
+
+
+def test_add_layer_batch_reports_connection_errors_as_failed_layers():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    api_service = ApiService(f"http://127.0.0.1:{port}", "token", batch_size=10)
+
+    results = api_service.add_layers(make_layers(15))
+
+    assert len(results) == 15
+    assert not any(result.success for result in results)
+
+
+class MockApiWithoutWorkspaceFilter(MockApi):
+    """An API that ignores the workspace parameter when listing the layers."""
+
+    def respond(self, method, url_path, body, query):
+        return super().respond(method, url_path, body, {} if url_path == "/layers" else query)
+
+
+class MockApiWithoutSingleRows(MockApi):
+    """An API that can list the layers, but cannot update or delete a single row."""
+
+    def respond(self, method, url_path, body, query):
+        if url_path.startswith("/layer/"):
+            return 405, {}
+        return super().respond(method, url_path, body, query)
+
+
+def test_sync_layers_leaves_other_workspaces_alone():
+    api = MockApiWithoutWorkspaceFilter().start()
+    try:
+        api_service = ApiService(api.url, "token")
+        api_service.add_layers(make_layers(3, workspace="other"))
+
+        result = api_service.sync_layers("test", make_layers(2))
+
+        assert result.success and result.inserted == 2 and result.deleted == 0
+        assert sorted(row["workspace"] for row in api.rows.values()) == ["other", "other", "other", "test", "test"]
+    finally:
+        api.stop()
+
+
+def test_sync_layers_compares_typed_values(api):
+    api_service = ApiService(api.url, "token")
+    layers = make_layers(2)
+    layers[0].date = "2024-05-01"
+    layers[0].resolution = "250"
+    api_service.add_layers(layers)
+    # The database returns typed values for the strings that were sent
+    for row in api.rows.values():
+        row["restricted"] = False
+        if row["name"] == "layer_0":
+            row["date"] = "2024-05-01T00:00:00.000Z"
+            row["resolution"] = 250.0
+        else:
+            row["date"] = 2024
+
+    result = api_service.sync_layers("test", layers)
+
+    assert result.unchanged == 2 and result.updated == 0
+
+
+def test_sync_layers_replaces_the_rows_when_single_rows_are_not_supported():
+    api = MockApiWithoutSingleRows().start()
+    try:
+        api_service = ApiService(api.url, "token")
+        api_service.add_layers(make_layers(3))
+        layers = make_layers(2)
+        layers[0].description = "Changed"
+
+        result = api_service.sync_layers("test", layers)
+
+        assert result.success and result.inserted == 2
+        assert sorted((row["name"], row["description"]) for row in api.rows.values()) == \
+            [("layer_0", "Changed"), ("layer_1", "")]
+    finally:
+        api.stop()
@@ -0,0 +1,65 @@
+import pytest
+
+# The deploy needs GDAL and the geoserver-rest package, like in the Docker image
+pytest.importorskip("osgeo")
+pytest.importorskip("geo.Geoserver")
+
+from scripts.deploy_data.benchmark import generate_dataset  # noqa: E402
+from scripts.deploy_data.config import DeployConfig  # noqa: E402
+from scripts.deploy_data.main import deploy  # noqa: E402
+from scripts.deploy_data.mock_services import MockApi, MockGeoserver  # noqa: E402
+
+
+@pytest.fixture
+def services():
+    geoserver = MockGeoserver().start()
+    api = MockApi().start()
+    yield geoserver, api
+    geoserver.stop()
+    api.stop()
+
+
+def test_deploy_to_mock_services(services, tmp_path, monkeypatch):
+    geoserver, api = services
+    monkeypatch.chdir(tmp_path)  # The manifests and caches are written relative to the working directory
+    data_path = str(tmp_path / "data")
+    metadata_filename = generate_dataset(data_path, 6, raster_size=32, features=5)
+    config = DeployConfig(geoserver_url=geoserver.url, api_url=api.url, data_path=data_path,
+                          metadata_filename=metadata_filename, workspace="smoke", geoserver_workers=2)
+
+    deploy(config, "admin", "geoserver", "token")
+
+    layer_names = [f"layer_{i:04d}" for i in range(6)]
+    assert {f"smoke/layers/{name}" for name in layer_names} <= geoserver.resources
+    assert sorted(row["name"] for row in api.rows.values()) == layer_names
+    # Rasters and vectors have one SLD each, so only two styles are uploaded
+    assert len([r for r in geoserver.resources if r.startswith("smoke/styles/")]) == 2
+
+    # Nothing changed, so the second deploy writes nothing
+    resources, rows_written = set(geoserver.resources), api.rows_written
+    deploy(config, "admin", "geoserver", "token")
+
+    assert geoserver.resources == resources
+    assert api.rows_written == rows_written
+
+
+def test_deploy_moves_layers_from_their_own_style_to_the_shared_styles(services, tmp_path, monkeypatch):
+    geoserver, api = services
+    monkeypatch.chdir(tmp_path)
+    data_path = str(tmp_path / "data")
+    metadata_filename = generate_dataset(data_path, 4, raster_size=32, features=5)
+    config = DeployConfig(geoserver_url=geoserver.url, api_url=api.url, data_path=data_path,
+                          metadata_filename=metadata_filename, workspace="smoke", geoserver_workers=2)
+    deploy(config, "admin", "geoserver", "token")
+
+    # Deploys from before the styles were shared gave every layer its own <layer>_style
+    layer_names = [f"layer_{i:04d}" for i in range(4)]
+    for name in layer_names:
+        geoserver.resources.add(f"smoke/styles/{name}_style")
+        geoserver.layer_styles[f"smoke/{name}"] = f"{name}_style"
+
+    deploy(config, "admin", "geoserver", "token")
+
+    assert all(geoserver.layer_styles[f"smoke/{name}"].startswith("style_") for name in layer_names)
+    assert not [r for r in geoserver.resources if r.startswith("smoke/styles/") and r.endswith("_style")]
+    assert len([r for r in geoserver.resources if r.startswith("smoke/styles/")]) == 2
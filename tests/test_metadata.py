@@ -0,0 +1,21 @@
+import os
+
+import pandas as pd
+
+from scripts.deploy_data.metadata import read_metadata_table
+
+
+def test_read_metadata_table_keeps_only_the_latest_version_of_a_file(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    first_path, other_path = str(tmp_path / "metadata.xlsx"), str(tmp_path / "other.xlsx")
+    pd.DataFrame({"filename": ["a.tif"]}).to_excel(other_path, index=False)
+    read_metadata_table(other_path, cache_dir)
+
+    for filenames in (["a.tif"], ["a.tif", "b.tif"], ["c.tif"]):
+        pd.DataFrame({"filename": filenames}).to_excel(first_path, index=False)
+        df = read_metadata_table(first_path, cache_dir)
+        assert list(df["filename"]) == filenames
+
+    # One table for each of the two files
+    assert len(os.listdir(cache_dir)) == 2
+    assert list(read_metadata_table(other_path, cache_dir)["filename"]) == ["a.tif"]
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+# The deploy needs GDAL, like in the Docker image
+pytest.importorskip("osgeo")
+
+from scripts.deploy_data import multi_deploy  # noqa: E402
+from scripts.deploy_data.config import DeployConfig  # noqa: E402
+from scripts.deploy_data.multi_deploy import DeployTarget, deploy_targets, load_targets  # noqa: E402
+
+
+class FakeDeploy:
+    """Records how many deploys run at the same time, in total and per GeoServer."""
+
+    def __init__(self, seconds: float = 0.1, failing_workspaces=()):
+        self.seconds = seconds
+        self.failing_workspaces = set(failing_workspaces)
+        self.running = {}
+        self.max_running = 0
+        self.max_running_per_geoserver = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, config, geoserver_username, geoserver_password, api_token, shared_inputs):
+        with self.lock:
+            self.running[config.geoserver_url] = self.running.get(config.geoserver_url, 0) + 1
+            self.max_running = max(self.max_running, sum(self.running.values()))
+            self.max_running_per_geoserver = max(self.max_running_per_geoserver, self.running[config.geoserver_url])
+        time.sleep(self.seconds)
+        with self.lock:
+            self.running[config.geoserver_url] -= 1
+        if config.workspace in self.failing_workspaces:
+            raise RuntimeError(f"{config.workspace} failed")
+
+
+def make_targets(*geoserver_urls: str):
+    return [DeployTarget(f"target-{i}", DeployConfig(geoserver_url=url, api_url="http://api", data_path="data",
+                                                     metadata_filename="metadata.xlsx", workspace=f"ws-{i}"))
+            for i, url in enumerate(geoserver_urls)]
+
+
+def test_deploy_targets_caps_the_targets_in_total(monkeypatch):
+    fake_deploy = FakeDeploy()
+    monkeypatch.setattr(multi_deploy, "deploy", fake_deploy)
+
+    results = deploy_targets(make_targets("http://a", "http://b", "http://c", "http://d"), "admin", "geoserver",
+                             "token", max_concurrent_targets=2)
+
+    assert [result.success for result in results] == [True] * 4
+    assert fake_deploy.max_running == 2
+
+
+def test_deploy_targets_caps_the_targets_per_geoserver_without_counting_the_wait(monkeypatch):
+    fake_deploy = FakeDeploy(seconds=0.2)
+    monkeypatch.setattr(multi_deploy, "deploy", fake_deploy)
+
+    results = deploy_targets(make_targets("http://a", "http://a"), "admin", "geoserver", "token",
+                             max_concurrent_targets=2, max_targets_per_geoserver=1)
+
+    assert fake_deploy.max_running_per_geoserver == 1
+    assert all(result.seconds < 0.35 for result in results)
+    assert max(result.waited_seconds for result in results) >= 0.15
+
+
+def test_deploy_targets_reports_failed_targets(monkeypatch):
+    monkeypatch.setattr(multi_deploy, "deploy", FakeDeploy(failing_workspaces=["ws-1"]))
+
+    results = deploy_targets(make_targets("http://a", "http://b"), "admin", "geoserver", "token")
+
+    assert [(result.name, result.success, result.error) for result in results] == \
+        [("target-0", True, ""), ("target-1", False, "ws-1 failed")]
+
+
+def test_load_targets_applies_the_defaults_and_names_the_files_after_the_target(tmp_path, monkeypatch):
+    monkeypatch.setenv("GEOSERVER_URL", "http://geoserver")
+    config_path = tmp_path / "targets.yaml"
+    config_path.write_text("""
+max_concurrent_targets: 3
+defaults:
+  geoserver_url: ${GEOSERVER_URL}
+  api_url: http://api
+  data_path: data
+  geoserver_workers: 2
+targets:
+  - name: dev
+    workspace: gaa
+    metadata_filename: gaa.xlsx
+  - name: prod
+    workspace: gaa
+    metadata_filename: gaa.xlsx
+    geoserver_url: http://other
+""")
+
+    targets, settings = load_targets(str(config_path))
+
+    assert settings == {"max_concurrent_targets": 3}
+    assert [(target.name, target.config.geoserver_url, target.config.geoserver_workers) for target in targets] == \
+        [("dev", "http://geoserver", 2), ("prod", "http://other", 2)]
+    # Both targets deploy the workspace gaa, so their manifests and traces must not be the same files
+    assert targets[0].config.manifest_path != targets[1].config.manifest_path
+    assert targets[0].config.trace_path != targets[1].config.trace_path
+
+
+def test_load_targets_rejects_unknown_settings_and_duplicate_names(tmp_path):
+    config_path = tmp_path / "targets.yaml"
+    config_path.write_text("targets:\n  - {name: a, workspace: a, colour: red}\n")
+    with pytest.raises(ValueError, match="unknown settings: colour"):
+        load_targets(str(config_path))
+
+    config_path.write_text("defaults: {geoserver_url: g, api_url: a, data_path: d, metadata_filename: m.xlsx}\n"
+                           "targets:\n  - {name: a, workspace: a}\n  - {name: a, workspace: b}\n")
+    with pytest.raises(ValueError, match="not unique: a"):
+        load_targets(str(config_path))
@@ -0,0 +1,99 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from scripts.generate_maps_report_document import main
+from scripts.generate_maps_report_document.image_fetcher import LayerImages
+from scripts.generate_maps_report_document.main import ReportSettings, build_pages
+from scripts.generate_maps_report_document.page_cache import PageAssets, PageCache
+
+
+def png(color: str) -> bytes:
+    image = BytesIO()
+    Image.new("RGBA", (8, 8), color).save(image, "PNG")
+    return image.getvalue()
+
+
+class FakeImageFetcher:
+    """Returns the same images for every layer and records which layers were fetched."""
+    fetched = []
+
+    def __init__(self, bbox, max_workers=8, cache=None):
+        pass
+
+    def fetch_all(self, filenames):
+        FakeImageFetcher.fetched += filenames
+        return {filename: LayerImages(map=png("red"), basemap=png("white"), legend=png("black"))
+                for filename in filenames}
+
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "ImageFetcher", FakeImageFetcher)
+    FakeImageFetcher.fetched = []
+    # With the data folder, the page keys come from the layer files, so cached pages are not fetched at all
+    data_path = tmp_path / "data"
+    data_path.mkdir()
+    for name in ["a", "b"]:
+        (data_path / f"{name}.tif").write_bytes(name.encode("utf-8"))
+        (data_path / f"{name}.sld").write_text(f"<StyledLayerDescriptor>{name}</StyledLayerDescriptor>")
+    return ReportSettings(bbox="-45,-25,40,60", image_format="PNG", image_quality=85, image_dpi=72, renderer="wms",
+                          data_path=str(data_path), basemap_path=None, offline=False, fetch_threads=2,
+                          render_processes=1)
+
+
+def make_rows(*filenames: str) -> dict:
+    return {filename: {"filename": filename, "full_name": filename, "description": "", "keywords": "",
+                       "source": None, "date": "", "coverage": "", "resolution": ""} for filename in filenames}
+
+
+def page(name: str) -> PageAssets:
+    return PageAssets(full_name=name, paragraphs=[], source=None, closing_paragraphs=[], image=png("red"))
+
+
+def test_build_pages_reuses_the_cached_pages(settings):
+    first_pages, first_keys = build_pages(make_rows("a.tif", "b.tif"), settings)
+    second_pages, second_keys = build_pages(make_rows("a.tif", "b.tif"), settings)
+
+    assert FakeImageFetcher.fetched == ["a.tif", "b.tif"]
+    assert second_keys == first_keys
+    assert second_pages == first_pages
+
+
+def test_build_pages_only_fetches_the_changed_layers_again(settings, tmp_path):
+    _, first_keys = build_pages(make_rows("a.tif", "b.tif"), settings)
+    (tmp_path / "data" / "a.sld").write_text("<StyledLayerDescriptor>changed</StyledLayerDescriptor>")
+    _, second_keys = build_pages(make_rows("a.tif", "b.tif"), settings)
+
+    assert FakeImageFetcher.fetched == ["a.tif", "b.tif", "a.tif"]
+    assert second_keys["a.tif"] != first_keys["a.tif"]
+    assert second_keys["b.tif"] == first_keys["b.tif"]
+
+
+def test_prune_keeps_the_pages_of_layers_that_a_run_left_out(tmp_path):
+    page_cache = PageCache(str(tmp_path))
+    # The first run includes the layers a and b, the second run is filtered to c
+    page_cache.put("key_a", page("a"), "a.tif")
+    page_cache.put("key_b", page("b"), "b.tif")
+    page_cache.prune({"a.tif": "key_a", "b.tif": "key_b"})
+    page_cache.put("key_c", page("c"), "c.tif")
+    page_cache.prune({"c.tif": "key_c"})
+
+    assert page_cache.get("key_a") == page("a")
+    assert page_cache.get("key_b") == page("b")
+    assert page_cache.get("key_c") == page("c")
+
+
+def test_prune_removes_the_old_versions_of_changed_layers(tmp_path):
+    page_cache = PageCache(str(tmp_path))
+    page_cache.put("key_a", page("a"), "a.tif")
+    page_cache.put("key_b", page("b"), "b.tif")
+    page_cache.put("key_a2", page("a2"), "a.tif")
+
+    assert page_cache.prune({"a.tif": "key_a2"}) == 1
+
+    assert page_cache.get("key_a") is None
+    assert page_cache.get("key_a2") == page("a2")
+    assert page_cache.get("key_b") == page("b")
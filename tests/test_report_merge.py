@@ -0,0 +1,62 @@
+from io import BytesIO
+
+import pandas as pd
+from docx import Document
+from PIL import Image
+
+from scripts.generate_maps_report_document.main import (add_hyperlink, add_paragraph, make_shards, merge_documents,
+                                                        new_document)
+
+
+def make_document(document_path: str, name: str, color: str, image_format: str) -> None:
+    doc = new_document()
+    for i in range(2):
+        if i != 0:
+            doc.add_page_break()
+        add_hyperlink(add_paragraph(doc, f"{name} page {i} source: "), "link", f"https://example.com/{name}/{i}")
+        image = BytesIO()
+        Image.new("RGB", (20, 20), color).save(image, image_format)
+        doc.add_picture(image)
+    doc.save(document_path)
+
+
+def test_merge_documents_keeps_the_pages_images_and_links(tmp_path):
+    document_paths = [str(tmp_path / f"shard_{i}.docx") for i in range(3)]
+    for document_path, name, color, image_format in zip(document_paths, ["a", "b", "c"], ["red", "green", "blue"],
+                                                        ["PNG", "PNG", "JPEG"]):
+        make_document(document_path, name, color, image_format)
+
+    merge_documents(document_paths, str(tmp_path / "merged.docx"))
+
+    merged = Document(str(tmp_path / "merged.docx"))
+    assert [p.text for p in merged.paragraphs if p.text] == [f"{name} page {i} source: link"
+                                                              for name in ["a", "b", "c"] for i in range(2)]
+    images = [merged.part.related_parts[shape._inline.graphic.graphicData.pic.blipFill.blip.embed].blob
+              for shape in merged.inline_shapes]
+    assert [Image.open(BytesIO(image)).getpixel((0, 0))[:2] for image in images] == \
+        [(255, 0), (255, 0), (0, 128), (0, 128), (0, 0), (0, 0)]
+    assert [rel.target_ref for rel in merged.part.rels.values() if rel.is_external] == \
+        [f"https://example.com/{name}/{i}" for name in ["a", "b", "c"] for i in range(2)]
+
+
+def test_merge_documents_puts_the_pages_in_the_given_order(tmp_path):
+    document_paths = [str(tmp_path / f"shard_{i}.docx") for i in range(2)]
+    for document_path, name, color in zip(document_paths, ["a", "b"], ["red", "green"]):
+        make_document(document_path, name, color, "PNG")
+
+    merge_documents(document_paths, str(tmp_path / "merged.docx"), [(1, 0), (0, 0), (1, 1), (0, 1)])
+
+    merged = Document(str(tmp_path / "merged.docx"))
+    assert [p.text for p in merged.paragraphs if p.text] == ["b page 0 source: link", "a page 0 source: link",
+                                                              "b page 1 source: link", "a page 1 source: link"]
+    assert len(merged.inline_shapes) == 4
+
+
+def test_make_shards_by_group_keeps_rows_without_a_parent_group():
+    df = pd.DataFrame({"parent_group": ["Energy", None, "Climate", "Energy"],
+                       "full_name": ["A", "B", "C", "D"]})
+
+    shards = make_shards(df, "group", 25)
+
+    assert [(name, list(rows["full_name"])) for name, rows in shards] == \
+        [("Climate", ["C"]), ("Energy", ["A", "D"]), ("no_parent_group", ["B"])]
@@ -0,0 +1,40 @@
+import pytest
+
+from scripts.deploy_data.mock_services import MockGeoserver
+from scripts.deploy_data.tile_seeder import AFRICA_BBOX, TileSeeder, expected_tiles
+
+
+@pytest.fixture
+def geoserver():
+    geoserver = MockGeoserver(seed_tiles_per_poll=7).start()
+    geoserver.resources.update({"test", "test/layers/faults", "test/layers/heat_flow", "other/layers/roads"})
+    yield geoserver
+    geoserver.stop()
+
+
+def test_expected_tiles():
+    assert expected_tiles("EPSG:4326", AFRICA_BBOX, (0, 0)) == 2
+    assert expected_tiles("EPSG:4326", (-180.0, -90.0, 180.0, 90.0), (0, 2)) == 2 + 8 + 32
+    assert expected_tiles("EPSG:900913", (-180.0, -85.0, 180.0, 85.0), (0, 1)) == 1 + 4
+    assert expected_tiles("custom", AFRICA_BBOX, (0, 6)) == 0
+
+
+def test_seed_all_layers_of_the_workspace(geoserver):
+    seeder = TileSeeder(geoserver.url, "admin", "geoserver", poll_interval=0)
+
+    results = seeder.seed_layers("test", (0, 4))
+
+    assert [result.layer_name for result in results] == ["faults", "heat_flow"]
+    assert all(result.success for result in results)
+    assert all(result.tiles == expected_tiles("EPSG:4326", AFRICA_BBOX, (0, 4)) for result in results)
+    assert geoserver.seeded_tiles == sum(result.tiles for result in results)
+
+
+def test_seed_that_finishes_before_the_first_poll_counts_all_tiles(geoserver):
+    geoserver.seed_tiles_per_poll = 1000000
+    seeder = TileSeeder(geoserver.url, "admin", "geoserver", poll_interval=0)
+
+    results = seeder.seed_layers("test", (0, 3), ["faults"])
+
+    assert results[0].success
+    assert results[0].tiles == expected_tiles("EPSG:4326", AFRICA_BBOX, (0, 3))